@@ -5,7 +5,11 @@ import matplotlib.pylab as plt
 #%matplotlib inline
 import random as rnd
 rnd.seed()
-import copy
+
+from results import SimulationResult
+from checkpoint import label_array, label_list, set_random_state
+from profiler import NULL
+from state_buffer import StateBuffer
 
 class SIR():
     def drawGz(self,G,z):
@@ -43,18 +47,29 @@ class SIR():
 
         return
 
-    def SIR_Simulation(self,G,beta,gamma):
+    def SIR_Simulation(self,G,beta,gamma,headless=False,observers=None,snapshots=False,profiler=None,checkpoint=None,tmax=None,steady=None):
         # This function simulates a SIR model based on network G with beta and alpha
         #
         # input  : G is a networkx graph
         #        : beta, infection rate per S-I contact
         #        : gamma, I->R recovery rate
-        # output : none
+        #        : headless, skip all printing, drawing and plotting
+        #        : observers, objects whose observe(t,z) is called every time step,
+        #          e.g. visualize.GraphDrawer
+        #        : snapshots, keep a copy of the node states of every time step
+        #        : profiler, a profiler.Profiler timing the phases of every step
+        #        : checkpoint, a checkpoint.Checkpointer; the run resumes from its file
+        #          when there is one and saves its state whenever checkpoint.due(t)
+        #        : tmax, last time step (None runs until no node is infected)
+        #        : steady, a steady_state.SteadyState that also stops the run once the
+        #          counts stop changing
+        # output : SimulationResult with the S(t),I(t),R(t) time series
         # 
         # WARNING: function is optimistic: assumes inputs are properly formatted
 
         n  = G.order()
-        zt = dict.fromkeys(range(n), 'S') # all nodes S, initially
+        zb = StateBuffer(n, 'S') # current and next node states, preallocated
+        zt = zb.cur              # all nodes S, initially
 
         St = [] # S(t), time series of number of S nodes per time step t
         It = [] # I(t), time series of number of I nodes per time step t
@@ -62,46 +77,104 @@ class SIR():
 
         seed     = int(rnd.randint(0,n-1)) # pick a random node is patient 0
         zt[seed] = 'I'
+        zt, zu   = zb.sync()
         t        = 1
 
-        print(f'time step {t}')
-        self.drawGz(G,zt)
-
         Sc,Ic,Rc = n-1,1,0 # S,I,R node counts, initial
         St.append(Sc)
         It.append(Ic)
         Rt.append(Rc)
-        while any(xi == 'I' for xi in zt.values()):
-            zu = copy.deepcopy(zt) # nodes states for next time step (synchronous updates)
+        Zt = [list(zt)] if snapshots else None # node states per time step t
+
+        if checkpoint is not None and checkpoint.exists():
+            # resume: states, counts, series and random state of the saved time step
+            ck       = checkpoint.load()
+            zt[:]    = label_list(ck['z'])
+            zt, zu   = zb.sync()
+            t        = ck['t']
+            Sc,Ic,Rc = ck['counts']
+            St,It,Rt = [ck['series'][k].tolist() for k in 'SIR']
+            if snapshots:
+                Zt = [label_list(z) for z in ck['series']['Z']]
+            set_random_state(rnd, ck['random'])
+
+        observers = observers or []
+        if not headless:
+            print(f'time step {t}')
+            self.drawGz(G,zt)
+        for obs in observers:
+            obs.observe(t,zt)
+
+        prof = profiler if profiler is not None else NULL # NULL: every hook is a no-op
+        m    = G.number_of_edges() if prof.enabled else 0
+        stop = 'steady' if steady is not None and steady.start(n, np.column_stack([St,It,Rt])) else None
+        while stop is None and Ic > 0 and (tmax is None or t < tmax): # Ic counts the I nodes of zt
 
             # do S -> I transitions
+            t0 = prof.clock()
+            Sb,Ib,draws = Sc,Ic,0 # counts before the step, coin flips
             for e in G.edges():
                 i,j = e[0],e[1]           # this edge (i,j)
                 if zt[i]=='I' and zt[j]=='S' and zu[j]!='I':
+                    draws = draws+1
                     if rnd.random() < beta:
                         zu[j] = 'I'       # i infects j for next round
                         Sc,Ic = Sc-1,Ic+1 # update counts
 
                 if zt[i]=='S' and zt[j]=='I' and zu[i]!='I':
+                    draws = draws+1
                     if rnd.random() < beta:
                         zu[i] = 'I'       # j infects i for next round
                         Sc,Ic = Sc-1,Ic+1 # update counts
 
+            prof.add('infection', t0)
+            prof.count('edges_examined', m)
+            prof.count('transmissions', Sb-Sc)
+            prof.count('rng_draws', draws)
+
             # do I -> R transitions
+            t0 = prof.clock()
             for i in G.nodes():
                 if zt[i] == 'I' and rnd.random() < gamma:
                     zu[i] = 'R'           # i recovers (R)
                     Ic,Rc = Ic-1,Rc+1     # update counts
+            prof.add('recovery', t0)
+            prof.count('rng_draws', Ib) # one coin per I node
 
             # update all states synchronously, update clock
-            zt = copy.deepcopy(zu)
+            t0 = prof.clock()
+            zt, zu = zb.swap() # zu is re-synced in place, ready for the next step
             t  = t+1
-            print(f'time step {t}')
-            self.drawGz(G,zt)
+            prof.add('swap', t0)
+            t0 = prof.clock()
+            if not headless:
+                print(f'time step {t}')
+                self.drawGz(G,zt)
+            prof.add('draw', t0)
+            t0 = prof.clock()
+            for obs in observers:
+                obs.observe(t,zt)
+            prof.add('observe', t0)
 
             St.append(Sc)
             It.append(Ic)
             Rt.append(Rc) # append these counts to the time series
+            if snapshots:
+                Zt.append(list(zt))
+            if checkpoint is not None and checkpoint.due(t):
+                series = {'S' : np.array(St), 'I' : np.array(It), 'R' : np.array(Rt)}
+                if snapshots:
+                    series['Z'] = np.array([label_array(z) for z in Zt])
+                checkpoint.save({'t' : t, 'z' : label_array(zt), 'counts' : [Sc,Ic,Rc],
+                                 'series' : series, 'random' : rnd.getstate()})
+            prof.end_step(t-1)
+            if steady is not None and steady.update((Sc,Ic,Rc)):
+                stop = 'steady'
+
+        stop   = stop or ('horizon' if Ic > 0 else 'extinct')
+        result = SimulationResult(St,It,Rt,snapshots=Zt,stop=stop)
+        if headless:
+            return result
 
         # report how it went
         print(f'number of steps in epidemic: {t-1}')
@@ -117,4 +190,6 @@ class SIR():
         plt.ylabel('number of nodes')
         plt.xlabel('time, t')
         plt.legend(loc='upper right');
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+        return result
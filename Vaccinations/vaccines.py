@@ -4,7 +4,15 @@ import matplotlib
 import matplotlib.pylab as plt
 import random as rnd
 rnd.seed()
-import copy
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # shared modules live in the repository root
+
+from results import SimulationResult
+from checkpoint import label_array, label_list, set_random_state
+from profiler import NULL
+from state_buffer import StateBuffer
+from vaccination import VaccinationScheduler, WeeklyRelease
 
 class SIR():
     
@@ -45,20 +53,30 @@ class SIR():
 
         return
 
-    def SIR_Simulation(self,G,beta,gamma, group):
+    def SIR_Simulation(self,G,beta,gamma, group,headless=False,observers=None,snapshots=False,profiler=None,checkpoint=None,tmax=30,steady=None):
         # This function simulates a SIR model based on network G with beta and alpha
         #
         # input  : G is a networkx graph
         #        : beta, infection rate per S-I contact
         #        : gamma, I->R recovery rate
-        # output : none
+        #        : group, vaccine release size
+        #        : headless, skip all printing, drawing and plotting
+        #        : observers, objects whose observe(t,z) is called every time step,
+        #          e.g. visualize.GraphDrawer
+        #        : snapshots, keep a copy of the node states of every time step
+        #        : profiler, a profiler.Profiler timing the phases of every step
+        #        : checkpoint, a checkpoint.Checkpointer; the run resumes from its file
+        #          when there is one and saves its state whenever checkpoint.due(t)
+        #        : tmax, last time step, 30 days by default (None for no limit)
+        #        : steady, a steady_state.SteadyState that also stops the run once the
+        #          counts stop changing
+        # output : SimulationResult with the S(t),I(t),R(t),V(t) time series
         # 
         # WARNING: function is optimistic: assumes inputs are properly formatted
 
         n  = G.order()
-        zt = dict.fromkeys(range(n), 'S') # all nodes S, initially
-        #vz is a dictionary containing three labels, 0,1,2 representing no vaccines, 1-dose, 2-dose
-        vz = dict.fromkeys(range(n), 0) #all nodes 0 vaccine dosage, initially
+        zb = StateBuffer(n, 'S') # current and next node states, preallocated
+        zt = zb.cur              # all nodes S, initially
 
         St = [] # S(t), time series of number of S nodes per time step t
         It = [] # I(t), time series of number of I nodes per time step t
@@ -67,75 +85,127 @@ class SIR():
 
         seed     = int(rnd.randint(0,n-1)) # pick a random node is patient 0
         zt[seed] = 'I'
+        zt, zu   = zb.sync()
         t        = 1 #t is in the scale of day
         v_dict = {1 : 0.85, 2 : 0.9} #possibility of S -> V
+        # vaccine doses per node (0,1,2), released every 7 days, more from day 20 on
+        vs   = VaccinationScheduler(n, WeeklyRelease(group, interval=7, ramp_day=20), v_dict)
+        vrng = np.random.default_rng(rnd.getrandbits(64)) # dose draws, seeded from rnd
 
-        print(f'time step {t}')
-        self.drawGz(G,zt, t)
 
         Sc,Ic,Rc, Vc = n-1,1,0,0 # S,I,R,V node counts, initial
         St.append(Sc)
         It.append(Ic)
         Rt.append(Rc)
         Vt.append(Vc)
+        Zt = [list(zt)] if snapshots else None # node states per time step t
+
+        if checkpoint is not None and checkpoint.exists():
+            # resume: states, counts, series, doses and random states of the saved time step
+            ck          = checkpoint.load()
+            zt[:]       = label_list(ck['z'])
+            zt, zu      = zb.sync()
+            t           = ck['t']
+            Sc,Ic,Rc,Vc = ck['counts']
+            St,It,Rt,Vt = [ck['series'][k].tolist() for k in 'SIRV']
+            if snapshots:
+                Zt = [label_list(z) for z in ck['series']['Z']]
+            vs.restore(ck['doses'])
+            set_random_state(rnd, ck['random'])
+            vrng.bit_generator.state = ck['vrng']
+
+        observers = observers or []
+        if not headless:
+            print(f'time step {t}')
+            self.drawGz(G,zt, t)
+        for obs in observers:
+            obs.observe(t,zt)
+
      
-        while any(xi < 2 for xi in vz.values()):
-            zu = copy.deepcopy(zt) # nodes states for next time step (synchronous updates)
+        prof = profiler if profiler is not None else NULL # NULL: every hook is a no-op
+        m    = G.number_of_edges() if prof.enabled else 0
+        stop = 'steady' if steady is not None and steady.start(n, np.column_stack([St,It,Rt,Vt])) else None
+        # until nobody is infected and no dose is left to hand out
+        while stop is None and (Ic > 0 or not vs.exhausted(t)) and (tmax is None or t < tmax):
             
-            # do S/I/R -> V transitions
-            if t >= 7 and t%7 == 0:
-                # number of nodes that will get 1 dose of vaccine:
-                vac = int(group * rnd.uniform(1, 2))
-                # after a number of time, more vaccines will be provided
-                if t >= 20:
-                    vac = int(group * rnd.uniform(2, 4))
-                    
-                # which node will get the vaccine
-                v_key = [k for k,h in vz.items() if h < 2]
-                
-                for i in range(vac):
-                    v_ch = rnd.choice(v_key) 
-                    vz[v_ch] += 1 #node's vaccine dosage status 0,1,2
-                    v_key.remove(v_ch) #one person can only get one vaccine per month
-                    v_pr = vz[v_ch] # get the current possibily of vaccination from v_dict
-                    if rnd.random() < v_dict[v_pr]:
-                        zu[v_ch] = 'V'           # S -> V
-                        Vc = Vc+1     # update counts
+            # do S/I/R -> V transitions, at most one dose per node per release
+            t0 = prof.clock()
+            v_ch, v_ok = vs.release(t, vrng)
+            for i in v_ok.tolist():
+                zu[i] = 'V'   # S -> V
+                Vc = Vc+1     # update counts
+            prof.add('vaccination', t0)
+            prof.count('doses', len(v_ch))
+            prof.count('rng_draws', len(v_ch))
                         
             # do S -> I transitions
+            t0 = prof.clock()
+            Sb,Ib,draws = Sc,Ic,0 # counts before the step, coin flips
             for e in G.edges():
                 i,j = e[0],e[1]           # this edge (i,j)
                 if zt[i]=='I' and zt[j]=='S' and zu[j]!='I':
+                    draws = draws+1
                     if rnd.random() < beta:
                         zu[j] = 'I'       # i infects j for next round
                         Sc,Ic = Sc-1,Ic+1 # update counts
 
                 if zt[i]=='S' and zt[j]=='I' and zu[i]!='I':
+                    draws = draws+1
                     if rnd.random() < beta:
                         zu[i] = 'I'       # j infects i for next round
                         Sc,Ic = Sc-1,Ic+1 # update counts
 
+            prof.add('infection', t0)
+            prof.count('edges_examined', m)
+            prof.count('transmissions', Sb-Sc)
+            prof.count('rng_draws', draws)
+
             # do I -> R transitions
+            t0 = prof.clock()
             for i in G.nodes():
                 if zt[i] == 'I' and rnd.random() < gamma:
                     zu[i] = 'R'           # i recovers (R)
                     Ic,Rc = Ic-1,Rc+1     # update counts
+            prof.add('recovery', t0)
+            prof.count('rng_draws', Ib) # one coin per I node
                                         
                         
             # update all states synchronously, update clock
-            zt = copy.deepcopy(zu)
+            t0 = prof.clock()
+            zt, zu = zb.swap() # zu is re-synced in place, ready for the next step
             t  = t+1
-            print(f'time step {t}')
-            self.drawGz(G,zt, t)
+            prof.add('swap', t0)
+            t0 = prof.clock()
+            if not headless:
+                print(f'time step {t}')
+                self.drawGz(G,zt, t)
+            prof.add('draw', t0)
+            t0 = prof.clock()
+            for obs in observers:
+                obs.observe(t,zt)
+            prof.add('observe', t0)
 
             St.append(Sc)
             It.append(Ic)
             Rt.append(Rc) 
             Vt.append(Vc)# append these counts to the time series
+            if snapshots:
+                Zt.append(list(zt))
+            prof.end_step(t-1)
+            if steady is not None and steady.update((Sc,Ic,Rc,Vc)):
+                stop = 'steady'
+            if checkpoint is not None and checkpoint.due(t):
+                series = {'S' : np.array(St), 'I' : np.array(It), 'R' : np.array(Rt), 'V' : np.array(Vt)}
+                if snapshots:
+                    series['Z'] = np.array([label_array(z) for z in Zt])
+                checkpoint.save({'t' : t, 'z' : label_array(zt), 'counts' : [Sc,Ic,Rc,Vc], 'series' : series,
+                                 'doses' : vs.state(), 'random' : rnd.getstate(), 'vrng' : vrng.bit_generator.state})
             
-            if t>= 30:
-                break
-            
+
+        stop   = stop or ('horizon' if Ic > 0 or not vs.exhausted(t) else 'extinct')
+        result = SimulationResult(St,It,Rt,Vt,snapshots=Zt,stop=stop)
+        if headless:
+            return result
 
         print(f'number of steps in epidemic: {t-1}')
         print(f'final number of S: {Sc}')
@@ -171,6 +241,8 @@ class SIR():
         # plt.savefig('standard_interval_75_80_relaxed')
         # plt.savefig('standard_interval_90_95_relaxed')
 
+        return result
+
 
 def connected_caveman_random_partition_graph():
     G = nx.connected_caveman_graph(6,6)
@@ -199,14 +271,15 @@ def relaxed_caveman_random_partition_graph():
     return G
 
 
-class Main():
+def main():
 
     # G = connected_caveman_random_partition_graph()
-    # SIR = SIR()
-    # SIR.SIR_Simulation(G, beta = 0.6, gamma = 0.3, group = 6)
+    # sim = SIR()
+    # sim.SIR_Simulation(G, beta = 0.6, gamma = 0.3, group = 6)
     
     G = relaxed_caveman_random_partition_graph()
-    SIR = SIR()
-    SIR.SIR_Simulation(G,beta = 0.6,gamma = 0.3, group = 6)
+    sim = SIR()
+    sim.SIR_Simulation(G,beta = 0.6,gamma = 0.3, group = 6)
 
-Main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import numpy as np
+
+from csr_engine import CSRGraph, S, I, R
+from kernels import spans
+
+
+class BatchedEngine():
+    # R independent SIR/SIRS replicates on the same graph, advanced together.
+    #
+    # The states are one int8 matrix stored node-major, z[node, replicate], so the
+    # replicate states of a neighbour are a single contiguous row; states gives the
+    # (R x N) replicate-major view of the same memory. Each transition type draws
+    # the randomness of every replicate in one call.
+    #
+    # The dense S->I pass walks the adjacency in ELL order: nodes sorted by degree,
+    # so the j-th neighbour of every node of degree > j is one gather of contiguous
+    # rows added to a prefix of the count matrix, a SIMD-friendly pass over all
+    # replicates at once. While few (node, replicate) pairs are infected the
+    # frontier pass gathers only their neighbourhoods instead, as in CSREngine.
+
+    def __init__(self, G, beta, gamma, replicates, sigma=0.0, rng=None):
+        # input  : G is a networkx graph or a CSRGraph
+        #        : beta, gamma, sigma, per-step probabilities as in CSREngine
+        #        : replicates, number of realizations R
+        #        : rng, numpy Generator or seed
+
+        self.csr   = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+        self.beta  = beta
+        self.gamma = gamma
+        self.sigma = sigma
+        self.reps  = replicates
+        self.rng   = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+        n = self.csr.n
+        self.z      = np.zeros((n, replicates), dtype=np.int8) # all nodes S, initially
+        self.counts = np.zeros((replicates, 4), dtype=np.int64)
+        self.counts[:, S] = n
+        self.t      = 1
+        self.active = np.ones(replicates, dtype=bool) # replicates still being advanced
+
+        # infected and (for SIRS) recovered (node, replicate) pairs, as flat
+        # indices node * R + replicate into z
+        self.infected  = np.zeros(0, dtype=np.int64)
+        self.recovered = np.zeros(0, dtype=np.int64)
+
+        # ELL layout: ell[j] holds the j-th neighbour of the nodes order[:len(ell[j])]
+        deg        = self.csr.degree()
+        self.deg   = deg
+        self.work  = 0 # adjacency entries of the infected pairs, what the frontier pass gathers
+        self.order = np.argsort(-deg, kind='stable')
+        sdeg       = deg[self.order]
+        width      = np.searchsorted(-sdeg, -np.arange(sdeg[0] if n else 0), side='left')
+        first      = self.csr.indptr[self.order]
+        self.ell   = [self.csr.indices[first[:w] + j] for j, w in enumerate(width)]
+        self.ktype = np.uint8 if len(self.ell) < 2**8 else np.int16 if len(self.ell) < 2**15 else np.int32
+        self.escape = (1.0 - beta) ** np.arange(len(self.ell) + 1) # (1-beta)^k for every possible k
+
+    @property
+    def states(self):
+        # (R x N) view of the state matrix, row r is replicate r
+        return self.z.T
+
+    def seed_infection(self, nodes=None):
+        # This function makes patient 0 of every replicate
+        #
+        # input  : nodes, one node per replicate (random when None)
+        if nodes is None:
+            nodes = self.rng.integers(self.csr.n, size=self.reps)
+        flat  = np.asarray(nodes, dtype=np.int64) * self.reps + np.arange(self.reps)
+        flat  = flat[self.z.ravel()[flat] == S]
+        self.z.ravel()[flat] = I
+        self.infected = np.concatenate([self.infected, flat])
+        self.work    += self.deg[flat // self.reps].sum()
+        fresh = np.bincount(flat % self.reps, minlength=self.reps)
+        self.counts[:, S] -= fresh
+        self.counts[:, I] += fresh
+
+    def _pressure_dense(self):
+        # infected-neighbour counts of all (node, replicate) pairs, one ELL pass
+        infected = (self.z == I).view(np.uint8)
+        K = np.zeros(self.z.shape, dtype=self.ktype)
+        for col in self.ell:
+            # take copies whole rows, about twice as fast as fancy indexing here
+            np.add(K[:len(col)], np.take(infected, col, axis=0), out=K[:len(col)])
+        k = np.empty_like(K)
+        k[self.order] = K
+        k = k.ravel()
+        cand = np.flatnonzero(np.logical_and(k, self.z.ravel() == S))
+        if not self.active.all():
+            cand = cand[self.active[cand % self.reps]]
+        return cand, k[cand]
+
+    def _pressure_frontier(self):
+        # infected-neighbour counts gathered from the neighbourhoods of the infected pairs
+        csr   = self.csr
+        nodes = self.infected // self.reps
+        start = csr.indptr[nodes]
+        deg   = csr.indptr[nodes + 1] - start
+        flat  = csr.indices[spans(start, deg)] * np.int64(self.reps) + np.repeat(self.infected % self.reps, deg)
+        return np.unique(flat[self.z.ravel()[flat] == S], return_counts=True)
+
+    def freeze(self, replicates):
+        # This function stops advancing some replicates; their states and counts stay as they are
+        #
+        # input  : replicates, boolean mask or indices of the replicates to freeze
+        self.active[replicates] = False
+        self.infected  = self.infected[self.active[self.infected % self.reps]]
+        self.recovered = self.recovered[self.active[self.recovered % self.reps]]
+        self.work      = self.deg[self.infected // self.reps].sum()
+
+    def step(self):
+        # This function advances all active replicates by one synchronous time step
+        z, rng = self.z.ravel(), self.rng
+
+        # do S -> I transitions, one draw for the candidates of every replicate
+        if 48 * self.work < len(self.csr.indices) * self.reps: # measured crossover of the two passes
+            cand, k = self._pressure_frontier()
+        else:
+            cand, k = self._pressure_dense()
+        new_i = cand[rng.random(len(k)) >= self.escape[k]]
+
+        # do I -> R transitions
+        heal  = rng.random(len(self.infected)) < self.gamma
+        new_r = self.infected[heal]
+
+        # do R -> S transitions
+        if self.sigma > 0:
+            wane  = rng.random(len(self.recovered)) < self.sigma
+            new_s = self.recovered[wane]
+            self.recovered = np.concatenate([self.recovered[~wane], new_r])
+            z[new_s] = S
+        else:
+            new_s = self.recovered # always empty for SIR
+
+        z[new_i] = I
+        z[new_r] = R
+        self.infected = np.concatenate([self.infected[~heal], new_i])
+        self.work    += self.deg[new_i // self.reps].sum() - self.deg[new_r // self.reps].sum()
+
+        # count changes of every replicate, one bincount over (transition, replicate)
+        reps = self.reps
+        moved      = np.concatenate([new_i % reps, reps + new_r % reps, 2 * reps + new_s % reps])
+        di, dr, ds = np.bincount(moved, minlength=3 * reps).reshape(3, reps)
+        self.counts[:, S] += ds - di
+        self.counts[:, I] += di - dr
+        self.counts[:, R] += dr - ds
+        self.t += 1
+
+    def run(self, tmax=None, steady=None):
+        # This function steps all replicates until none is infected, or until time step tmax
+        #
+        # input  : steady, a steady_state.SteadyState; a replicate found steady is frozen
+        #          (no longer stepped), and the run stops once every replicate ended
+        # output : (T, R, 4) array of S,I,R,V counts per time step and replicate;
+        #          replicates that ended early keep their final counts
+        if not self.counts[:, I].any():
+            self.seed_infection()
+        series = [self.counts.copy()]
+        done   = np.zeros(self.reps, dtype=bool) # replicates found steady
+        if steady is not None:
+            steady.start(self.csr.n, series)
+        while not (done | (self.counts[:, I] == 0)).all() and (tmax is None or self.t < tmax):
+            self.step()
+            series.append(self.counts.copy())
+            if steady is not None:
+                fresh = steady.update(self.counts) & ~done
+                if fresh.any():
+                    done |= fresh
+                    self.freeze(fresh)
+        return np.stack(series)
+
+
+def SIR_Simulation_batched(G, beta, gamma, replicates, sigma=0.0, tmax=None, rng=None):
+    # This function runs `replicates` realizations of SIR_Simulation in one array pass per step
+    #
+    # output : (T, R, 4) array of S,I,R,V counts per time step and replicate
+    return BatchedEngine(G, beta, gamma, replicates, sigma=sigma, rng=rng).run(tmax)
@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+
+from caveman_gaussian_snowflake_graphs import (connected_caveman_random_partition_csr,
+                                               relaxed_caveman_random_partition_csr)
+from csr_engine import CSRGraph, CSREngine
+from gatherings import GatheringSchedule
+from profiler import Profiler
+
+FAMILIES    = ('connected_caveman', 'relaxed_caveman', 'erdos_renyi', 'barabasi_albert')
+SIZES       = (10**2, 10**3, 10**4, 10**5, 10**6)
+REGIMES     = {'low' : (0.1, 0.05), 'high' : (0.6, 0.3)} # (beta, gamma)
+SIMULATIONS = ('sir', 'sirs_flocking', 'vaccine')
+TEMPLATE_MAX_NODES = 2000 # the pure-Python templates are only timed up to this size
+MIN_TIME = 0.2 # seconds of runs timed per repeat, so millisecond cases are not timer noise
+FLOOR    = 0.05 # cases whose single run is shorter than this get twice the tolerance
+
+
+def _erdos_renyi_edges(n, k, rng):
+    # G(n, m) with m = n*k/2 uniform pairs, mean degree k (rare repeated pairs are kept)
+    m = n * k // 2
+    return rng.integers(n, size=m), rng.integers(n, size=m)
+
+
+def _barabasi_albert_edges(n, m, rng):
+    # Preferential attachment in linear time (Batagelj-Brandes): edge e of node t picks
+    # a uniform position among the endpoints of the edges before node t, i.e. a node
+    # with probability proportional to its degree. A position on a target endpoint is
+    # resolved by pointer jumping, all edges at once. Repeated targets are kept.
+    if n <= m:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    src = np.repeat(np.arange(m, n), m)
+    E   = len(src)
+    pos = np.zeros(E, dtype=np.int64)
+    before = 2 * (np.arange(E) // m) * m # endpoints of the edges of earlier nodes
+    pos[m:] = (rng.random(E - m) * before[m:]).astype(np.int64)
+    dst = np.full(E, -1, dtype=np.int64)
+    dst[:m] = np.arange(m) # node m attaches to every node of the seed set
+    todo = np.arange(m, E)
+    while len(todo):
+        p, e = pos[todo], pos[todo] // 2
+        src_end = p % 2 == 0
+        dst[todo[src_end]] = src[e[src_end]]
+        known = ~src_end & (dst[e] >= 0)
+        dst[todo[known]] = dst[e[known]]
+        jump = ~src_end & ~known
+        pos[todo[jump]] = pos[e[jump]] # follow the unresolved target to its own position
+        todo = todo[jump]
+    return src, dst
+
+
+def family_graph(family, n, seed=0):
+    # This function builds a benchmark graph of about n nodes
+    #
+    # input  : family, one of FAMILIES
+    #        : n, target number of nodes
+    #        : seed, graph seed
+    # output : a CSRGraph
+    rng    = np.random.default_rng(seed)
+    blocks = max(1, round(n / 60)) # about half the nodes in Gaussian-partition blocks of 30, as in vaccines.py
+    if family == 'connected_caveman':
+        return connected_caveman_random_partition_csr(num_caves=max(1, (n - 30 * blocks) // 6), num_blocks=blocks, seed=seed)
+    if family == 'relaxed_caveman':
+        return relaxed_caveman_random_partition_csr(num_caves=max(1, (n - 30 * blocks) // 10), num_blocks=blocks, seed=seed)
+    if family == 'erdos_renyi':
+        return CSRGraph.from_edges(n, *_erdos_renyi_edges(n, 8, rng))
+    if family == 'barabasi_albert':
+        return CSRGraph.from_edges(n, *_barabasi_albert_edges(n, 3, rng))
+    raise ValueError(f'unknown graph family {family!r}')
+
+
+def _engine(sim, G, beta, gamma, seed, backend, prof):
+    n = G.n
+    group = max(6, n // 36) # vaccines.py releases 6 doses a week to 216 nodes
+    if sim == 'sir':
+        e = CSREngine(G, beta, gamma, rng=seed, backend=backend, profiler=prof)
+    elif sim == 'sirs_flocking':
+        e = CSREngine(G, beta, gamma, sigma=0.1, rng=seed, backend=backend, group=group, profiler=prof,
+                      v_dict={1 : 0.8, 2 : 0.95}, gatherings=GatheringSchedule(max(10, n // 100), every=6))
+    elif sim == 'vaccine':
+        e = CSREngine(G, beta, gamma, rng=seed, backend=backend, group=group, profiler=prof)
+    else:
+        raise ValueError(f'unknown simulation {sim!r}')
+    e.seed_infection(e.rng.integers(n, size=max(1, n // 1000)))
+    return e
+
+
+def _template(sim, G, beta, gamma, seed, prof):
+    # the original pure-Python simulation on a networkx copy of G, headless
+    Gx = nx.Graph()
+    Gx.add_nodes_from(range(G.n))
+    Gx.add_edges_from(zip(G.row.tolist(), G.indices.tolist()))
+    group = max(6, G.n // 36)
+    # the template modules call random.seed() when first imported, so seed after the import
+    if sim == 'sir':
+        import SIR_template
+        run = lambda: SIR_template.SIR().SIR_Simulation(Gx, beta, gamma, headless=True, profiler=prof)
+    elif sim == 'sirs_flocking':
+        import SIRSV_Focking_ltemplate
+        run = lambda: SIRSV_Focking_ltemplate.SIR().SIRS_flocking_Simulation(Gx, beta, gamma, 0.1, max(10, G.n // 100),
+                                                                           group, headless=True, profiler=prof)
+    else:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Vaccinations'))
+        import vaccines
+        run = lambda: vaccines.SIR().SIR_Simulation(Gx, beta, gamma, group, headless=True, profiler=prof)
+    random.seed(seed)
+    return run
+
+
+def _measure(make, memory, min_time=MIN_TIME):
+    # time runs until min_time seconds have been spent in them (at least one run) and
+    # return the mean time of a run, then (optionally) repeat it under tracemalloc for
+    # its peak allocation; make(prof) builds a run reporting to the profiler prof, and
+    # building is not timed
+    prof  = Profiler()
+    run   = make(prof)
+    spent, calls = 0.0, 0
+    while calls == 0 or spent < min_time:
+        if calls:
+            run = make(Profiler()) # a seeded run repeats the same work
+        t0     = time.perf_counter()
+        res    = run()
+        spent += time.perf_counter() - t0
+        calls += 1
+    sec  = spent / calls
+    peak = None
+    if memory:
+        run = make(Profiler())
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return res, sec, peak, prof.counters.get('edges_examined', 0)
+
+
+def run_case(family, n, regime, sim, impl='engine', backend='auto', tmax=100, seed=0, repeats=3, memory=True, G=None,
+             min_time=MIN_TIME):
+    # This function benchmarks one (graph, regime, simulation, implementation) case
+    #
+    # input  : family, n, graph family and size; G, the graph when it is already built
+    #        : regime, key of REGIMES
+    #        : sim, one of SIMULATIONS
+    #        : impl, 'engine' (CSREngine) or 'template' (the original pure-Python code)
+    #        : backend, kernel backend of the engine
+    #        : tmax, step limit of engine runs (the templates stop on their own)
+    #        : repeats, timed repeats, the fastest is reported
+    #        : min_time, seconds of runs timed per repeat (short runs are looped)
+    #        : memory, also measure the peak allocation (one extra run under tracemalloc)
+    # output : dict of the case and its steps/s, edge-steps/s and peak MiB; edge-steps are
+    #          the adjacency entries the S->I passes actually examined (profiler counter)
+    G = G if G is not None else family_graph(family, n, seed)
+    beta, gamma = REGIMES[regime]
+    if impl == 'engine':
+        make = lambda prof: (lambda e: lambda: e.run(tmax=tmax))(_engine(sim, G, beta, gamma, seed, backend, prof))
+    else:
+        make = lambda prof: _template(sim, G, beta, gamma, seed, prof)
+    runs = [_measure(make, memory and r == 0, min_time) for r in range(repeats)]
+    res, sec, _, examined = min(runs, key=lambda x: x[1])
+    peak = runs[0][2]
+    steps = max(res.steps, 1)
+    edges = G.number_of_edges()
+    return {'family' : family, 'size' : n, 'n' : G.n, 'edges' : int(edges), 'regime' : regime, 'beta' : beta, 'gamma' : gamma,
+            'simulation' : sim, 'impl' : impl, 'backend' : backend if impl == 'engine' else 'python',
+            'steps' : int(res.steps), 'seconds' : sec, 'steps_per_s' : steps / sec,
+            'edges_examined' : int(examined), 'edge_steps_per_s' : examined / sec, 'peak_mib' : peak}
+
+
+def run_benchmarks(families=FAMILIES, sizes=SIZES, regimes=tuple(REGIMES), simulations=SIMULATIONS,
+                   templates=True, backend='auto', tmax=100, seed=0, repeats=3, memory=True, log=print,
+                   min_time=MIN_TIME):
+    # This function runs the benchmark grid
+    #
+    # input  : families, sizes, regimes, simulations, the grid
+    #        : templates, also time the pure-Python templates up to TEMPLATE_MAX_NODES nodes
+    #        : log, called with one line per finished case (None for silence)
+    #        : see run_case for the others
+    # output : list of case dicts
+    results = []
+    for family in families:
+        for n in sizes:
+            G = family_graph(family, n, seed)
+            for regime in regimes:
+                for sim in simulations:
+                    impls = ['engine'] + (['template'] if templates and n <= TEMPLATE_MAX_NODES else [])
+                    for impl in impls:
+                        r = run_case(family, n, regime, sim, impl, backend, tmax, seed, repeats, memory, G, min_time)
+                        results.append(r)
+                        if log:
+                            log(f"{family:18} n={r['n']:<8} {regime:4} {sim:14} {impl:8} "
+                                f"{r['steps_per_s']:12.1f} steps/s {r['edge_steps_per_s']:14.3e} edges/s "
+                                f"{r['peak_mib'] if r['peak_mib'] is not None else float('nan'):9.1f} MiB")
+    return results
+
+
+def _key(r):
+    return (r['family'], r['n'], r['regime'], r['simulation'], r['impl'], r['backend'])
+
+
+def save_baseline(path, results):
+    # This function writes benchmark results, with the machine they ran on, as JSON
+    meta = {'python' : platform.python_version(), 'numpy' : np.__version__,
+            'machine' : platform.machine(), 'system' : platform.system(), 'time' : time.time()}
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'meta' : meta, 'results' : results}, f, indent=1)
+    os.replace(tmp, path)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, tolerance=0.2, floor=FLOOR):
+    # This function lists the cases that got slower than the baseline
+    #
+    # input  : results, baseline, lists of case dicts
+    #        : tolerance, allowed relative drop of steps/s
+    #        : floor, seconds per run below which the tolerance is doubled
+    # output : list of (case key, baseline steps/s, new steps/s), empty when nothing regressed
+    old = {_key(r) : r for r in baseline}
+    slow = []
+    for r in results:
+        b = old.get(_key(r))
+        if b is None:
+            continue
+        allowed = tolerance if b['seconds'] >= floor else 2 * tolerance
+        if r['steps_per_s'] < (1 - allowed) * b['steps_per_s']:
+            slow.append((_key(r), b['steps_per_s'], r['steps_per_s']))
+    return slow
+
+
+def recheck(results, slow, rounds=3, **options):
+    # This function times the cases that compare() flagged again, keeping their best time
+    #
+    # input  : results, list of case dicts, updated in place
+    #        : slow, output of compare()
+    #        : rounds, times every flagged case is timed again
+    #        : options, run_case keyword arguments (backend, tmax, seed, repeats, min_time)
+    # output : results
+    #
+    # A run of small cases is noisy in bursts longer than one case: a flagged case is
+    # timed again after the other flagged ones, and only counts as a regression if it
+    # stays slow every time.
+    flagged = {key for key, _, _ in slow}
+    cases   = [r for r in results if _key(r) in flagged]
+    graphs  = {}
+    for _ in range(rounds):
+        for r in cases:
+            g = (r['family'], r['size'])
+            if g not in graphs:
+                graphs[g] = family_graph(r['family'], r['size'], options.get('seed', 0))
+            again = run_case(r['family'], r['size'], r['regime'], r['simulation'], r['impl'],
+                             memory=False, G=graphs[g], **options)
+            if again['steps_per_s'] > r['steps_per_s']:
+                r.update({k : again[k] for k in ('seconds', 'steps_per_s', 'edge_steps_per_s')})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the SIR/SIRS/SIRV simulations.')
+    parser.add_argument('--families', nargs='+', default=list(FAMILIES), choices=FAMILIES)
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES))
+    parser.add_argument('--regimes', nargs='+', default=list(REGIMES), choices=list(REGIMES))
+    parser.add_argument('--simulations', nargs='+', default=list(SIMULATIONS), choices=SIMULATIONS)
+    parser.add_argument('--no-templates', action='store_true', help='only time the array engines')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'numba', 'numpy'])
+    parser.add_argument('--tmax', type=int, default=100)
+    parser.add_argument('--repeats', type=int, default=3, help='timed repeats per case, the fastest counts')
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help='seconds of runs timed per repeat')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--floor', type=float, default=FLOOR, help='seconds per run below which the tolerance is doubled')
+    parser.add_argument('--recheck', type=int, default=3, help='times a slower case is timed again before it counts')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.families, args.sizes, args.regimes, args.simulations,
+                             not args.no_templates, args.backend, args.tmax, args.seed,
+                             args.repeats, not args.no_memory, min_time=args.min_time)
+    slow = []
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        slow     = compare(results, baseline, args.tolerance, args.floor)
+        if slow and args.recheck:
+            recheck(results, slow, args.recheck, backend=args.backend, tmax=args.tmax, seed=args.seed,
+                    repeats=args.repeats, min_time=args.min_time)
+            slow = compare(results, baseline, args.tolerance, args.floor)
+    if args.out:
+        save_baseline(args.out, results)
+    for key, before, after in slow:
+        print(f'REGRESSION {key}: {before:.1f} -> {after:.1f} steps/s')
+    if slow:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
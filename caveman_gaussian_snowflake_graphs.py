@@ -1,3 +1,8 @@
+import networkx as nx
+import numpy as np
+
+from csr_engine import CSRGraph
+
 def connected_caveman_random_partition_graph():
     G = nx.connected_caveman_graph(6,6)
     for i in range(6):
@@ -15,3 +20,131 @@ def relaxed_caveman_random_partition_graph():
         F.add_edge(6*i,len(G))
         G = F
     return G
+
+
+# edge layers of the generated graphs
+CAVE, PARTITION, BRIDGE = 0, 1, 2
+
+
+def _clique_edges(num, size, offset=0):
+    # all pairs (i<j) inside num consecutive cliques of the given size
+    i, j = np.triu_indices(size, 1)
+    base = offset + size * np.arange(num, dtype=np.int64)[:, None]
+    return (base + i).ravel(), (base + j).ravel()
+
+
+def _cave_edges(num_caves, cave_size, relaxed_p, rng):
+    # connected caveman (relaxed_p None) or relaxed caveman graph, as edge arrays
+    u, v = _clique_edges(num_caves, cave_size)
+    n    = num_caves * cave_size
+    if relaxed_p is None:
+        # like nx.connected_caveman_graph: the edge (start, start+1) of every cave
+        # is rewired to (start, start-1), the last node of the previous cave
+        start = cave_size * np.arange(num_caves)
+        first = np.isin(u, start) & (v == u + 1)
+        v     = np.where(first, (u - 1) % n, v)
+    else:
+        # like nx.relaxed_caveman_graph: every edge (u,v) is rewired to (u,x) with
+        # probability relaxed_p, x a random node; rewirings that would create a
+        # self loop or repeat an existing edge are skipped
+        move = np.flatnonzero(rng.random(len(u)) < relaxed_p)
+        x    = rng.integers(n, size=len(move))
+        a    = u[move]
+        key  = np.minimum(a, x) * n + np.maximum(a, x)
+        old  = np.minimum(u, v) * n + np.maximum(u, v)
+        _, first = np.unique(key, return_index=True)
+        ok   = (a != x) & ~np.isin(key, old)
+        ok  &= np.isin(np.arange(len(move)), first)
+        v    = v.copy()
+        v[move[ok]] = x[ok]
+    return u, v
+
+
+def _partition_labels(num_blocks, block_size, s, v, rng):
+    # partition index of every node of num_blocks gaussian random partitions of
+    # block_size nodes: sizes int(gauss(s, s/v + 0.5)), sizes < 1 are redrawn and
+    # the last partition of a block is cut to fill it (nx.gaussian_random_partition_graph)
+    sizes = np.trunc(rng.normal(s, s / v + 0.5, size=(num_blocks, 2 * block_size))).astype(np.int64)
+    ends  = np.cumsum(np.where(sizes < 1, 0, sizes), axis=1)
+    marks = np.zeros((num_blocks, block_size + 1), dtype=np.int64)
+    rows  = np.broadcast_to(np.arange(num_blocks)[:, None], ends.shape)
+    inner = ends < block_size
+    marks[rows[inner], ends[inner]] = 1
+    return np.cumsum(marks[:, :block_size], axis=1)
+
+
+def caveman_partition_edges(num_caves=6, cave_size=6, num_blocks=6, block_size=30, s=5, v=4,
+                            p_in=0.1, p_out=0.1, relaxed_p=None, seed=None, chunk=4096):
+    # This function builds a caveman + Gaussian-partition community graph as edge arrays
+    #
+    # input  : num_caves, cave_size, the caveman part (num_caves cliques of cave_size nodes)
+    #        : num_blocks, block_size, number and size of the Gaussian random partition blocks
+    #        : s, v, p_in, p_out, as in nx.gaussian_random_partition_graph
+    #        : relaxed_p, rewiring probability of a relaxed caveman part (None: connected caveman)
+    #        : seed, numpy Generator or seed
+    #        : chunk, blocks generated per array pass, bounds the working memory
+    # output : u, v, layer, community; edge endpoints, layer of every edge (CAVE,
+    #          PARTITION or BRIDGE) and community id of every node (its cave or partition)
+    #
+    # Block b takes the nodes after the caves, like the disjoint_union versions, but
+    # its first node is bridged to the first node of cave b (mod num_caves), node
+    # cave_size*b, where F.add_edge(6*i,len(G)) bridges to node 6*i. The two agree for
+    # 6-node caves and at most num_caves blocks, e.g. the connected version's defaults.
+    # They differ for the relaxed version's 10-node caves: nodes 0,10,..,50 here
+    # instead of 0,6,..,30. Past 6*i >= num_caves*cave_size, node 6*i lies in an
+    # earlier partition block, while here the bridges wrap around the caves so that
+    # every cave gets its share at any size. Nothing is copied per block, so the cost
+    # is linear in the number of caves and blocks.
+
+    rng    = seed if isinstance(seed, np.random.Generator) else np.random.default_rng(seed)
+    n_cave = num_caves * cave_size
+    cu, cv = _cave_edges(num_caves, cave_size, relaxed_p, rng)
+
+    pi, pj = np.triu_indices(block_size, 1)
+    us, vs, labels = [cu], [cv], []
+    for b0 in range(0, num_blocks, chunk):
+        nb    = min(chunk, num_blocks - b0)
+        lab   = _partition_labels(nb, block_size, s, v, rng)
+        same  = lab[:, pi] == lab[:, pj]
+        keep  = rng.random(same.shape) < np.where(same, p_in, p_out)
+        blk, e = np.nonzero(keep)
+        base  = n_cave + (b0 + blk) * block_size
+        us.append(base + pi[e])
+        vs.append(base + pj[e])
+        labels.append(lab)
+
+    start = n_cave + block_size * np.arange(num_blocks, dtype=np.int64)
+    us.append((cave_size * np.arange(num_blocks, dtype=np.int64)) % max(n_cave, 1))
+    vs.append(start)
+
+    layer = np.concatenate([np.full(len(cu), CAVE, dtype=np.int8),
+                            np.full(sum(len(x) for x in us[1:-1]), PARTITION, dtype=np.int8),
+                            np.full(num_blocks, BRIDGE, dtype=np.int8)])
+
+    # community ids: caves first, then the partitions block by block
+    part  = np.concatenate(labels) if labels else np.zeros((0, block_size), dtype=np.int64)
+    count = part[:, -1] + 1 if block_size else np.zeros(len(part), dtype=np.int64)
+    part  = part + (np.cumsum(count) - count)[:, None] + num_caves
+    community = np.concatenate([np.repeat(np.arange(num_caves), cave_size), part.ravel()])
+    return np.concatenate(us), np.concatenate(vs), layer, community
+
+
+def caveman_partition_csr(num_caves=6, cave_size=6, num_blocks=6, block_size=30, s=5, v=4,
+                          p_in=0.1, p_out=0.1, relaxed_p=None, seed=None):
+    # This function builds the same graph straight into CSR arrays
+    #
+    # input  : see caveman_partition_edges
+    # output : a CSRGraph with node_attrs['community']
+    u, w, layer, community = caveman_partition_edges(num_caves, cave_size, num_blocks, block_size,
+                                                     s, v, p_in, p_out, relaxed_p, seed)
+    return CSRGraph.from_edges(len(community), u, w, node_attrs={'community' : community})
+
+
+def connected_caveman_random_partition_csr(num_caves=6, cave_size=6, num_blocks=6, seed=None, **kw):
+    # scalable version of connected_caveman_random_partition_graph
+    return caveman_partition_csr(num_caves, cave_size, num_blocks, seed=seed, **kw)
+
+
+def relaxed_caveman_random_partition_csr(num_caves=6, cave_size=10, num_blocks=6, p=0.1, seed=None, **kw):
+    # scalable version of relaxed_caveman_random_partition_graph
+    return caveman_partition_csr(num_caves, cave_size, num_blocks, relaxed_p=p, seed=seed, **kw)
@@ -0,0 +1,135 @@
+import os
+import time
+
+import numpy as np
+
+from graph_store import _pad, _read_header, _write_header
+
+# Checkpoints use the layout of graph_store files: a JSON header followed by raw,
+# aligned arrays. The header holds the scalars and small values of the state (time
+# step, counts, random generator states); node-sized arrays are stored raw.
+CHECKPOINT_MAGIC = b'CKPT0001'
+
+
+def _plain(x):
+    # JSON-able copy of a header value (numpy scalars and tuples become int/float/list)
+    if isinstance(x, dict):
+        return {k : _plain(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return [_plain(v) for v in x]
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+
+def _split(state, prefix, arrays):
+    # move the arrays of a nested state dict to arrays[dotted name], return the rest
+    rest = {}
+    for k, v in state.items():
+        if isinstance(v, np.ndarray):
+            arrays[prefix + k] = v
+        elif isinstance(v, dict):
+            rest[k] = _split(v, prefix + k + '.', arrays)
+        else:
+            rest[k] = _plain(v)
+    return rest
+
+
+def save_checkpoint(path, state):
+    # This function writes a simulation state to a checkpoint file
+    #
+    # input  : path, output file (conventionally *.ckpt)
+    #        : state, dict of numpy arrays, numbers, strings, lists and nested dicts
+    # output : none
+    #
+    # The file is written to a temporary name and renamed, so a job killed while
+    # saving leaves the previous checkpoint intact.
+    arrays = {}
+    meta   = _split(state, '', arrays)
+    arrays = {k : np.ascontiguousarray(a, dtype=a.dtype.newbyteorder('<')) for k, a in arrays.items()}
+
+    # offsets are relative to the end of the header
+    layout, pos = {}, 0
+    for name, a in arrays.items():
+        layout[name] = {'dtype' : a.dtype.str, 'shape' : list(a.shape), 'offset' : pos}
+        pos += a.nbytes + _pad(a.nbytes)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        _write_header(f, CHECKPOINT_MAGIC, {'state' : meta, 'arrays' : layout})
+        for a in arrays.values():
+            f.write(a.tobytes())
+            f.write(b'\0' * _pad(a.nbytes))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path):
+    # This function reads a state written by save_checkpoint
+    #
+    # output : the state dict, arrays back in their place in the nested dicts
+    header, start = _read_header(path, CHECKPOINT_MAGIC)
+    state = header['state']
+    with open(path, 'rb') as f:
+        for name, spec in header['arrays'].items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            f.seek(start + spec['offset'])
+            a = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            *parents, key = name.split('.')
+            d = state
+            for p in parents:
+                d = d.setdefault(p, {})
+            d[key] = a.astype(dtype.newbyteorder('='))
+    return state
+
+
+class Checkpointer():
+    # Periodic checkpoints of one run, in one file that every save replaces.
+    #
+    # Pass it as checkpoint= to CSREngine.run, MultilayerEngine.run or a template
+    # simulation: if its file exists the run resumes from it, otherwise it starts
+    # fresh, and either way the state is saved whenever due(t). Build the engine with
+    # the same graph and parameters as the interrupted run; the saved random state
+    # makes the resumed run identical, bit for bit, to one that never stopped.
+
+    def __init__(self, path, every=100, seconds=None):
+        # input  : path, checkpoint file, one per run (e.g. one per sweep point)
+        #        : every, save after every `every` time steps (None for never)
+        #        : seconds, also save when this much wall time passed since the last save
+        self.path    = path
+        self.every   = every
+        self.seconds = seconds
+        self.last    = time.monotonic()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def due(self, t):
+        # This function tells whether the state of time step t should be saved
+        if self.every is not None and t % self.every == 0:
+            return True
+        return self.seconds is not None and time.monotonic() - self.last >= self.seconds
+
+    def save(self, state):
+        save_checkpoint(self.path, state)
+        self.last = time.monotonic()
+
+    def load(self):
+        return load_checkpoint(self.path)
+
+
+def label_array(z):
+    # the 'S','I','R','V' labels of a template state list as one byte per node
+    return np.frombuffer(''.join(z).encode('ascii'), dtype=np.uint8).copy()
+
+
+def label_list(a):
+    # inverse of label_array
+    return list(a.tobytes().decode('ascii'))
+
+
+def set_random_state(r, state):
+    # This function restores the state of a `random` generator (or of the module)
+    # from the list that save_checkpoint made of r.getstate()
+    r.setstate((state[0], tuple(state[1]), state[2]))
@@ -0,0 +1,422 @@
+import numpy as np
+
+from kernels import get_backend
+from profiler import NULL
+from results import SimulationResult
+from vaccination import VaccinationScheduler, WeeklyRelease
+
+# compartment codes of the int8 state array, in the same order as the colors in drawGz
+S, I, R, V = 0, 1, 2, 3
+LABELS = ['S', 'I', 'R', 'V']
+
+
+def log_escape(beta):
+    # This function returns log(1-beta), the log probability of escaping one contact
+    # (-inf for beta = 1); beta may be an array of per-layer probabilities
+    with np.errstate(divide='ignore'):
+        return np.log1p(-np.asarray(beta, dtype=float))
+
+
+class CSRGraph():
+    # Compressed sparse row adjacency of an undirected contact graph.
+    # The neighbours of node i are indices[indptr[i]:indptr[i+1]]; every
+    # undirected edge (i,j) is stored twice, once in each row.
+    # node_attrs maps attribute names to per-node arrays, e.g. 'community'.
+
+    def __init__(self, indptr, indices, node_attrs=None):
+        self.indptr     = indptr
+        self.indices    = indices
+        self.n          = len(indptr) - 1
+        self.node_attrs = node_attrs if node_attrs is not None else {}
+        self._row       = None
+
+    @classmethod
+    def from_edges(cls, n, u, v, node_attrs=None):
+        # This function builds the CSR arrays from an undirected edge list
+        #
+        # input  : n, number of nodes, labelled 0..n-1
+        #        : u, v, arrays of edge endpoints
+        #        : node_attrs, optional dict of per-node arrays
+        # output : a CSRGraph (self loops are dropped, they never carry an S-I contact)
+
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        keep = u != v
+        src = np.concatenate([u[keep], v[keep]])
+        dst = np.concatenate([v[keep], u[keep]])
+
+        order  = np.argsort(src, kind='stable')
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        itype  = np.int32 if n < 2**31 else np.int64
+        return cls(indptr, dst[order].astype(itype), node_attrs)
+
+    @classmethod
+    def from_networkx(cls, G):
+        # This function converts a networkx graph to CSR arrays, once
+        #
+        # input  : G is a networkx graph
+        # output : a CSRGraph, node i of the CSR is the i-th node of G.nodes()
+
+        n = G.order()
+        if all(type(u) is int for u in G) and set(G) == set(range(n)):
+            edges = np.fromiter((x for e in G.edges() for x in e), dtype=np.int64,
+                                count=2 * G.number_of_edges())
+        else:
+            index = {u: i for i, u in enumerate(G)}
+            edges = np.fromiter((index[x] for e in G.edges() for x in e), dtype=np.int64,
+                                count=2 * G.number_of_edges())
+        edges = edges.reshape(-1, 2)
+        return cls.from_edges(n, edges[:, 0], edges[:, 1])
+
+    def degree(self):
+        return np.diff(self.indptr)
+
+    def number_of_edges(self):
+        return len(self.indices) // 2
+
+    @property
+    def row(self):
+        # source node of every stored (directed) edge, i.e. the row of each entry of indices
+        if self._row is None:
+            self._row = np.repeat(np.arange(self.n, dtype=self.indices.dtype), self.degree())
+        return self._row
+
+
+class CSREngine():
+    # Synchronous discrete-time SIR/SIRS/SIRV on CSR arrays with an int8 node state.
+    # Each step is a handful of array passes instead of a Python loop over G.edges().
+    #
+    # With a vaccine release size `group`, doses are handed out as in vaccines.py:
+    # every `interval` days int(group * U(1,2)) doses, int(group * U(2,4)) from day
+    # `ramp_day` on, to nodes with fewer than two doses; a dose moves its node to V
+    # with probability v_dict[dose], overriding any other transition of that step.
+    # Another release plan or targeting policy (see vaccination.py) can be passed as
+    # schedule and policy.
+    #
+    # gatherings (see gatherings.py) adds temporary mixing events: on a gathering day
+    # the contacts of the gathering are an overlay layer whose S-I pairs are added to
+    # the infection pressure, at a cost linear in the number of those contacts.
+    #
+    # mode selects how the S->I pass finds its candidates:
+    #   'dense'    : one pass over the whole edge array, O(|E|) per step
+    #   'frontier' : only the neighbourhoods of the currently infected nodes are
+    #                gathered, O(sum of infected degrees) per step
+    #   'auto'     : frontier while the infected neighbourhood is a small part of
+    #                the graph (early and late epidemic), dense around the peak
+    # backend selects the kernels (kernels.py): 'numba' always walks the frontier in
+    # compiled code, 'numpy' uses mode; both give the same result for the same seed.
+
+    def __init__(self, G, beta, gamma, sigma=0.0, rng=None, mode='auto',
+                 group=None, v_dict=None, interval=7, ramp_day=20, schedule=None, policy=None,
+                 gatherings=None, backend='auto', profiler=None):
+        # input  : G is a networkx graph or a CSRGraph
+        #        : beta, infection probability per S-I contact per step
+        #        : gamma, I->R recovery probability per step
+        #        : sigma, R->S re-susceptible probability per step (0 for SIR)
+        #        : rng, numpy Generator or seed (None draws fresh entropy)
+        #        : mode, 'dense', 'frontier' or 'auto'
+        #        : group, vaccine release size (None disables vaccination)
+        #        : v_dict, efficacy of the 1st and 2nd dose, {1 : 0.85, 2 : 0.9} by default
+        #        : interval, ramp_day, vaccine release cadence and day of the larger releases
+        #        : schedule, release plan replacing the group/interval/ramp_day rule
+        #        : policy, vaccine targeting policy, uniform by default
+        #        : gatherings, a GatheringSchedule (None for no gatherings)
+        #        : backend, 'numba', 'numpy', or 'auto' for Numba when it is installed
+        #        : profiler, a profiler.Profiler to time the phases of every step
+
+        if mode not in ('dense', 'frontier', 'auto'):
+            raise ValueError(f'unknown mode {mode!r}')
+        self.csr   = self._as_graph(G)
+        self.beta  = beta
+        self.gamma = gamma
+        self.sigma = sigma
+        self.mode  = mode
+        self.gatherings = gatherings
+        self.backend    = get_backend(backend)
+        self.profiler   = profiler if profiler is not None else NULL
+        self.rng   = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+        n = self.csr.n
+        self.z      = np.zeros(n, dtype=np.int8)           # all nodes S, initially
+        self.counts = np.array([n, 0, 0, 0], dtype=np.int64) # S,I,R,V node counts
+        self.t      = 1
+
+        # active sets, kept up to date by step() so no pass has to scan all of z
+        self.infected  = np.zeros(0, dtype=np.int64)
+        self.recovered = np.zeros(0, dtype=np.int64) # only tracked when sigma > 0
+        self.scratch   = self._new_scratch()
+        self.isolated  = None # nodes without neighbours, found by the first dense pass
+
+        if schedule is None and group is not None:
+            schedule = WeeklyRelease(group, interval, ramp_day)
+        self.vaccination = VaccinationScheduler(n, schedule, v_dict, policy) if schedule is not None else None
+
+    @staticmethod
+    def _as_graph(G):
+        return G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+
+    def _new_scratch(self):
+        # per-node counters of the compiled S->I kernel
+        return self.backend.new_scratch(self.csr.n, np.int64)
+
+    def seed_infection(self, nodes=None):
+        # This function makes patient(s) 0; a random node when nodes is None
+        if nodes is None:
+            nodes = self.rng.integers(self.csr.n, size=1)
+        nodes = np.unique(np.asarray(nodes, dtype=np.int64))
+        nodes = nodes[self.z[nodes] == S]
+        self.z[nodes] = I
+        self.infected = np.concatenate([self.infected, nodes])
+        self.counts[S] -= len(nodes)
+        self.counts[I] += len(nodes)
+
+    def _use_frontier(self):
+        if self.mode != 'auto':
+            return self.mode == 'frontier'
+        if 8 * len(self.infected) > self.csr.n:
+            return False
+        work = (self.csr.indptr[self.infected + 1] - self.csr.indptr[self.infected]).sum()
+        return 4 * work < len(self.csr.indices)
+
+    def _pressure_dense(self):
+        # infected-neighbour count of every S node, in one pass over the edge array;
+        # rows are summed straight from indptr, so no per-edge row array is built and a
+        # memory-mapped graph stays shared between processes
+        z, csr = self.z, self.csr
+        if self.isolated is None:
+            self.isolated = np.flatnonzero(csr.degree() == 0)
+        hit  = np.append((z == I)[csr.indices], False) # a trailing empty row starts at len(indices)
+        k    = np.add.reduceat(hit, csr.indptr[:-1], dtype=np.int64)
+        k[self.isolated] = 0 # reduceat gives an empty row the next entry, not 0
+        cand = np.flatnonzero((k > 0) & (z == S))
+        return cand, k[cand]
+
+    def _pressure_overlay(self, g):
+        # infected-contact count of the S attendees of gathering g, from its pairs only
+        zu, zv = self.z[g.u], self.z[g.v]
+        nb = np.concatenate([g.v[(zu == I) & (zv == S)], g.u[(zv == I) & (zu == S)]])
+        return np.unique(nb, return_counts=True)
+
+    def _escape(self):
+        # S nodes with infected neighbours and the log probability that each of them
+        # escapes all of its k infected contacts, k*log(1-beta)
+        csr, prof = self.csr, self.profiler
+        dense = not self.backend.compiled and not self._use_frontier()
+        if dense:
+            cand, k = self._pressure_dense()
+        else: # the frontier pass of the backend, compiled or NumPy
+            cand, k = self.backend.frontier_counts(csr.indptr, csr.indices, self.z, self.infected, self.scratch)
+        if prof.enabled:
+            prof.count('edges_examined', len(csr.indices) if dense else
+                       (csr.indptr[self.infected + 1] - csr.indptr[self.infected]).sum())
+        return cand, k * log_escape(self.beta)
+
+    def _infections(self):
+        # This function draws the S -> I transitions of this step from the old state
+        #
+        # An S node with k infected neighbours escapes each of its k contacts with
+        # probability 1-beta, so it is infected with probability 1-(1-beta)^k, which
+        # is exactly the per-edge coin flipping of SIR_Simulation.
+        rng, prof = self.rng, self.profiler
+        t0 = prof.clock()
+        cand, escape = self._escape()
+        prof.add('infection', t0)
+        g = self.gatherings.gathering(self.t, self.csr.n, rng) if self.gatherings is not None else None
+        if g is not None:
+            # escaping the gathering contacts too: the log escape probabilities add up
+            t0 = prof.clock()
+            gc, gk = self._pressure_overlay(g)
+            bg     = self.beta if g.beta is None else g.beta
+            cand, inv = np.unique(np.concatenate([cand, gc]), return_inverse=True)
+            escape = np.bincount(inv, weights=np.concatenate([escape, gk * log_escape(bg)]), minlength=cand.size)
+            prof.add('gathering', t0)
+            prof.count('edges_examined', g.number_of_contacts())
+        t0 = prof.clock()
+        new_i = cand[rng.random(cand.size) < -np.expm1(escape)]
+        prof.add('infection', t0)
+        prof.count('rng_draws', cand.size)
+        prof.count('transmissions', new_i.size)
+        return new_i
+
+    def step(self):
+        # This function advances every node by one synchronous time step
+        # (run() closes the profiler record of the step after its observers; code that
+        # steps by hand calls profiler.end_step itself)
+        z, rng, prof = self.z, self.rng, self.profiler
+
+        # do S -> I transitions
+        new_i = self._infections()
+
+        # do I -> R transitions
+        t0 = prof.clock()
+        healed = rng.random(self.infected.size) < self.gamma
+        new_r  = self.infected[healed]
+        prof.add('recovery', t0)
+        prof.count('rng_draws', self.infected.size)
+
+        # do R -> S transitions
+        t0 = prof.clock()
+        if self.sigma > 0:
+            waned = rng.random(self.recovered.size) < self.sigma
+            prof.count('rng_draws', self.recovered.size)
+            new_s = self.recovered[waned]
+            self.recovered = np.concatenate([self.recovered[~waned], new_r])
+            z[new_s] = S
+        else:
+            new_s = self.recovered # always empty for SIR
+        prof.add('waning', t0)
+
+        # all transitions were drawn from the old state, so writing in place is synchronous
+        t0 = prof.clock()
+        z[new_i] = I
+        z[new_r] = R
+        self.infected = np.concatenate([self.infected[~healed], new_i])
+        self.counts[S] += len(new_s) - len(new_i)
+        self.counts[I] += len(new_i) - len(new_r)
+        self.counts[R] += len(new_r) - len(new_s)
+        prof.add('update', t0)
+
+        # do S/I/R -> V transitions
+        if self.vaccination is not None:
+            t0 = prof.clock()
+            self._vaccinate()
+            prof.add('vaccination', t0)
+        self.t += 1
+
+    def _vaccinate(self):
+        v_ch, protected = self.vaccination.release(self.t, self.rng)
+        self.profiler.count('doses', len(v_ch))
+        self.profiler.count('rng_draws', len(v_ch))
+        new_v = protected[self.z[protected] != V]
+        self.counts -= np.bincount(self.z[new_v], minlength=4)
+        self.counts[V] += len(new_v)
+        self.z[new_v] = V
+        if len(new_v):
+            self.infected  = self.infected[self.z[self.infected] == I]
+            self.recovered = self.recovered[self.z[self.recovered] == R]
+
+    def _signature(self):
+        # what a checkpoint must share with this engine to resume on it
+        return [self.csr.n, self.csr.number_of_edges(), self.beta, self.gamma, self.sigma]
+
+    def state(self):
+        # This function returns the full simulation state, the node states, counts,
+        # active sets, time step, random generator state and dose bookkeeping
+        #
+        # output : dict for checkpoint.save_checkpoint; restore() resumes from it
+        state = {'engine' : type(self).__name__, 'signature' : self._signature(), 't' : self.t,
+                 'z' : self.z.copy(), 'counts' : self.counts.copy(),
+                 'infected' : self.infected.copy(), 'recovered' : self.recovered.copy(),
+                 'rng' : self.rng.bit_generator.state}
+        if self.vaccination is not None:
+            state['vaccination'] = self.vaccination.state()
+        return state
+
+    def restore(self, state):
+        # This function resumes from the output of state(), on an engine built with the
+        # same graph and parameters; the next steps are the ones the saved run would take
+        if state['engine'] != type(self).__name__ or list(state['signature']) != self._signature():
+            raise ValueError(f"checkpoint of a {state['engine']} {state['signature']}, "
+                             f"not of this {type(self).__name__} {self._signature()}")
+        if ('vaccination' in state) != (self.vaccination is not None):
+            raise ValueError('checkpoint and engine disagree on vaccination')
+        self.t         = int(state['t'])
+        self.z[:]      = state['z']
+        self.counts[:] = state['counts']
+        self.infected  = np.asarray(state['infected'], dtype=np.int64)
+        self.recovered = np.asarray(state['recovered'], dtype=np.int64)
+        self.rng.bit_generator.state = state['rng']
+        if self.vaccination is not None:
+            self.vaccination.restore(state['vaccination'])
+
+    def active(self):
+        # This function tells whether another step can change anything:
+        # someone is infected, or there are still doses to hand out
+        return self.counts[I] > 0 or (self.vaccination is not None and not self.vaccination.exhausted(self.t))
+
+    def _series(self, St, It, Rt, Vt, Zt):
+        # the time series so far, as checkpoint arrays
+        series = {'S' : np.array(St, dtype=np.int64), 'I' : np.array(It, dtype=np.int64),
+                  'R' : np.array(Rt, dtype=np.int64)}
+        if Vt is not None:
+            series['V'] = np.array(Vt, dtype=np.int64)
+        if Zt is not None:
+            series['Z'] = np.stack(Zt)
+        return series
+
+    def run(self, observers=None, snapshots=False, tmax=None, checkpoint=None, steady=None):
+        # This function runs the simulation without any drawing, until no node is
+        # infected and no dose is left, or until time step tmax
+        #
+        # input  : observers, objects whose observe(t,z) is called every time step
+        #        : snapshots, keep a copy of the state array of every time step
+        #        : tmax, last time step (vaccines.py stops at 30)
+        #        : checkpoint, a checkpoint.Checkpointer: the run resumes from its file
+        #          when there is one, and saves its state whenever checkpoint.due(t)
+        #        : steady, a steady_state.SteadyState that also ends the run once the
+        #          counts stop changing (e.g. at the endemic equilibrium of SIRS)
+        # output : SimulationResult with the S(t),I(t),R(t)[,V(t)] time series
+        #
+        # A resumed run returns the whole series, from time step 1. Its observers are
+        # called from the resumed time step on.
+
+        observers = observers or []
+        vaccine   = self.vaccination is not None
+        if checkpoint is not None and checkpoint.exists():
+            state  = checkpoint.load()
+            series = state.get('series', {})
+            if snapshots and 'Z' not in series:
+                raise ValueError(f'{checkpoint.path} was saved without snapshots')
+            self.restore(state)
+            St, It, Rt = list(series['S']), list(series['I']), list(series['R'])
+            Vt = list(series['V']) if vaccine else None
+            Zt = list(series['Z']) if snapshots else None
+        else:
+            if self.counts[I] == 0:
+                self.seed_infection()
+            St, It, Rt = [self.counts[S]], [self.counts[I]], [self.counts[R]]
+            Vt = [self.counts[V]] if vaccine else None
+            Zt = [self.z.copy()] if snapshots else None
+        for obs in observers:
+            obs.observe(self.t, self.z)
+        stop = None
+        if steady is not None and steady.start(self.csr.n, np.column_stack([St, It, Rt] + ([Vt] if vaccine else []))):
+            stop = 'steady' # a resumed run that had already settled
+        prof = self.profiler
+        while stop is None and self.active() and (tmax is None or self.t < tmax):
+            self.step()
+            t0 = prof.clock()
+            St.append(self.counts[S])
+            It.append(self.counts[I])
+            Rt.append(self.counts[R])
+            if vaccine:
+                Vt.append(self.counts[V])
+            if snapshots:
+                Zt.append(self.z.copy())
+            prof.add('record', t0)
+            t0 = prof.clock()
+            for obs in observers:
+                obs.observe(self.t, self.z)
+            prof.add('observe', t0)
+            if checkpoint is not None and checkpoint.due(self.t):
+                t0 = prof.clock()
+                checkpoint.save(dict(self.state(), series=self._series(St, It, Rt, Vt, Zt)))
+                prof.add('checkpoint', t0)
+            prof.end_step(self.t - 1)
+            if steady is not None and steady.update(self.counts[:4 if vaccine else 3]):
+                stop = 'steady'
+        stop = stop or ('horizon' if self.active() else 'extinct')
+        return SimulationResult(St, It, Rt, Vt, snapshots=Zt, stop=stop)
+
+
+def SIR_Simulation(G, beta, gamma, rng=None, mode='auto'):
+    # This function is the CSR counterpart of SIR.SIR_Simulation in SIR_template.py
+    #
+    # input  : G is a networkx graph (or a CSRGraph)
+    #        : beta, infection rate per S-I contact
+    #        : gamma, I->R recovery rate
+    #        : rng, numpy Generator or seed
+    #        : mode, S->I stepping mode of CSREngine
+    # output : SimulationResult with the S(t),I(t),R(t) time series
+    return CSREngine(G, beta, gamma, rng=rng, mode=mode).run()
@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from csr_engine import CSREngine
+from graph_store import open_graph
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+BINS      = 256 # default histogram bins over 0..n
+
+_graph = None # contact graph of a worker process, set once by _init_worker
+
+
+class EnsembleResult():
+    # Aggregated S/I/R/V statistics of an ensemble of replicates.
+    #
+    # quantiles[q, t, c] is the quantiles[q] value of compartment c (S,I,R,V) at
+    # time step t; mean[t, c] is the ensemble mean. Replicates that ended early
+    # keep their final counts up to the longest run.
+
+    def __init__(self, levels, quantiles, mean, replicates):
+        self.levels     = levels
+        self.quantiles  = quantiles
+        self.mean       = mean
+        self.replicates = replicates
+
+    @property
+    def median(self):
+        return self.quantile(0.5)
+
+    def quantile(self, q):
+        # output : (T, 4) array of the q quantile, q must be one of the computed levels
+        return self.quantiles[list(self.levels).index(q)]
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = open_graph(graph) # a saved graph is memory-mapped, not copied, by every worker
+
+
+def _run_chunk(seeds, params):
+    # This function runs a chunk of replicates in a worker
+    #
+    # input  : seeds, one SeedSequence per replicate
+    #        : params, CSREngine and run() keyword arguments, and bins
+    # output : hist, (T, 4, bins) histogram of the S,I,R,V counts over the replicates
+    #        : total, (T, 4) sum of the counts over the replicates
+    #        : low, high, (T, 4) smallest and largest count over the replicates
+    #
+    # Replicates that ended early keep their final counts up to the longest run. Only
+    # these aggregates leave the worker, never the trajectories, so a chunk result has
+    # the same size whatever the number of replicates and the graph size.
+
+    bins   = params.pop('bins')
+    tmax   = params.pop('tmax', None)
+    steady = params.pop('steady', None)
+    runs   = [CSREngine(_graph, rng=np.random.default_rng(ss), **params).run(tmax=tmax, steady=steady).as_array()
+              for ss in seeds]
+    T    = max(len(r) for r in runs)
+    runs = np.stack([_pad(r, T) for r in runs]).astype(np.int64)
+    return _histogram(runs, _graph.n, bins), runs.sum(axis=0), runs.min(axis=0), runs.max(axis=0)
+
+
+def _histogram(runs, n, bins):
+    # per-step histogram (T, 4, bins) of every compartment over the replicates of a chunk
+    T, b = runs.shape[1], runs * bins // (n + 1) # bin of every count
+    flat = (np.arange(T * 4).reshape(1, T, 4) * bins + b).ravel()
+    return np.bincount(flat, minlength=T * 4 * bins).reshape(T, 4, bins)
+
+
+def _pad(a, T):
+    return np.concatenate([a, np.repeat(a[-1:], T - len(a), axis=0)])
+
+
+def _reduce(chunks):
+    # adds up the histograms and sums of the chunks, and keeps the extreme counts; a
+    # shorter chunk is padded with its last step, the final counts of its replicates
+    hist, total, low, high = None, None, None, None
+    for h, s, lo, hi in chunks:
+        if hist is None:
+            hist, total, low, high = h, s, lo, hi
+            continue
+        T = max(len(hist), len(h))
+        hist  = _pad(hist, T) + _pad(h, T)
+        total = _pad(total, T) + _pad(s, T)
+        low   = np.minimum(_pad(low, T), _pad(lo, T))
+        high  = np.maximum(_pad(high, T), _pad(hi, T))
+    return hist, total, low, high
+
+
+def _quantiles(hist, low, high, n, levels):
+    # quantiles of every (step, compartment) from the histogram: the first bin whose
+    # cumulative count reaches q*replicates, interpolated linearly inside the part of
+    # that bin the counts were seen in (between the smallest and largest count), so
+    # counts much smaller than a bin are not rounded to its lower edge
+    bins  = hist.shape[2]
+    width = (n + 1) / bins
+    cum   = np.cumsum(hist, axis=2)
+    reps  = cum[..., -1]
+    quant = []
+    for q in levels:
+        target = np.maximum(q * reps, 1)
+        b      = np.argmax(cum >= target[..., None], axis=2)[..., None]
+        count  = np.take_along_axis(hist, b, axis=2)[..., 0]
+        before = np.take_along_axis(cum, b, axis=2)[..., 0] - count
+        lo     = np.maximum(b[..., 0] * width, low)
+        hi     = np.minimum((b[..., 0] + 1) * width - 1, high)
+        quant.append(lo + (target - before) / count * np.maximum(hi - lo, 0))
+    return np.stack(quant)
+
+
+def run_ensemble(G, replicates, beta, gamma, sigma=0.0, group=None, v_dict=None, tmax=None,
+                 seed=None, workers=None, levels=QUANTILES, bins=None, chunksize=None, mode='auto',
+                 steady=None):
+    # This function runs independent replicates of the CSR engine over a process pool
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a graph_store file
+    #        : replicates, number of stochastic runs
+    #        : beta, gamma, sigma, as in CSREngine
+    #        : group, v_dict, vaccine release size and efficacies; None runs SIR_Simulation,
+    #          a value runs the vaccines.py simulation (use tmax=30 to match it)
+    #        : tmax, last time step of every run
+    #        : seed, root seed; replicate r always uses child r of SeedSequence(seed), so
+    #          the result does not depend on workers or chunksize
+    #        : workers, number of processes (None uses all cores, 1 runs in-process)
+    #        : levels, quantile levels to report
+    #        : bins, histogram resolution of the counts, BINS by default; quantiles are
+    #          interpolated inside bins of n/bins nodes (bins=n+1 gives exact quantiles,
+    #          at T*4*(n+1) memory)
+    #        : chunksize, replicates per task
+    #        : steady, a steady_state.SteadyState ending every replicate whose counts
+    #          stopped changing (SIRS runs rarely die out on their own)
+    # output : EnsembleResult
+
+    graph    = open_graph(G)
+    shared   = G if isinstance(G, (str, os.PathLike)) else graph
+    n        = graph.n
+    bins     = min(bins or BINS, n + 1)
+    workers  = workers or os.cpu_count()
+    seeds    = np.random.SeedSequence(seed).spawn(replicates)
+    chunk    = chunksize or max(1, -(-replicates // (4 * workers)))
+    chunks   = [seeds[i:i + chunk] for i in range(0, replicates, chunk)]
+    params   = dict(beta=beta, gamma=gamma, sigma=sigma, group=group, v_dict=v_dict, tmax=tmax, mode=mode,
+                    steady=steady, bins=bins)
+
+    if workers == 1:
+        _init_worker(graph)
+        hist, total, low, high = _reduce(_run_chunk(c, dict(params)) for c in chunks)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shared,)) as pool:
+            hist, total, low, high = _reduce(pool.map(_run_chunk, chunks, [dict(params)] * len(chunks)))
+
+    quant = _quantiles(hist, low, high, n, levels)
+    return EnsembleResult(tuple(levels), quant, total / replicates, replicates)
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+class Gathering():
+    # One temporary mixing event, an overlay contact layer that exists for one step.
+    #
+    # nodes are the attendees; u[k], v[k] is the k-th contact pair among them (a pair
+    # that met twice is listed twice and carries two exposures). beta is the
+    # transmission probability per contact of the gathering, None for the base beta.
+
+    def __init__(self, nodes, u, v, beta=None):
+        self.nodes = nodes
+        self.u     = u
+        self.v     = v
+        self.beta  = beta
+
+    def number_of_contacts(self):
+        return len(self.u)
+
+
+def mixing_contacts(nodes, contacts, rng):
+    # This function draws the contact pairs of a gathering
+    #
+    # input  : nodes, array of the m attendees
+    #        : contacts, partners met by every attendee, None for everybody (all pairs)
+    #        : rng, numpy Generator
+    # output : u, v, arrays of contact endpoints, never a self contact
+    #
+    # With a finite number of contacts the layer has m * contacts pairs, so its cost is
+    # linear in the size of the gathering; all pairs cost m(m-1)/2.
+    m = len(nodes)
+    if m < 2:
+        return nodes[:0], nodes[:0]
+    if contacts is None or contacts >= m - 1:
+        a, b = np.triu_indices(m, k=1)
+    else:
+        a = np.repeat(np.arange(m), contacts)
+        b = (a + rng.integers(1, m, size=len(a))) % m # any attendee but a itself
+    return nodes[a], nodes[b]
+
+
+class GatheringSchedule():
+    # Recurring gatherings: every `every` days from day `start` on, `groups` disjoint
+    # gatherings of `size` random nodes each. The attendees are drawn without scanning
+    # the graph or the states, so a gathering costs O(groups * size * contacts).
+
+    def __init__(self, size, every=6, start=None, contacts=4, groups=1, beta=None):
+        # input  : size, attendees per gathering (the `flocking` of SIRSV_Focking_ltemplate.py)
+        #        : every, days between gatherings
+        #        : start, first gathering day, `every` by default
+        #        : contacts, partners met by every attendee, None for all pairs
+        #        : groups, number of simultaneous gatherings
+        #        : beta, transmission probability per gathering contact, None for the base beta
+        self.size     = size
+        self.every    = every
+        self.start    = every if start is None else start
+        self.contacts = contacts
+        self.groups   = groups
+        self.beta     = beta
+
+    def gathering(self, t, n, rng):
+        # This function draws the gatherings of day t
+        #
+        # input  : t, time step
+        #        : n, number of nodes
+        #        : rng, numpy Generator
+        # output : a Gathering with the contacts of all groups, None on other days
+        if t < self.start or (t - self.start) % self.every != 0 or self.size < 2:
+            return None
+        m     = min(self.groups * self.size, n)
+        nodes = rng.choice(n, m, replace=False)
+        parts = [mixing_contacts(nodes[k:k + self.size], self.contacts, rng) for k in range(0, m, self.size)]
+        u = np.concatenate([p[0] for p in parts])
+        v = np.concatenate([p[1] for p in parts])
+        return Gathering(nodes, u, v, self.beta)
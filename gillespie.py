@@ -0,0 +1,166 @@
+import heapq
+import numpy as np
+
+from csr_engine import CSRGraph, S, I, R, V
+from results import SimulationResult
+from vaccination import VaccinationScheduler, WeeklyRelease
+
+# event kinds, popped from the queue in time order
+TRANSMIT, RECOVER, WANE, RELEASE = 0, 1, 2, 3
+
+
+def rate_from_probability(p):
+    # This function converts a per-step probability of the discrete-time templates
+    # to the rate of an exponential clock that fires within one step with probability p
+    return -np.log1p(-p)
+
+
+class GillespieEngine():
+    # Continuous-time exact stochastic SIR/SIRS/SIRV on CSR arrays.
+    #
+    # Events sit in a binary heap (next-reaction method): infecting a node schedules
+    # its recovery and one transmission attempt per neighbour, each in O(log N).
+    # Only events are processed, so quiet days cost nothing beyond copying the counts.
+    #
+    # Vaccination follows the release rule of vaccines.py: every `interval` days
+    # int(group * U(1,2)) doses, int(group * U(2,4)) from day `ramp_day` on, go to
+    # nodes with fewer than two doses, and a dose moves its node to V with
+    # probability v_dict[dose]. schedule and policy replace that rule as in CSREngine.
+
+    def __init__(self, G, beta, gamma, sigma=0.0, group=None, v_dict=None,
+                 interval=7, ramp_day=20, rng=None, schedule=None, policy=None):
+        # input  : G is a networkx graph or a CSRGraph
+        #        : beta, transmission rate per S-I contact
+        #        : gamma, I->R recovery rate
+        #        : sigma, R->S re-susceptible rate (0 for SIR)
+        #        : group, vaccine release size (None disables vaccination)
+        #        : v_dict, efficacy of the 1st and 2nd dose, {1 : 0.85, 2 : 0.9} by default
+        #        : interval, ramp_day, vaccine release cadence and day of the larger releases
+        #        : rng, numpy Generator or seed
+        #        : schedule, policy, vaccine release plan and targeting policy (vaccination.py)
+        #
+        # Rates are per day; rate_from_probability maps the per-step probabilities
+        # of the templates to matching rates.
+
+        self.csr      = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+        self.beta     = beta
+        self.gamma    = gamma
+        self.sigma    = sigma
+        self.rng      = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+
+        n = self.csr.n
+        self.z        = np.zeros(n, dtype=np.int8)  # all nodes S, initially
+        self.epoch    = np.zeros(n, dtype=np.int64) # bumped on every state change, invalidates stale events
+        self.rec_time = np.zeros(n)                 # recovery time of the current infection
+        self.counts   = np.array([n, 0, 0, 0], dtype=np.int64)
+        self.time     = 0.0
+        self.queue    = []
+        if schedule is None and group is not None:
+            schedule = WeeklyRelease(group, interval, ramp_day)
+        self.vaccination = VaccinationScheduler(n, schedule, v_dict, policy) if schedule is not None else None
+        if self.vaccination is not None:
+            self._schedule_release(self.time)
+
+    def _push(self, t, kind, node, src, epoch):
+        heapq.heappush(self.queue, (t, kind, node, src, epoch))
+
+    def _move(self, node, new):
+        self.counts[self.z[node]] -= 1
+        self.counts[new] += 1
+        self.z[node] = new
+        self.epoch[node] += 1
+
+    def _infect(self, node, t):
+        self._move(node, I)
+        rec = t + self.rng.exponential(1.0 / self.gamma) if self.gamma > 0 else np.inf
+        self.rec_time[node] = rec
+        self._push(rec, RECOVER, node, node, self.epoch[node])
+
+        nbrs = self.csr.indices[self.csr.indptr[node]:self.csr.indptr[node + 1]]
+        if self.sigma == 0:
+            nbrs = nbrs[self.z[nbrs] == S] # in SIR a non-S neighbour never becomes S again
+        if self.beta > 0 and len(nbrs):
+            when = t + self.rng.exponential(1.0 / self.beta, len(nbrs))
+            ep   = self.epoch[node]
+            for v, tv in zip(nbrs[when < rec].tolist(), when[when < rec].tolist()):
+                self._push(tv, TRANSMIT, v, node, ep)
+
+    def _schedule_release(self, t):
+        day = self.vaccination.schedule.next_day(t)
+        if day is not None and self.vaccination.pending > 0:
+            self._push(day, RELEASE, -1, -1, 0)
+
+    def _release(self, t):
+        _, protected = self.vaccination.release(int(round(t)), self.rng)
+        for v_ch in protected[self.z[protected] != V].tolist():
+            self._move(v_ch, V)
+        self._schedule_release(t)
+
+    def seed_infection(self, nodes=None):
+        # This function makes patient(s) 0 at the current time; a random node when nodes is None
+        if nodes is None:
+            nodes = self.rng.integers(self.csr.n, size=1)
+        for node in np.unique(np.asarray(nodes, dtype=np.int64)).tolist():
+            if self.z[node] == S:
+                self._infect(node, self.time)
+
+    def _handle(self, t, kind, node, src, epoch):
+        if kind == TRANSMIT:
+            if self.epoch[src] != epoch: # src recovered or was vaccinated meanwhile
+                return
+            if self.z[node] == S:
+                self._infect(node, t)
+            if self.sigma > 0: # node may be S again before src recovers, keep the contact going
+                tn = t + self.rng.exponential(1.0 / self.beta)
+                if tn < self.rec_time[src]:
+                    self._push(tn, TRANSMIT, node, src, epoch)
+        elif kind == RECOVER:
+            if self.epoch[node] == epoch:
+                self._move(node, R)
+                if self.sigma > 0:
+                    self._push(t + self.rng.exponential(1.0 / self.sigma), WANE, node, node, self.epoch[node])
+        elif kind == WANE:
+            if self.epoch[node] == epoch:
+                self._move(node, S)
+        else:
+            self._release(t)
+
+    def run(self, tmax=None):
+        # This function processes events until none are left or tmax is reached
+        #
+        # input  : tmax, time horizon in days (None runs to the end)
+        # output : SimulationResult with the S(t),I(t),R(t),V(t) counts at the start of every day 0,1,2,...
+
+        if self.counts[I] == 0:
+            self.seed_infection()
+        St, It, Rt, Vt = [], [], [], []
+        day = int(np.floor(self.time))
+        while self.queue:
+            t = self.queue[0][0]
+            if tmax is not None and t > tmax:
+                break
+            while day <= t: # days without events are only a copy of the counts
+                St.append(self.counts[S])
+                It.append(self.counts[I])
+                Rt.append(self.counts[R])
+                Vt.append(self.counts[V])
+                day += 1
+            self._handle(*heapq.heappop(self.queue))
+            self.time = t
+        end = tmax if tmax is not None else int(np.floor(self.time)) + 1 # one day after the last event
+        while day <= end or not St:
+            St.append(self.counts[S])
+            It.append(self.counts[I])
+            Rt.append(self.counts[R])
+            Vt.append(self.counts[V])
+            day += 1
+        return SimulationResult(St, It, Rt, Vt)
+
+
+def Gillespie_Simulation(G, beta, gamma, sigma=0.0, group=None, v_dict=None, tmax=None, rng=None):
+    # This function is the continuous-time counterpart of the template simulations
+    #
+    # input  : see GillespieEngine; beta, gamma, sigma are rates per day
+    # output : SimulationResult with daily S(t),I(t),R(t),V(t) time series
+    engine = GillespieEngine(G, beta, gamma, sigma=sigma, group=group, v_dict=v_dict, rng=rng)
+    return engine.run(tmax)
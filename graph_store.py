@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+
+from csr_engine import CSRGraph
+
+# File layout shared by graphs and snapshots:
+#   8-byte magic, 8-byte little-endian header length, JSON header, zero padding to
+#   ALIGN bytes, then raw little-endian arrays, each starting on an ALIGN boundary.
+# Every array can therefore be memory-mapped in place, and processes that map the
+# same file share its pages through the OS page cache.
+GRAPH_MAGIC    = b'CSRG0001'
+SNAPSHOT_MAGIC = b'SNAP0001'
+ALIGN          = 64
+
+
+def _pad(pos):
+    return -pos % ALIGN
+
+
+def _write_header(f, magic, header):
+    text = json.dumps(header).encode()
+    f.write(magic)
+    f.write(np.uint64(len(text)).tobytes())
+    f.write(text)
+    f.write(b'\0' * _pad(16 + len(text)))
+    return 16 + len(text) + _pad(16 + len(text))
+
+
+def _read_header(path, magic):
+    with open(path, 'rb') as f:
+        if f.read(8) != magic:
+            raise ValueError(f'{path} is not a {magic[:4].decode()} file')
+        size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(size))
+    return header, 16 + size + _pad(16 + size)
+
+
+def save_graph(path, G):
+    # This function writes a contact graph to the compact binary CSR format
+    #
+    # input  : path, output file (conventionally *.csrg)
+    #        : G is a networkx graph or a CSRGraph; its node_attrs are saved too
+    # output : none
+    #
+    # A graph costs 8 bytes per node for indptr and 4 bytes per edge end for indices
+    # (8 beyond 2^31 nodes), against roughly a kilobyte per edge as a networkx object.
+
+    csr    = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    arrays = {'indptr' : csr.indptr, 'indices' : csr.indices}
+    arrays.update({'attr.' + k : np.asarray(a) for k, a in csr.node_attrs.items()})
+    arrays = {k : np.ascontiguousarray(a, dtype=np.asarray(a).dtype.newbyteorder('<')) for k, a in arrays.items()}
+
+    # offsets are relative to the end of the header
+    layout, pos = {}, 0
+    for name, a in arrays.items():
+        layout[name] = {'dtype' : a.dtype.str, 'shape' : list(a.shape), 'offset' : pos}
+        pos += a.nbytes + _pad(a.nbytes)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        _write_header(f, GRAPH_MAGIC, {'n' : csr.n, 'arrays' : layout})
+        for a in arrays.values():
+            f.write(a.tobytes())
+            f.write(b'\0' * _pad(a.nbytes))
+    os.replace(tmp, path)
+
+
+def load_graph(path, mmap=True):
+    # This function loads a graph written by save_graph
+    #
+    # input  : path, graph file
+    #        : mmap, map the arrays read-only instead of reading them into memory
+    # output : a CSRGraph, whose arrays are np.memmap views of the file when mmap is True
+    #
+    # Mapping takes milliseconds whatever the graph size, and workers that map the same
+    # file share one physical copy of it.
+
+    header, start = _read_header(path, GRAPH_MAGIC)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        if mmap:
+            arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=start + spec['offset'], shape=shape)
+        else:
+            with open(path, 'rb') as f:
+                f.seek(start + spec['offset'])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    attrs = {k[5:] : a for k, a in arrays.items() if k.startswith('attr.')}
+    return CSRGraph(arrays['indptr'], arrays['indices'], attrs)
+
+
+def open_graph(G):
+    # This function accepts a networkx graph, a CSRGraph or the path of a saved graph
+    if isinstance(G, (str, os.PathLike)):
+        return load_graph(G)
+    return G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+
+
+class SnapshotWriter():
+    # Append-only file of per-step int8 state arrays, one frame of n bytes per step.
+    # It is an observer: pass it in observers= of a simulation to record every step.
+
+    def __init__(self, path, n, t0=1):
+        # input  : path, output file (conventionally *.snap)
+        #        : n, number of nodes
+        #        : t0, time step of the first frame
+        self.n = n
+        self.f = open(path, 'wb')
+        _write_header(self.f, SNAPSHOT_MAGIC, {'n' : n, 't0' : t0, 'dtype' : 'i1'})
+
+    def observe(self, t, z):
+        # input  : z, int8 state array, or a list/dict of 'S','I','R','V' labels
+        if not isinstance(z, np.ndarray):
+            codes = {'S' : 0, 'I' : 1, 'R' : 2, 'V' : 3}
+            z = np.fromiter((codes[z[i]] for i in range(self.n)), dtype=np.int8, count=self.n)
+        self.f.write(np.ascontiguousarray(z, dtype=np.int8).tobytes())
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_snapshots(path):
+    # This function maps the frames of a snapshot file
+    #
+    # output : t0, (T, n) read-only int8 array, row k holds the states of time step t0+k
+    header, start = _read_header(path, SNAPSHOT_MAGIC)
+    n = header['n']
+    T = (os.path.getsize(path) - start) // n if n else 0
+    if T == 0:
+        return header['t0'], np.zeros((0, n), dtype=np.int8)
+    return header['t0'], np.memmap(path, dtype=np.int8, mode='r', offset=start, shape=(T, n))
@@ -0,0 +1,148 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError: # the NumPy kernels below are used instead
+    numba = None
+
+S, I = 0, 1 # state codes, as in csr_engine
+
+# Kernels of the S->I pass, the only transition that walks the adjacency; I->R and
+# R->S are one vectorized comparison over the active sets in every backend.
+#
+# Both backends return the candidates in increasing node order with exactly the
+# same counts (integer counts, or log escape sums added in the same order), and
+# the engines draw the uniforms themselves, so a seeded run gives the same result
+# with or without Numba.
+
+
+def spans(start, length):
+    # This function lists the storage slots of several rows, row by row
+    #
+    # input  : start, length, first slot and number of slots of every row
+    # output : the slots start[0]..start[0]+length[0]-1, then those of the next row, ...
+    #
+    # One repeat and one arange, so gathering the neighbourhoods of a set of nodes
+    # (indices[spans(indptr[nodes], degree)]) costs the sum of their degrees.
+    total = int(length.sum())
+    return np.repeat(start - np.cumsum(length) + length, length) + np.arange(total)
+
+
+def _frontier_counts_numpy(indptr, indices, z, infected, scratch):
+    # This function counts the infected neighbours of the S nodes next to the infected nodes
+    #
+    # input  : indptr, indices, CSR adjacency
+    #        : z, int8 node states
+    #        : infected, array of the infected nodes
+    #        : scratch, unused here (the compiled kernel's per-node counters)
+    # output : cand, sorted S nodes with at least one infected neighbour; k, their counts
+    start = indptr[infected]
+    nb    = indices[spans(start, indptr[infected + 1] - start)]
+    return np.unique(nb[z[nb] == S], return_counts=True)
+
+
+def _frontier_counts_loop(indptr, indices, z, infected, scratch):
+    total = 0
+    for i in infected:
+        total += indptr[i + 1] - indptr[i]
+    cand = np.empty(total, dtype=np.int64)
+    c = 0
+    for i in infected:
+        for s in range(indptr[i], indptr[i + 1]):
+            j = indices[s]
+            if z[j] == S:
+                if scratch[j] == 0:
+                    cand[c] = j
+                    c += 1
+                scratch[j] += 1
+    cand = np.sort(cand[:c])
+    k = np.empty(c, dtype=np.int64)
+    for m in range(c):
+        k[m] = scratch[cand[m]]
+        scratch[cand[m]] = 0 # left all zero for the next call
+    return cand, k
+
+
+def _layered_escape_numpy(start, length, nbr, lay, logw, z, infected, scratch):
+    # This function sums the log escape probabilities of the S nodes next to the infected
+    # nodes of a LayeredGraph, over contacts on layers with a nonzero rate
+    #
+    # input  : start, length, nbr, lay, storage of the LayeredGraph
+    #        : logw, log(1-beta) of every layer
+    #        : z, int8 node states
+    #        : infected, array of the infected nodes
+    #        : scratch, unused here (the compiled kernel's per-node sums)
+    # output : cand, sorted S nodes with an infected contact; their summed log escape
+    slots = spans(start[infected], length[infected])
+    nb    = nbr[slots]
+    w     = logw[lay[slots]]
+    keep  = (z[nb] == S) & (w != 0)
+    nb, w = nb[keep], w[keep]
+    if 8 * len(nb) < len(z):
+        cand, inv = np.unique(nb, return_inverse=True)
+        return cand, np.bincount(inv, weights=w, minlength=len(cand))
+    escape = np.bincount(nb, weights=w, minlength=len(z))
+    cand   = np.flatnonzero(escape < 0)
+    return cand, escape[cand]
+
+
+def _layered_escape_loop(start, length, nbr, lay, logw, z, infected, scratch):
+    total = 0
+    for i in infected:
+        total += length[i]
+    cand = np.empty(total, dtype=np.int64)
+    c = 0
+    for i in infected:
+        for s in range(start[i], start[i] + length[i]):
+            j = nbr[s]
+            w = logw[lay[s]]
+            if z[j] == S and w != 0:
+                if scratch[j] == 0: # every w is negative, so a touched sum is never 0
+                    cand[c] = j
+                    c += 1
+                scratch[j] += w
+    cand = np.sort(cand[:c])
+    escape = np.empty(c)
+    for m in range(c):
+        escape[m] = scratch[cand[m]]
+        scratch[cand[m]] = 0.0
+    return cand, escape
+
+
+class Backend():
+    # The S->I kernels of one backend. compiled backends need per-node scratch
+    # arrays from new_scratch(), which they leave all zero after every call.
+
+    def __init__(self, name, frontier_counts, layered_escape, compiled):
+        self.name            = name
+        self.frontier_counts = frontier_counts
+        self.layered_escape  = layered_escape
+        self.compiled        = compiled
+
+    def new_scratch(self, n, dtype):
+        return np.zeros(n if self.compiled else 0, dtype=dtype)
+
+
+NUMPY = Backend('numpy', _frontier_counts_numpy, _layered_escape_numpy, False)
+NUMBA = None
+if numba is not None:
+    # cache=True keeps the machine code in __pycache__, so workers and later runs
+    # load it instead of compiling again
+    _jit  = numba.njit(cache=True, nogil=True)
+    NUMBA = Backend('numba', _jit(_frontier_counts_loop), _jit(_layered_escape_loop), True)
+
+
+def get_backend(name='auto'):
+    # This function selects the kernels of the S->I pass
+    #
+    # input  : name, 'numba', 'numpy', or 'auto' for Numba when it is installed
+    # output : a Backend
+    if name == 'auto':
+        return NUMBA if NUMBA is not None else NUMPY
+    if name == 'numba':
+        if NUMBA is None:
+            raise ImportError("backend='numba' needs the numba package")
+        return NUMBA
+    if name == 'numpy':
+        return NUMPY
+    raise ValueError(f'unknown backend {name!r}')
@@ -0,0 +1,259 @@
+import numpy as np
+
+from gillespie import rate_from_probability
+from graph_store import open_graph
+from sweep import DEFAULTS
+from vaccination import weekly_mean_doses
+
+# Deterministic approximations of the SIR / SIRS (sigma) / SIRV (doses) simulations,
+# for screening parameter points before running stochastic ensembles on them.
+#
+# The per-step probabilities of the templates become rates (rate_from_probability),
+# the ODEs are integrated with fixed steps (RK4, or exponential steps for the degree
+# classes of the heterogeneous model), and every array carries a leading axis
+# of parameter points, so a whole grid is integrated in one pass of array operations.
+# Dose releases are applied at the end of every day, as CSREngine does, with the
+# expected number of doses of the release schedule.
+#
+# Models, all built from the degrees of the same graph G:
+#   Homogeneous   : well-mixed nodes with the mean degree <k>
+#   Heterogeneous : degree-based mean field, one S,I,R triple per degree class
+#   Pairwise      : S,I,R and pair counts [SS],[SI],...; triples closed with
+#                   [ABC] = kappa [AB][BC]/[B], kappa = <k(k-1)>/<k>^2
+
+
+def _rk4(derivative, y, dt, b, g, s):
+    k1 = derivative(y, b, g, s)
+    k2 = derivative(y + dt / 2 * k1, b, g, s)
+    k3 = derivative(y + dt / 2 * k2, b, g, s)
+    k4 = derivative(y + dt * k3, b, g, s)
+    return y + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+def degree_sequence(G):
+    # degree of every node of a networkx graph, a CSRGraph or a graph_store file
+    return open_graph(G).degree()
+
+
+class Homogeneous():
+    # S' = -b <k> S I / n + s R,  I' = b <k> S I / n - g I,  R' = g I - s R
+
+    nodes = slice(0, 3) # columns of node counts, scaled by the fraction left after vaccination
+    pairs = slice(3, 3)
+
+    def __init__(self, G=None, degrees=None):
+        # input  : G is a networkx graph, a CSRGraph or the path of a graph_store file
+        #        : degrees, the degree sequence instead of G
+        k = np.asarray(degrees if degrees is not None else degree_sequence(G), dtype=float)
+        self.n  = len(k)
+        self.k1 = k.mean()
+
+    def initial(self, infected, P):
+        y = np.zeros((P, 3))
+        y[:, 0], y[:, 1] = self.n - infected, infected
+        return y
+
+    def derivative(self, y, b, g, s):
+        S, I, R = y[:, 0], y[:, 1], y[:, 2]
+        inf = b * self.k1 * S * I / self.n
+        return np.stack([-inf + s * R, inf - g * I, g * I - s * R], axis=1)
+
+    def step(self, y, dt, b, g, s):
+        return _rk4(self.derivative, y, dt, b, g, s)
+
+    def counts(self, y):
+        return y[:, :3]
+
+
+class Heterogeneous():
+    # Degree-based mean field: s_k, i_k, r_k are the S,I,R fractions of the nodes of
+    # degree k, and an S node of degree k meets an infected neighbour on each edge
+    # with probability theta = sum_k (k-1) P(k) i_k / <k> (the edge that infected a
+    # node cannot pass the infection back).
+    #
+    # Graphs with more distinct degrees than max_classes are binned on a log scale,
+    # every bin standing for its mean degree.
+
+    def __init__(self, G=None, degrees=None, max_classes=32):
+        # input  : G, degrees, as in Homogeneous
+        #        : max_classes, number of degree classes above which degrees are binned
+        k = np.asarray(degrees if degrees is not None else degree_sequence(G), dtype=np.int64)
+        self.n = len(k)
+        deg, cnt = np.unique(k, return_counts=True)
+        if len(deg) > max_classes:
+            edges = np.unique(np.round(np.geomspace(1, deg.max() + 1, max_classes)))
+            bins  = np.searchsorted(edges, deg, side='right')
+            tot   = np.bincount(bins, weights=cnt)
+            used  = tot > 0
+            deg   = (np.bincount(bins, weights=cnt * deg) / np.maximum(tot, 1))[used]
+            cnt   = tot[used]
+        self.k  = deg.astype(float)
+        self.pk = cnt / cnt.sum()
+        self.k1 = (self.k * self.pk).sum()
+        K = len(self.k)
+        self.nodes = slice(0, 3 * K)
+        self.pairs = slice(3 * K, 3 * K)
+
+    def initial(self, infected, P):
+        K = len(self.k)
+        y = np.zeros((P, 3 * K))
+        y[:, :K], y[:, K:2 * K] = 1 - infected / self.n, infected / self.n # patient 0 is any node
+        return y
+
+    def _force(self, y, b):
+        # infection hazard b k theta of an S node of every class
+        K = len(self.k)
+        theta = y[:, K:2 * K] @ ((self.k - 1) * self.pk) / self.k1
+        return b[:, None] * self.k * theta[:, None]
+
+    def _advance(self, y, dt, force, g, s):
+        # every node leaves its state with probability 1-exp(-rate dt), rates frozen over dt
+        K = len(self.k)
+        sk, ik, rk = y[:, :K], y[:, K:2 * K], y[:, 2 * K:]
+        inf = sk * -np.expm1(-force * dt)
+        rec = ik * -np.expm1(-g * dt)[:, None]
+        wan = rk * -np.expm1(-s * dt)[:, None]
+        return np.concatenate([sk - inf + wan, ik + inf - rec, rk + rec - wan], axis=1)
+
+    def step(self, y, dt, b, g, s):
+        # The hubs of heavy-tailed graphs make the S->I hazard of their class far larger
+        # than 1/dt, where explicit Runge-Kutta steps blow up. This step is exponential
+        # in each class instead, with the hazard evaluated at the midpoint of the step,
+        # so it stays positive and conserves the nodes at any dt.
+        half = self._advance(y, dt / 2, self._force(y, b), g, s)
+        return self._advance(y, dt, self._force(half, b), g, s)
+
+    def counts(self, y):
+        K = len(self.k)
+        return self.n * np.stack([y[:, c * K:(c + 1) * K] @ self.pk for c in range(3)], axis=1)
+
+
+class Pairwise():
+    # Pair approximation: node counts [S],[I],[R] and ordered pair counts [AB] (an A-B
+    # edge is counted once in [AB], an A-A edge twice in [AA]):
+    #   [S]'  = -b[SI] + s[R]
+    #   [SS]' = -2b[SSI] + 2s[SR]
+    #   [SI]' = b([SSI] - [ISI] - [SI]) - g[SI] + s[RI]
+    #   [SR]' = -b[ISR] + g[SI] - s[SR] + s[RR]
+    #   [II]' = 2b([ISI] + [SI]) - 2g[II]
+    #   [IR]' = b[ISR] + g([II] - [IR]) - s[IR]
+    #   [RR]' = 2g[IR] - 2s[RR]
+    # kappa = (n-1)/n on an n-regular graph, larger on heterogeneous ones.
+
+    nodes = slice(0, 3)
+    pairs = slice(3, 9)
+
+    def __init__(self, G=None, degrees=None):
+        k = np.asarray(degrees if degrees is not None else degree_sequence(G), dtype=float)
+        self.n     = len(k)
+        self.k1    = k.mean()
+        self.kappa = (k * (k - 1)).mean() / self.k1**2 if self.k1 > 0 else 0.0
+
+    def initial(self, infected, P):
+        # pairs of randomly placed states: [AB] = n <k> x_A x_B
+        x = np.array([self.n - infected, infected, 0.0]) / self.n
+        m = self.n * self.k1
+        y = np.zeros((P, 9))
+        y[:, :3] = self.n * x
+        y[:, 3:] = m * np.array([x[0] * x[0], x[0] * x[1], x[0] * x[2], x[1] * x[1], x[1] * x[2], x[2] * x[2]])
+        return y
+
+    def derivative(self, y, b, g, s):
+        S, I, R, SS, SI, SR, II, IR, RR = y.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            over = np.where(S > 0, self.kappa / S, 0.0)
+        SSI, ISI, ISR = SS * SI * over, SI * SI * over, SI * SR * over
+        return np.stack([-b * SI + s * R,
+                         b * SI - g * I,
+                         g * I - s * R,
+                         -2 * b * SSI + 2 * s * SR,
+                         b * (SSI - ISI - SI) - g * SI + s * IR,
+                         -b * ISR + g * SI - s * SR + s * RR,
+                         2 * b * (ISI + SI) - 2 * g * II,
+                         b * ISR + g * (II - IR) - s * IR,
+                         2 * g * IR - 2 * s * RR], axis=1)
+
+    def step(self, y, dt, b, g, s):
+        return _rk4(self.derivative, y, dt, b, g, s)
+
+    def counts(self, y):
+        return y[:, :3]
+
+
+MODELS = {'homogeneous' : Homogeneous, 'heterogeneous' : Heterogeneous, 'pairwise' : Pairwise}
+
+
+def integrate(model, beta, gamma, sigma=0.0, group=None, v_dict=None, interval=7, ramp_day=20,
+              schedule=None, tmax=30, substeps=10, infected=1):
+    # This function integrates a model for every parameter point at once
+    #
+    # input  : model, a Homogeneous, Heterogeneous or Pairwise model of the graph
+    #        : beta, gamma, sigma, per-step probabilities as in CSREngine
+    #        : group, vaccine release size of the weekly schedule (None for no vaccine)
+    #        : v_dict, {1 : e1, 2 : e2} dose efficacies, {1 : 0.85, 2 : 0.9} by default
+    #        : interval, ramp_day, weekly schedule of the releases
+    #        : schedule, release plan with mean_doses(t) replacing the weekly one
+    #        : tmax, last time step; substeps, RK4 steps per day
+    #        : infected, number of nodes infected at time step 1
+    #          beta, gamma, sigma, group, the efficacies, interval and ramp_day may be
+    #          arrays; they are broadcast against each other to P parameter points
+    # output : (P, tmax, 4) array of the expected S,I,R,V counts of time steps 1..tmax
+    v_dict = v_dict if v_dict is not None else {1 : 0.85, 2 : 0.9}
+    vaccine = group is not None or schedule is not None
+    beta, gamma, sigma, e1, e2, grp, iv, ramp = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in
+          (beta, gamma, sigma, v_dict[1], v_dict[2], group if group is not None else 0, interval, ramp_day)))
+    P = len(beta)
+    b, g, s = rate_from_probability(beta), rate_from_probability(gamma), rate_from_probability(sigma)
+
+    days = np.arange(1, tmax + 1)
+    if schedule is not None:
+        doses = np.broadcast_to(np.array([schedule.mean_doses(t) for t in days]), (P, tmax))
+    elif vaccine:
+        doses = weekly_mean_doses(days[None, :], grp[:, None], iv[:, None], ramp[:, None])
+    n = model.n
+
+    # dose bookkeeping, as fractions of the nodes: no dose; one dose, not protected;
+    # one dose, protected; protected
+    a0, a1, a1v, V = np.ones(P), np.zeros(P), np.zeros(P), np.zeros(P)
+    y   = model.initial(infected, P)
+    out = np.zeros((P, tmax, 4))
+    out[:, 0, :3] = model.counts(y)
+    dt = 1.0 / substeps
+    for t in range(1, tmax):
+        for _ in range(substeps):
+            y = model.step(y, dt, b, g, s)
+        if vaccine:
+            # doses go uniformly to the nodes with fewer than two, whatever their state,
+            # so every unprotected state loses the same fraction x of its nodes
+            eligible = a0 + a1 + a1v
+            with np.errstate(invalid='ignore', divide='ignore'):
+                p = np.where(eligible > 0, np.minimum(doses[:, t - 1] / n / eligible, 1.0), 0.0)
+                new_v = p * (a0 * e1 + a1 * e2)
+                x = np.where(V < 1, new_v / (1 - V), 0.0)
+            a0, a1, a1v = a0 * (1 - p), a1 * (1 - p) + p * a0 * (1 - e1), a1v * (1 - p) + p * a0 * e1
+            V = V + new_v
+            y[:, model.nodes] *= (1 - x)[:, None]
+            y[:, model.pairs] *= ((1 - x)**2)[:, None]
+        out[:, t, :3] = model.counts(y)
+        out[:, t, 3]  = n * V
+    return out
+
+
+def screen(G, points, model='pairwise', tmax=30, substeps=10, infected=1):
+    # This function estimates the vaccine study at every point of a parameter sweep
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a graph_store file
+    #        : points, parameter dicts as for sweep.run_sweep, e.g. from sweep.grid()
+    #        : model, 'homogeneous', 'heterogeneous' or 'pairwise'
+    # output : (len(points), tmax, 4) array of expected S,I,R,V counts, in the order of points
+    #
+    # e.g. keep the points whose estimated epidemic peak is below a threshold:
+    #   est  = screen(G, pts)
+    #   keep = [p for p, peak in zip(pts, est[:, :, 1].max(axis=1)) if peak < 100]
+    points = [dict(DEFAULTS, **p) for p in points]
+    col = lambda name: np.array([p[name] for p in points], dtype=float)
+    eff = np.array([p['efficacy'] for p in points], dtype=float).reshape(len(points), 2)
+    return integrate(MODELS[model](G), col('beta'), col('gamma'), col('sigma'), col('group'),
+                     {1 : eff[:, 0], 2 : eff[:, 1]}, col('interval'), col('ramp_day'),
+                     tmax=tmax, substeps=substeps, infected=infected)
@@ -0,0 +1,271 @@
+import numpy as np
+
+from csr_engine import CSREngine, log_escape
+from kernels import spans
+
+
+class LayeredGraph():
+    # Multilayer contact graph that can be edited in place.
+    #
+    # Rows are stored like a CSR, but every row has spare capacity: the neighbours of
+    # node i are nbr[start[i]:start[i]+length[i]] and their layer ids are the same
+    # slice of lay, with room for cap[i] entries. Adding edges fills the spare room;
+    # a row that runs out of it moves to the end of the storage with doubled capacity.
+    # Removing edges compacts only the rows they touch. An edit therefore costs the
+    # degrees of the nodes it touches, never a rebuild of the graph.
+
+    def __init__(self, n, u, v, layer):
+        # input  : n, number of nodes, labelled 0..n-1
+        #        : u, v, arrays of edge endpoints
+        #        : layer, layer id (0,1,2,...) of every edge, e.g. the CAVE, PARTITION,
+        #          BRIDGE layers of caveman_partition_edges
+        self.n      = n
+        self.start  = np.zeros(n, dtype=np.int64)
+        self.length = np.zeros(n, dtype=np.int64)
+        self.cap    = np.zeros(n, dtype=np.int64)
+        self.nbr    = np.zeros(0, dtype=np.int32 if n < 2**31 else np.int64)
+        self.lay    = np.zeros(0, dtype=np.int16)
+        self.end    = 0 # storage in use, rows included
+        self.waste  = 0 # storage of rows that moved away
+        self.layers = 0 # number of layer ids seen so far
+        self.add_edges(u, v, layer)
+
+    @classmethod
+    def from_layers(cls, n, layers):
+        # This function builds the graph from {layer id : (u, v)} edge arrays
+        ids = sorted(layers)
+        u = np.concatenate([np.asarray(layers[k][0], dtype=np.int64) for k in ids] or [np.zeros(0, np.int64)])
+        v = np.concatenate([np.asarray(layers[k][1], dtype=np.int64) for k in ids] or [np.zeros(0, np.int64)])
+        layer = np.repeat(ids, [len(layers[k][0]) for k in ids])
+        return cls(n, u, v, layer)
+
+    def degree(self):
+        # number of neighbours of every node, over all layers
+        return self.length.copy()
+
+    def number_of_edges(self):
+        return int(self.length.sum()) // 2
+
+    def neighbours(self, node):
+        # output : neighbours of node and the layer of each of those edges
+        s = slice(self.start[node], self.start[node] + self.length[node])
+        return self.nbr[s], self.lay[s]
+
+    def slots(self, rows):
+        # storage slots of the neighbours of the given nodes
+        return spans(self.start[rows], self.length[rows])
+
+    def _directed(self, u, v, layer):
+        u = np.asarray(u, dtype=np.int64)
+        v = np.asarray(v, dtype=np.int64)
+        layer = np.broadcast_to(np.asarray(layer, dtype=np.int64), u.shape)
+        keep = u != v
+        a = np.concatenate([u[keep], v[keep]])
+        b = np.concatenate([v[keep], u[keep]])
+        l = np.concatenate([layer[keep], layer[keep]])
+        order = np.argsort(a, kind='stable')
+        return a[order], b[order], l[order]
+
+    def _reserve(self, extra):
+        # grow the storage arrays geometrically so appends are amortized O(1)
+        if self.end + extra > len(self.nbr):
+            size = max(2 * len(self.nbr), self.end + extra, 16)
+            for name in ('nbr', 'lay'):
+                old = getattr(self, name)
+                new = np.zeros(size, dtype=old.dtype)
+                new[:self.end] = old[:self.end]
+                setattr(self, name, new)
+
+    def _move(self, rows, cap):
+        # move rows to the end of the storage, with the new capacities cap
+        self._reserve(int(cap.sum()))
+        start = self.end + np.cumsum(cap) - cap
+        old   = self.slots(rows)
+        new   = spans(start, self.length[rows])
+        self.nbr[new] = self.nbr[old]
+        self.lay[new] = self.lay[old]
+        self.waste   += int(self.cap[rows].sum())
+        self.start[rows], self.cap[rows] = start, cap
+        self.end += int(cap.sum())
+
+    def add_edges(self, u, v, layer):
+        # This function adds undirected edges (u[k], v[k]) to the given layer(s)
+        #
+        # input  : u, v, arrays of edge endpoints
+        #        : layer, layer id, one for all edges or one per edge
+        a, b, l = self._directed(u, v, layer)
+        if len(a) == 0:
+            return
+        self.layers = max(self.layers, int(l.max()) + 1)
+        rows, first, cnt = np.unique(a, return_index=True, return_counts=True)
+        full = self.length[rows] + cnt > self.cap[rows]
+        if full.any():
+            need = self.length[rows[full]] + cnt[full]
+            self._move(rows[full], np.maximum(2 * need, 4))
+        pos = self.start[a] + self.length[a] + np.arange(len(a)) - np.repeat(first, cnt)
+        self.nbr[pos] = b
+        self.lay[pos] = l
+        self.length[rows] += cnt
+        if self.waste > self.end // 2:
+            self.compact()
+
+    def remove_edges(self, u, v, layer):
+        # This function removes undirected edges (u[k], v[k]) from the given layer(s);
+        # every copy of an edge in its layer goes, and edges that are absent are ignored
+        a, b, l = self._directed(u, v, layer)
+        L = max(self.layers, 1)
+        a, b, l = a[l < L], b[l < L], l[l < L] # layers never added hold no edges
+        if len(a) == 0:
+            return
+        rows  = np.unique(a)
+        slots = self.slots(rows)
+        rowid = np.repeat(np.arange(len(rows)), self.length[rows])
+        have  = (rows[rowid] * self.n + self.nbr[slots]) * L + self.lay[slots]
+        drop  = np.isin(have, (a * self.n + b) * L + l)
+        kept, kid = slots[~drop], rowid[~drop]
+        nbr, lay  = self.nbr[kept], self.lay[kept]
+        length    = np.bincount(kid, minlength=len(rows))
+        pos = spans(self.start[rows], length)
+        self.nbr[pos] = nbr
+        self.lay[pos] = lay
+        self.length[rows] = length
+
+    def compact(self):
+        # This function repacks all rows, dropping the storage left behind by moved rows
+        cap   = self.length + self.length // 2 + 2
+        start = np.cumsum(cap) - cap
+        old   = spans(self.start, self.length)
+        new   = spans(start, self.length)
+        nbr   = np.zeros(int(cap.sum()), dtype=self.nbr.dtype)
+        lay   = np.zeros(int(cap.sum()), dtype=self.lay.dtype)
+        nbr[new], lay[new] = self.nbr[old], self.lay[old]
+        self.nbr, self.lay = nbr, lay
+        self.start, self.cap = start, cap
+        self.end, self.waste = len(nbr), 0
+
+    def state(self):
+        # This function returns the storage of the graph, for checkpoints of runs that edit it
+        return {'start' : self.start.copy(), 'length' : self.length.copy(), 'cap' : self.cap.copy(),
+                'nbr' : self.nbr[:self.end].copy(), 'lay' : self.lay[:self.end].copy(),
+                'end' : self.end, 'waste' : self.waste, 'layers' : self.layers}
+
+    def restore(self, state):
+        # This function resumes from the output of state(), on a graph with as many nodes
+        self.start[:], self.length[:], self.cap[:] = state['start'], state['length'], state['cap']
+        self.nbr = np.asarray(state['nbr'], dtype=self.nbr.dtype)
+        self.lay = np.asarray(state['lay'], dtype=self.lay.dtype)
+        self.end, self.waste, self.layers = int(state['end']), int(state['waste']), int(state['layers'])
+
+    def edges(self, layer=None):
+        # output : u, v arrays of the undirected edges (u < v), of one layer or of all layers
+        rows = np.repeat(np.arange(self.n), self.length)
+        slot = spans(self.start, self.length)
+        u, v = rows, self.nbr[slot].astype(np.int64)
+        keep = u < v
+        if layer is not None:
+            keep &= self.lay[slot] == layer
+        return u[keep], v[keep]
+
+
+class MultilayerEngine(CSREngine):
+    # CSREngine on a LayeredGraph: every layer has its own transmission probability,
+    # and scheduled events edit the layers or their rates while the epidemic runs.
+    #
+    # An S node escapes its infected contacts on layer l with probability 1-beta_l
+    # each, so it is infected with probability 1 - prod_l (1-beta_l)^k_l.
+    #
+    # events maps a time step to the list of changes applied at the start of it:
+    #   ('add',    layer, u, v) : add edges (u[k], v[k]) to layer
+    #   ('remove', layer, u, v) : remove them, e.g. switching bridge edges off
+    #   ('beta',   layer, p)    : set the transmission probability of layer,
+    #                             p = 0 closes it (e.g. school closures)
+    #
+    # Gatherings without their own beta use the largest layer probability, as it stands
+    # after the events of the step (closing every layer also stops such gatherings).
+
+    def __init__(self, G, layer_beta, gamma, sigma=0.0, rng=None, events=None, **kw):
+        # input  : G is a LayeredGraph
+        #        : layer_beta, transmission probability of every layer, a list indexed
+        #          by layer id or a {layer id : beta} dict
+        #        : gamma, sigma, rng, as in CSREngine
+        #        : events, {time step : [change, ...]} as described above
+        #        : kw, vaccination and gathering arguments of CSREngine
+        if isinstance(layer_beta, dict):
+            beta = np.zeros(max(max(layer_beta) + 1, G.layers))
+            beta[list(layer_beta)] = list(layer_beta.values())
+        else:
+            beta = np.array(layer_beta, dtype=float)
+        if len(beta) < G.layers:
+            raise ValueError(f'layer_beta has {len(beta)} layers, the graph has {G.layers}')
+        self.layer_beta = beta
+        self.events     = events if events is not None else {}
+        super().__init__(G, self._gathering_beta(), gamma, sigma=sigma, rng=rng, **kw)
+
+    def _gathering_beta(self):
+        # base beta of the gatherings, the largest layer probability
+        return float(self.layer_beta.max()) if len(self.layer_beta) else 0.0
+
+    @staticmethod
+    def _as_graph(G):
+        if not isinstance(G, LayeredGraph):
+            raise TypeError('MultilayerEngine needs a LayeredGraph')
+        return G
+
+    def _apply_events(self):
+        for change in self.events.get(self.t, []):
+            kind, layer = change[0], change[1]
+            if kind == 'add':
+                self.csr.add_edges(change[2], change[3], layer)
+            elif kind == 'remove':
+                self.csr.remove_edges(change[2], change[3], layer)
+            elif kind == 'beta':
+                if layer >= len(self.layer_beta):
+                    self.layer_beta = np.concatenate([self.layer_beta, np.zeros(layer + 1 - len(self.layer_beta))])
+                self.layer_beta[layer] = change[2]
+                self.beta = self._gathering_beta()
+            else:
+                raise ValueError(f'unknown event {kind!r}')
+        if len(self.layer_beta) < self.csr.layers:
+            raise ValueError(f'no transmission probability for layer {self.csr.layers - 1}')
+
+    def _signature(self):
+        # the graph and the layer rates are edited by events, so they are part of the state
+        return [self.csr.n, self.gamma, self.sigma]
+
+    def state(self):
+        # This function adds the edited graph and layer rates to the state of CSREngine
+        return dict(super().state(), graph=self.csr.state(), layer_beta=self.layer_beta.copy())
+
+    def restore(self, state):
+        super().restore(state)
+        self.csr.restore(state['graph'])
+        self.layer_beta = np.array(state['layer_beta'], dtype=float)
+        self.beta       = self._gathering_beta()
+
+    def _new_scratch(self):
+        # per-node log escape sums of the compiled S->I kernel
+        return self.backend.new_scratch(self.csr.n, np.float64)
+
+    def _escape(self):
+        # log escape probability of the S neighbours of the infected nodes, summed
+        # over their infected contacts on every layer with a nonzero rate
+        G = self.csr
+        if self.profiler.enabled:
+            self.profiler.count('edges_examined', G.length[self.infected].sum())
+        return self.backend.layered_escape(G.start, G.length, G.nbr, G.lay, log_escape(self.layer_beta),
+                                           self.z, self.infected, self.scratch)
+
+    def step(self):
+        # This function applies the changes scheduled for this time step, then steps
+        t0 = self.profiler.clock()
+        self._apply_events()
+        self.profiler.add('events', t0)
+        super().step()
+
+
+def Multilayer_Simulation(G, layer_beta, gamma, sigma=0.0, events=None, tmax=None, rng=None, **kw):
+    # This function runs the multilayer counterpart of SIR_Simulation
+    #
+    # input  : see MultilayerEngine
+    # output : SimulationResult with the S(t),I(t),R(t)[,V(t)] time series
+    return MultilayerEngine(G, layer_beta, gamma, sigma=sigma, rng=rng, events=events, **kw).run(tmax=tmax)
@@ -0,0 +1,345 @@
+import multiprocessing as mp
+import os
+import threading
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from csr_engine import S, I, R, V, log_escape
+from graph_store import open_graph
+from kernels import NUMPY
+from results import SimulationResult
+from vaccination import VaccinationScheduler, WeeklyRelease
+
+
+def partition_graph(G, parts, community=None):
+    # This function splits the nodes of a graph into parts along community boundaries
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a saved graph
+    #        : parts, number of partitions
+    #        : community, community id of every node; node_attrs['community'] (set by the
+    #          caveman/partition generators) when None, else one community per node
+    # output : partition index of every node (int32)
+    #
+    # Communities are never split. They are taken in id order, which keeps neighbouring
+    # caves and partition blocks together, and cut into `parts` runs of about equal work,
+    # degree+1 summed over the nodes.
+    csr = open_graph(G)
+    if community is None:
+        community = csr.node_attrs.get('community', np.arange(csr.n))
+    community = np.asarray(community, dtype=np.int64)
+    work  = np.bincount(community, weights=csr.degree() + 1.0)
+    done  = np.cumsum(work) - work # work of the communities before each one
+    owner = np.minimum((done * parts / max(work.sum(), 1.0)).astype(np.int64), parts - 1)
+    return owner[community].astype(np.int32)
+
+
+class _Shared():
+    # numpy arrays in named shared memory blocks, which worker processes attach by name
+
+    def __init__(self):
+        self.blocks = {}
+        self.specs  = {}
+
+    def create(self, name, shape, dtype):
+        dtype = np.dtype(dtype)
+        shm   = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.blocks[name] = shm
+        self.specs[name]  = (shm.name, shape, dtype.str)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def close(self):
+        # unlink first: the names must go even if a view of a block is still alive
+        for shm in self.blocks.values():
+            shm.unlink()
+            try:
+                shm.close()
+            except BufferError:
+                pass # unmapped once the last array over it is dropped
+        self.blocks = {}
+
+
+def _release(shared, workers):
+    # This function stops the workers that are still alive and frees the shared memory of
+    # an engine; it is the engine's finalizer, so it must not reference the engine
+    for w in workers:
+        if w.is_alive():
+            w.terminate()
+        w.join()
+    workers.clear()
+    shared.close()
+
+
+def _attach(specs):
+    # worker side of _Shared: the same arrays, mapped from the blocks of the parent
+    blocks, arrays = [], {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return blocks, arrays
+
+
+def _worker(k, graph, specs, base, barrier, beta, gamma, sigma, seed):
+    # This function runs the steps of partition k until the parent sets the stop flag
+    #
+    # Every step has two phases between barriers, as seen from partition k:
+    #   1. from the old states (shared z), gather the S neighbours of its infected nodes;
+    #      those it owns count locally, the others go to its outbox, grouped by owner
+    #   2. read the outbox entries addressed to it, draw its own transitions and write
+    #      them to z (no worker reads z in this phase, so the update stays synchronous)
+    # The parent runs vaccination, observers and the stop test between steps.
+    blocks, a = _attach(specs)
+    try:
+        z, part, counts, control = a['z'], a['part'], a['counts'], a['control']
+        out_nodes, out_k, out_off = a['out_nodes'], a['out_k'], a['out_off']
+        csr    = open_graph(graph)
+        rng    = np.random.default_rng(seed)
+        escape = log_escape(beta)
+        own    = np.flatnonzero(part == k)
+        infected  = own[z[own] == I]
+        recovered = own[z[own] == R] if sigma > 0 else np.zeros(0, dtype=np.int64)
+        parts  = len(counts)
+        while True:
+            barrier.wait()
+            if control[0]:
+                break
+            infected = infected[z[infected] == I] # the parent may have vaccinated some
+
+            # phase 1: infection pressure of the old state
+            nodes, hits = NUMPY.frontier_counts(csr.indptr, csr.indices, z, infected, None)
+            owner  = part[nodes]
+            local  = owner == k
+            remote = np.flatnonzero(~local)
+            remote = remote[np.argsort(owner[remote], kind='stable')]
+            out_off[k, 1:] = np.cumsum(np.bincount(owner[remote], minlength=parts))
+            out_nodes[base[k]:base[k] + len(remote)] = nodes[remote]
+            out_k[base[k]:base[k] + len(remote)]     = hits[remote]
+            barrier.wait()
+
+            # phase 2: boundary events addressed to k, then the transitions of its nodes
+            inbox = [(out_nodes[base[j] + out_off[j, k]:base[j] + out_off[j, k + 1]],
+                      out_k[base[j] + out_off[j, k]:base[j] + out_off[j, k + 1]]) for j in range(parts) if j != k]
+            cand, inv = np.unique(np.concatenate([nodes[local]] + [n for n, _ in inbox]), return_inverse=True)
+            hits  = np.bincount(inv, weights=np.concatenate([hits[local]] + [h for _, h in inbox]), minlength=len(cand))
+            new_i = cand[rng.random(len(cand)) < -np.expm1(hits * escape)]
+
+            healed = rng.random(len(infected)) < gamma
+            new_r  = infected[healed]
+            if sigma > 0:
+                recovered = recovered[z[recovered] == R]
+                waned     = rng.random(len(recovered)) < sigma
+                new_s     = recovered[waned]
+                recovered = np.concatenate([recovered[~waned], new_r])
+                z[new_s]  = S
+            else:
+                new_s = recovered # always empty for SIR
+            z[new_i] = I
+            z[new_r] = R
+            infected = np.concatenate([infected[~healed], new_i])
+            counts[k, S] += len(new_s) - len(new_i)
+            counts[k, I] += len(new_i) - len(new_r)
+            counts[k, R] += len(new_r) - len(new_s)
+            barrier.wait()
+    except BaseException:
+        barrier.abort() # wake the parent and the other workers instead of leaving them waiting
+        raise
+    finally:
+        for shm in blocks:
+            shm.close()
+
+
+class PartitionedEngine():
+    # Domain-decomposed SIR/SIRS/SIRV: one worker process per partition of the graph.
+    #
+    # The graph is split along community boundaries (partition_graph) and every worker
+    # steps the nodes of its partition. The node states, per-partition counts and the
+    # outboxes of boundary infection events live in shared memory; the only data that
+    # crosses partitions in a step is, for every S node next to infected nodes of another
+    # partition, its node id and infected-contact count. Steps stay synchronous: all
+    # pressures are computed from the old states before any state is written.
+    #
+    # Every partition draws from its own generator (children of rng), so a run matches
+    # CSREngine in distribution, not draw for draw, and depends on the number of parts.
+    # A saved graph (graph_store path) is memory-mapped by the workers, not copied.
+    #
+    # Use it as a context manager, or call close(), to release the shared memory; a
+    # dropped engine releases it (and stops its workers) when garbage collected.
+
+    def __init__(self, G, beta, gamma, sigma=0.0, parts=None, rng=None, community=None,
+                 group=None, v_dict=None, interval=7, ramp_day=20, schedule=None, policy=None,
+                 timeout=600):
+        # input  : G is a networkx graph, a CSRGraph or the path of a saved graph
+        #        : beta, gamma, sigma, per-step probabilities as in CSREngine
+        #        : parts, number of partitions and worker processes (one per core when None)
+        #        : rng, numpy Generator or seed (None draws fresh entropy)
+        #        : community, community id of every node (see partition_graph)
+        #        : group, v_dict, interval, ramp_day, schedule, policy, vaccination as in CSREngine
+        #        : timeout, seconds a step phase may take before the run is declared hung
+        self.graph   = G if isinstance(G, (str, os.PathLike)) else open_graph(G)
+        self.csr     = open_graph(self.graph)
+        self.beta    = beta
+        self.gamma   = gamma
+        self.sigma   = sigma
+        self.parts   = parts or os.cpu_count() or 1
+        self.rng     = rng if isinstance(rng, np.random.Generator) else np.random.default_rng(rng)
+        self.timeout = timeout
+        self.t       = 1
+
+        csr = self.csr
+        n   = csr.n
+        self.shared   = _Shared()
+        self._workers = [] # live worker processes, kept in place for the finalizer
+        self._finalizer = weakref.finalize(self, _release, self.shared, self._workers)
+        try:
+            self._allocate(csr, community)
+        except BaseException:
+            self._finalizer() # no segment outlives a failed constructor
+            raise
+
+        if schedule is None and group is not None:
+            schedule = WeeklyRelease(group, interval, ramp_day)
+        self.vaccination = VaccinationScheduler(n, schedule, v_dict, policy) if schedule is not None else None
+
+    def _allocate(self, csr, community):
+        # This function creates the shared arrays: states, partition, counts and outboxes
+        n = csr.n
+        self.z      = self.shared.create('z', (n,), np.int8) # all nodes S, initially
+        self.z[:]   = S
+        self.part   = self.shared.create('part', (n,), np.int32)
+        self.part[:] = partition_graph(csr, self.parts, community)
+        self.pcounts = self.shared.create('counts', (self.parts, 4), np.int64) # S,I,R,V per partition
+        self.pcounts[:] = 0
+        self.pcounts[:, S] = np.bincount(self.part, minlength=self.parts)
+        self.control = self.shared.create('control', (1,), np.int64)
+
+        # outbox k holds at most one entry per edge from partition k to another one
+        cross = self.part[csr.row] != self.part[csr.indices]
+        cap   = np.bincount(self.part[csr.row[cross]], minlength=self.parts)
+        self.cut_edges = int(cross.sum()) // 2
+        self.base = np.concatenate([[0], np.cumsum(cap)[:-1]]).astype(np.int64)
+        self.shared.create('out_nodes', (int(cap.sum()),), np.int64)
+        self.shared.create('out_k', (int(cap.sum()),), np.int64)
+        self.shared.create('out_off', (self.parts, self.parts + 1), np.int64)[:] = 0
+
+    @property
+    def counts(self):
+        # S,I,R,V node counts of the whole graph
+        return self.pcounts.sum(axis=0)
+
+    def seed_infection(self, nodes=None):
+        # This function makes patient(s) 0; a random node when nodes is None
+        if nodes is None:
+            nodes = self.rng.integers(self.csr.n, size=1)
+        nodes = np.unique(np.asarray(nodes, dtype=np.int64))
+        nodes = nodes[self.z[nodes] == S]
+        self.z[nodes] = I
+        np.add.at(self.pcounts, (self.part[nodes], S), -1)
+        np.add.at(self.pcounts, (self.part[nodes], I), 1)
+
+    def _vaccinate(self):
+        # doses are handed out by the parent between steps, while the workers wait
+        v_ch, protected = self.vaccination.release(self.t, self.rng)
+        new_v = protected[self.z[protected] != V]
+        np.add.at(self.pcounts, (self.part[new_v], self.z[new_v]), -1)
+        np.add.at(self.pcounts, (self.part[new_v], V), 1)
+        self.z[new_v] = V
+
+    def active(self):
+        # This function tells whether another step can change anything
+        return self.counts[I] > 0 or (self.vaccination is not None and not self.vaccination.exhausted(self.t))
+
+    def _start(self):
+        ctx     = mp.get_context()
+        barrier = ctx.Barrier(self.parts + 1, timeout=self.timeout)
+        seeds   = np.random.SeedSequence(self.rng.integers(2**63)).spawn(self.parts)
+        self.control[0] = 0
+        workers = [ctx.Process(target=_worker, daemon=True,
+                               args=(k, self.graph, self.shared.specs, self.base, barrier,
+                                     self.beta, self.gamma, self.sigma, seeds[k]))
+                   for k in range(self.parts)]
+        self._workers.extend(workers)
+        for w in workers:
+            w.start()
+        return barrier, workers
+
+    def _stop(self, barrier, workers):
+        self.control[0] = 1
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        for w in workers:
+            w.join(self.timeout)
+            if w.is_alive():
+                w.terminate()
+                w.join()
+        self._workers.clear()
+
+    def step(self, barrier):
+        # This function advances every partition by one synchronous time step
+        try:
+            for _ in range(3): # start, after the pressure phase, after the update phase
+                barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError('a partition worker failed or timed out') from None
+        if self.vaccination is not None:
+            self._vaccinate()
+        self.t += 1
+
+    def run(self, observers=None, snapshots=False, tmax=None, steady=None):
+        # This function runs the simulation over the partition workers, until no node is
+        # infected and no dose is left, or until time step tmax
+        #
+        # input  : observers, objects whose observe(t,z) is called every time step, in the
+        #          parent while the workers wait
+        #        : snapshots, keep a copy of the state array of every time step
+        #        : tmax, last time step
+        #        : steady, a steady_state.SteadyState, as in CSREngine.run
+        # output : SimulationResult with the S(t),I(t),R(t)[,V(t)] time series
+        observers = observers or []
+        vaccine   = self.vaccination is not None
+        if self.counts[I] == 0:
+            self.seed_infection()
+        series = [self.counts]
+        Zt     = [self.z.copy()] if snapshots else None
+        for obs in observers:
+            obs.observe(self.t, self.z)
+        stop = None
+        if steady is not None and steady.start(self.csr.n, np.stack(series)[:, :4 if vaccine else 3]):
+            stop = 'steady'
+        barrier, workers = self._start()
+        try:
+            while stop is None and self.active() and (tmax is None or self.t < tmax):
+                self.step(barrier)
+                series.append(self.counts)
+                if snapshots:
+                    Zt.append(self.z.copy())
+                for obs in observers:
+                    obs.observe(self.t, self.z)
+                if steady is not None and steady.update(series[-1][:4 if vaccine else 3]):
+                    stop = 'steady'
+        finally:
+            self._stop(barrier, workers)
+        stop   = stop or ('horizon' if self.active() else 'extinct')
+        series = np.stack(series)
+        return SimulationResult(list(series[:, S]), list(series[:, I]), list(series[:, R]),
+                                list(series[:, V]) if vaccine else None, snapshots=Zt, stop=stop)
+
+    def close(self):
+        # This function releases the shared memory; z and the counts stay readable as copies
+        #
+        # An engine that is dropped without close() is released by its finalizer, which
+        # also terminates any worker left running.
+        if self.shared.blocks:
+            self.z, self.pcounts = self.z.copy(), self.pcounts.copy()
+            self.part = self.part.copy()
+            self.control = self.control.copy()
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,102 @@
+import time
+
+
+class Profiler():
+    # Per-phase timers and counters of a simulation, step by step.
+    #
+    # The simulations bracket every phase with
+    #     t0 = prof.clock(); ...phase...; prof.add('phase', t0)
+    # and report counts with prof.count('name', value). end_step(t) closes a step:
+    # its record {'t', 'seconds' : {phase : s}, 'counters' : {name : value}} is
+    # added to the totals and passed to every callback.
+    #
+    # Counters used by the simulations:
+    #   edges_examined : adjacency entries (or overlay contacts) visited by S->I
+    #   transmissions  : S->I transitions
+    #   rng_draws      : uniforms drawn for transition coin flips
+    #   doses          : vaccine doses handed out
+
+    enabled = True
+
+    def __init__(self, callbacks=None, keep_steps=False):
+        # input  : callbacks, functions called with the record of every step
+        #        : keep_steps, also keep every step record for report()
+        self.clock     = time.perf_counter
+        self.callbacks = list(callbacks or [])
+        self.records   = [] if keep_steps else None
+        self.seconds   = {}
+        self.calls     = {}
+        self.counters  = {}
+        self.steps     = 0
+        self._seconds  = {} # phases of the current step
+        self._counters = {}
+
+    def add(self, phase, t0):
+        # This function charges the time since t0 to phase
+        self._seconds[phase] = self._seconds.get(phase, 0.0) + self.clock() - t0
+
+    def count(self, name, value=1):
+        self._counters[name] = self._counters.get(name, 0) + int(value)
+
+    def end_step(self, t):
+        # This function closes time step t
+        record = {'t' : t, 'seconds' : self._seconds, 'counters' : self._counters}
+        for phase, s in self._seconds.items():
+            self.seconds[phase] = self.seconds.get(phase, 0.0) + s
+            self.calls[phase]   = self.calls.get(phase, 0) + 1
+        for name, c in self._counters.items():
+            self.counters[name] = self.counters.get(name, 0) + c
+        self.steps += 1
+        if self.records is not None:
+            self.records.append(record)
+        for cb in self.callbacks:
+            cb(record)
+        self._seconds, self._counters = {}, {}
+
+    def report(self):
+        # This function returns the totals as plain data (JSON serializable)
+        #
+        # output : {'steps', 'seconds', 'phases' : {phase : {'seconds', 'calls', 'share'}},
+        #           'counters', 'per_step' : {name : value / steps}[, 'records']}
+        total = sum(self.seconds.values())
+        out = {'steps'    : self.steps,
+               'seconds'  : total,
+               'phases'   : {p : {'seconds' : s, 'calls' : self.calls[p], 'share' : s / total if total else 0.0}
+                             for p, s in sorted(self.seconds.items(), key=lambda x: -x[1])},
+               'counters' : dict(self.counters),
+               'per_step' : {k : v / self.steps for k, v in self.counters.items()} if self.steps else {}}
+        if self.records is not None:
+            out['records'] = self.records
+        return out
+
+    def summary(self):
+        # This function formats the report as a table
+        rep   = self.report()
+        lines = [f"{rep['steps']} steps, {rep['seconds']:.4f} s in timed phases"]
+        for p, r in rep['phases'].items():
+            lines.append(f"  {p:14} {r['seconds']:10.4f} s {100 * r['share']:6.1f} %")
+        for k, v in rep['counters'].items():
+            lines.append(f"  {k:14} {v:12d} total {rep['per_step'][k]:14.1f} per step")
+        return '\n'.join(lines)
+
+
+class NullProfiler():
+    # Stand-in used when profiling is off: every hook is an empty call, and work that
+    # only feeds a counter is skipped behind `if prof.enabled`.
+
+    enabled = False
+
+    def clock(self):
+        return 0.0
+
+    def add(self, phase, t0):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def end_step(self, t):
+        pass
+
+
+NULL = NullProfiler()
@@ -0,0 +1,164 @@
+import glob
+import os
+
+import numpy as np
+
+CODES  = {'S' : 0, 'I' : 1, 'R' : 2, 'V' : 3}
+COUNTS = ('t', 'S', 'I', 'R', 'V')      # columns of the counts chunks
+EVENTS = ('t', 'node', 'old', 'new')    # columns of the events chunks, old/new are state codes
+
+
+def _as_codes(z):
+    # int8 state codes of a state array, or of a list/dict of 'S','I','R','V' labels
+    if isinstance(z, np.ndarray):
+        return z
+    return np.fromiter((CODES[z[i]] for i in range(len(z))), dtype=np.int8, count=len(z))
+
+
+class ResultSink():
+    # Append-only, chunked store of the results of a run.
+    #
+    # Per-step S,I,R,V counts (and, with events=True, one row per node state change)
+    # are buffered in fixed-size arrays and written as numbered chunk files in the
+    # directory `path`, so memory stays at one chunk whatever the horizon. Every chunk
+    # is written to a temporary name and renamed, so read_counts/read_events can be
+    # run on the directory while the simulation is still writing to it.
+    #
+    # It is an observer: pass it in observers= of a simulation, or call record()
+    # directly with counts that are already known. Given the engine as source, it
+    # records the engine's maintained counters, so a step costs O(1) without events;
+    # otherwise it counts the states, O(N) per step (fine for the label-dict templates,
+    # whose steps are O(N) anyway).
+
+    def __init__(self, path, chunk=4096, events=False, format='npz', source=None):
+        # input  : path, output directory, created if needed; new chunks are numbered
+        #          after the ones already in it
+        #        : chunk, rows per chunk file
+        #        : events, also record (t, node, old, new) for every node state change
+        #        : format, 'npz' (numpy) or 'arrow' (Arrow IPC files, needs pyarrow)
+        #        : source, object whose counts attribute holds the S,I,R,V counts of the
+        #          observed step, e.g. the CSREngine, MultilayerEngine or PartitionedEngine
+        #          being run (None: count the states of z)
+        if format not in ('npz', 'arrow'):
+            raise ValueError(f'unknown format {format!r}')
+        if format == 'arrow':
+            import pyarrow # fail at construction rather than at the first flush
+        os.makedirs(path, exist_ok=True)
+        self.path   = path
+        self.chunk  = chunk
+        self.format = format
+        self.source = source
+        self.seq    = {kind : len(_chunks(path, kind)) for kind in ('counts', 'events')}
+
+        self.rows   = np.zeros((chunk, len(COUNTS)), dtype=np.int64)
+        self.filled = 0
+
+        self.events = events
+        self.prev   = None # states of the previous observed step
+        self.ev     = []   # pending (t, node, old, new) column blocks
+        self.ev_len = 0
+
+    def record(self, t, counts):
+        # This function appends the S,I,R,V counts of time step t
+        self.rows[self.filled, 0]  = t
+        self.rows[self.filled, 1:] = counts
+        self.filled += 1
+        if self.filled == self.chunk:
+            self._flush_counts()
+
+    def observe(self, t, z):
+        # input  : z, int8 state array, or a list/dict of 'S','I','R','V' labels
+        if self.source is not None:
+            self.record(t, self.source.counts[:4])
+        else:
+            self.record(t, np.bincount(_as_codes(z), minlength=4)[:4])
+        if not self.events:
+            return
+        z = _as_codes(z)
+        if self.prev is None:
+            self.prev = np.zeros(len(z), dtype=np.int8) # changes are relative to all S
+        nodes = np.flatnonzero(z != self.prev)
+        if len(nodes):
+            self.ev.append((np.full(len(nodes), t, dtype=np.int64), nodes,
+                            self.prev[nodes].astype(np.int8), z[nodes].astype(np.int8)))
+            self.ev_len += len(nodes)
+            self.prev[nodes] = z[nodes]
+        if self.ev_len >= self.chunk:
+            self._flush_events()
+
+    def _flush_counts(self):
+        if self.filled:
+            rows = self.rows[:self.filled]
+            self._write('counts', {c : rows[:, k].copy() for k, c in enumerate(COUNTS)})
+            self.filled = 0
+
+    def _flush_events(self):
+        if self.ev_len:
+            cols = [np.concatenate(c) for c in zip(*self.ev)]
+            self._write('events', dict(zip(EVENTS, cols)))
+            self.ev, self.ev_len = [], 0
+
+    def _write(self, kind, columns):
+        path = os.path.join(self.path, f'{kind}-{self.seq[kind]:06d}.{self.format}')
+        tmp  = f'{path}.{os.getpid()}.tmp'
+        if self.format == 'npz':
+            with open(tmp, 'wb') as f:
+                np.savez(f, **columns)
+        else:
+            import pyarrow as pa
+            table = pa.table(columns)
+            with pa.OSFile(tmp, 'wb') as f, pa.ipc.new_file(f, table.schema) as w:
+                w.write_table(table)
+        os.replace(tmp, path)
+        self.seq[kind] += 1
+
+    def flush(self):
+        # This function writes the buffered rows out as (possibly short) chunks
+        self._flush_counts()
+        self._flush_events()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _chunks(path, kind):
+    return sorted(glob.glob(os.path.join(path, f'{kind}-*.npz')) +
+                  glob.glob(os.path.join(path, f'{kind}-*.arrow')))
+
+
+def _read(path, kind, columns):
+    parts = []
+    for file in _chunks(path, kind):
+        if file.endswith('.npz'):
+            with np.load(file) as f:
+                parts.append({c : f[c] for c in columns})
+        else:
+            import pyarrow as pa
+            with pa.memory_map(file) as f:
+                table = pa.ipc.open_file(f).read_all()
+            parts.append({c : table.column(c).to_numpy() for c in columns})
+    if not parts:
+        return {c : np.zeros(0, dtype=np.int64) for c in columns}
+    return {c : np.concatenate([p[c] for p in parts]) for c in columns}
+
+
+def read_counts(path):
+    # This function reads the counts written so far by a ResultSink
+    #
+    # input  : path, sink directory
+    # output : dict of equal-length arrays 't', 'S', 'I', 'R', 'V'
+    return _read(path, 'counts', COUNTS)
+
+
+def read_events(path):
+    # This function reads the node state changes written so far by a ResultSink
+    #
+    # input  : path, sink directory
+    # output : dict of equal-length arrays 't', 'node', 'old', 'new'
+    return _read(path, 'events', EVENTS)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class SimulationResult():
+    # Structured output of a headless run: the S(t),I(t),R(t),V(t) count series
+    # and, when requested, one copy of the node states per time step.
+    # stop tells why the run ended: 'extinct' (no infected node and no dose left),
+    # 'horizon' (time step tmax) or 'steady' (see steady_state.py).
+
+    def __init__(self, St, It, Rt, Vt=None, snapshots=None, stop=None):
+        self.St = St
+        self.It = It
+        self.Rt = Rt
+        self.Vt = Vt
+        self.snapshots = snapshots
+        self.stop      = stop
+
+    @property
+    def steps(self):
+        # number of steps in the epidemic, as reported by the templates
+        return len(self.St) - 1
+
+    def as_array(self):
+        # output : (T, 4) integer array of S,I,R,V counts, V is zero for models without it
+        Vt = self.Vt if self.Vt is not None else [0] * len(self.St)
+        return np.column_stack([self.St, self.It, self.Rt, Vt]).astype(np.int64)
+
+    def plot(self):
+        # This function plots the S(t),I(t),R(t)[,V(t)] time series the way the templates do
+        import matplotlib.pylab as plt
+
+        t = len(self.St)
+        fig = plt.figure()
+        ax1 = fig.add_subplot(111)
+        plt.plot(range(t), self.St, 'bo-', alpha=0.5,label='S(t)')
+        plt.plot(range(t), self.It, 'rv-', alpha=0.5,label='I(t)')
+        plt.plot(range(t), self.Rt, 'gs-', alpha=0.5,label='R(t)')
+        if self.Vt is not None:
+            plt.plot(range(t), self.Vt, 'cd-', alpha=0.5,label='V(t)')
+        plt.ylabel('number of nodes')
+        plt.xlabel('time, t')
+        plt.legend(loc='upper right');
+        plt.show()
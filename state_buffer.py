@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class StateBuffer():
+    # Double-buffered node states for synchronous updates.
+    #
+    # cur holds the states of time step t and is only read during a step, nxt
+    # receives the states of step t+1. Both are allocated once; swap() exchanges
+    # them and re-syncs the new nxt from the new cur in place, so a step neither
+    # copies a dict nor allocates a new container.
+    #
+    # With dtype=None the buffers are lists of labels ('S','I','R','V') that index
+    # like the dicts of the templates (nodes 0..n-1); otherwise numpy arrays.
+
+    def __init__(self, n, fill='S', dtype=None):
+        # input  : n, number of nodes
+        #        : fill, initial state of every node
+        #        : dtype, None for label lists, or a numpy dtype such as np.int8
+        if dtype is None:
+            self.cur = [fill] * n
+            self.nxt = [fill] * n
+        else:
+            self.cur = np.full(n, fill, dtype=dtype)
+            self.nxt = np.full(n, fill, dtype=dtype)
+
+    def _copy(self, dst, src):
+        if isinstance(dst, list):
+            dst[:] = src # same length, so the list storage is reused
+        else:
+            np.copyto(dst, src)
+
+    def sync(self):
+        # This function makes nxt equal to cur, e.g. after seeding patient 0 in cur
+        self._copy(self.nxt, self.cur)
+        return self.cur, self.nxt
+
+    def swap(self):
+        # This function ends a synchronous step: the written nxt becomes cur
+        #
+        # output : cur, nxt, the buffers to read and write during the next step
+        self.cur, self.nxt = self.nxt, self.cur
+        self._copy(self.nxt, self.cur)
+        return self.cur, self.nxt
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class SteadyState():
+    # Quasi-steady state detection from the maintained S,I,R(,V) counters.
+    #
+    # An SIRS epidemic settles into an endemic equilibrium instead of dying out, so
+    # "no infected left" never ends it, and its counts keep fluctuating around the
+    # equilibrium. A run is steady once
+    #   - the infected count has not reached a new maximum for `window` steps, so the
+    #     epidemic is past its peak (a slow pre-takeoff phase never counts as steady), and
+    #   - the mean counts of the last `window` steps differ from those of the `window`
+    #     steps before by at most tol times the recent mean, or `floor` nodes for
+    #     compartments smaller than floor / tol.
+    # The last 2*window count vectors are kept in a ring buffer, so a check costs
+    # O(window) however large the graph.
+    #
+    # Pass it as steady= to CSREngine.run, BatchedEngine.run, run_ensemble or a template
+    # simulation; every run starts it afresh from its own series.
+
+    def __init__(self, window=50, tol=0.05, floor=10):
+        # input  : window, number of steps averaged on each side of the comparison
+        #        : tol, tolerance relative to the recent mean count of each compartment
+        #        : floor, smallest tolerance in nodes, for compartments near zero
+        self.window = window
+        self.tol    = tol
+        self.floor  = floor
+
+    def start(self, n, history):
+        # This function starts the detection of one run
+        #
+        # input  : n, number of nodes
+        #        : history, (T, ...) counts of the steps so far (the initial counts, or
+        #          the series of a resumed run, so a resumed run stops where it would have)
+        # output : whether the history is already steady, as update()
+        history     = np.asarray(history, dtype=np.int64)
+        infected    = history[..., 1]
+        self.peak   = infected.max(axis=0)
+        self.since  = len(history) - 1 - infected.argmax(axis=0) # steps since the first maximum
+        self.ring   = np.zeros((2 * self.window,) + history.shape[1:], dtype=np.int64)
+        self.filled = 0
+        self.pos    = 0
+        for counts in history[-2 * self.window:]:
+            self._push(counts)
+        return self._steady()
+
+    def _push(self, counts):
+        self.ring[self.pos] = counts
+        self.pos    = (self.pos + 1) % len(self.ring)
+        self.filled = min(self.filled + 1, len(self.ring))
+
+    def update(self, counts):
+        # This function adds the counts of a new step
+        #
+        # input  : counts, S,I,R(,V) counts, or an (R, 4) array with one row per replicate
+        # output : whether the run is steady (one flag per replicate for an (R, 4) array)
+        counts     = np.asarray(counts)
+        higher     = counts[..., 1] > self.peak
+        self.peak  = np.where(higher, counts[..., 1], self.peak)
+        self.since = np.where(higher, 0, self.since + 1)
+        self._push(counts)
+        return self._steady()
+
+    def _steady(self):
+        if self.filled < len(self.ring):
+            return np.zeros(self.ring.shape[1:-1], dtype=bool) if self.ring.ndim > 2 else False
+        # once full, the ring holds the older window from pos on, then the recent one
+        order  = (self.pos + np.arange(len(self.ring))) % len(self.ring)
+        older  = self.ring[order[:self.window]].mean(axis=0)
+        recent = self.ring[order[self.window:]].mean(axis=0)
+        flat   = (np.abs(recent - older) <= np.maximum(self.tol * recent, self.floor)).all(axis=-1)
+        steady = flat & (self.since >= self.window)
+        return steady if self.ring.ndim > 2 else bool(steady)
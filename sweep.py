@@ -0,0 +1,165 @@
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from checkpoint import Checkpointer
+from csr_engine import CSRGraph, CSREngine
+from graph_store import open_graph
+
+# the study defaults of Vaccinations/vaccines.py
+DEFAULTS = {'beta' : 0.6, 'gamma' : 0.3, 'sigma' : 0.0, 'group' : 6,
+            'efficacy' : (0.85, 0.9), 'interval' : 7, 'ramp_day' : 20}
+
+_graph = None # contact graph of a worker process, set once by _init_worker
+
+
+def graph_fingerprint(G):
+    # This function hashes the CSR arrays of a graph, so cached results are tied to it
+    #
+    # input  : G is a networkx graph or a CSRGraph
+    # output : hex digest
+    csr = G if isinstance(G, CSRGraph) else CSRGraph.from_networkx(G)
+    h = hashlib.sha256()
+    h.update(np.int64(csr.n).tobytes())
+    h.update(np.ascontiguousarray(csr.indptr, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(csr.indices, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def grid(**axes):
+    # This function expands value lists into the points of a full grid
+    #
+    # input  : axes, e.g. beta=[0.3, 0.6], efficacy=[(0.75, 0.8), (0.85, 0.9)], interval=[5, 7, 9]
+    #          any of beta, gamma, sigma, group, efficacy, interval, ramp_day; the others
+    #          keep their DEFAULTS
+    # output : list of parameter dicts
+    unknown = set(axes) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'unknown sweep parameters {sorted(unknown)}')
+    names = list(axes)
+    return [dict(DEFAULTS, **dict(zip(names, values))) for values in itertools.product(*axes.values())]
+
+
+def _canonical(params):
+    return json.dumps({k : list(v) if isinstance(v, tuple) else v for k, v in sorted(params.items())},
+                      sort_keys=True)
+
+
+class ResultCache():
+    # On-disk cache of sweep results, one .npz file per (graph, parameters, seed) key.
+    # Files are written to a temporary name and renamed, so a crashed or concurrent
+    # sweep never leaves a partial entry behind.
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, fingerprint, params, seed):
+        text = f'{fingerprint}|{_canonical(params)}|{seed}'
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def get(self, key):
+        try:
+            with np.load(self._file(key)) as f:
+                return f['counts']
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, params, counts):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, counts=counts, params=_canonical(params))
+        os.replace(tmp, path)
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = open_graph(graph) # a saved graph is memory-mapped, not copied, by every worker
+
+
+def _run_point(params, seed, replicates, tmax, checkpoints=None):
+    # This function runs all replicates of one sweep point
+    #
+    # input  : checkpoints, None, or (path prefix, every) to checkpoint replicate r to
+    #          prefix-r.ckpt every `every` steps and resume from it
+    # output : (replicates, T, 4) array of S,I,R,V counts, padded with the final counts
+    #
+    # The random stream depends only on (params, seed), never on the other points of
+    # the grid or on the worker that runs it.
+    digest = int(hashlib.sha256(_canonical(params).encode()).hexdigest()[:16], 16)
+    seeds  = np.random.SeedSequence([seed, digest]).spawn(replicates)
+    v_dict = {1 : params['efficacy'][0], 2 : params['efficacy'][1]}
+    ckpts  = [Checkpointer(f'{checkpoints[0]}-{r}.ckpt', checkpoints[1]) if checkpoints else None
+              for r in range(replicates)]
+    runs   = [CSREngine(_graph, params['beta'], params['gamma'], sigma=params['sigma'],
+                        rng=np.random.default_rng(ss), group=params['group'], v_dict=v_dict,
+                        interval=params['interval'], ramp_day=params['ramp_day']).run(tmax=tmax, checkpoint=ck).as_array()
+              for ss, ck in zip(seeds, ckpts)]
+    T = max(len(r) for r in runs)
+    return np.stack([np.concatenate([r, np.repeat(r[-1:], T - len(r), axis=0)]) for r in runs])
+
+
+def _store(cache, keys, points, found, todo, done, checkpoints):
+    # results are cached as they arrive, so an interrupted sweep keeps its finished points
+    for i, counts in zip(todo, done):
+        cache.put(keys[i], points[i], counts)
+        found[i] = counts
+        if checkpoints[i]:
+            for r in range(len(counts)): # the cached point supersedes its checkpoints
+                path = f'{checkpoints[i][0]}-{r}.ckpt'
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def run_sweep(G, points, replicates=1, seed=0, tmax=30, cache_dir='sweep_cache', workers=None,
+              checkpoint_every=None):
+    # This function runs a parameter sweep of the vaccine simulation, reusing cached points
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a graph_store file
+    #        : points, parameter dicts, e.g. from grid()
+    #        : replicates, runs per point
+    #        : seed, root seed, part of the cache key
+    #        : tmax, last time step of every run (vaccines.py stops at 30)
+    #        : cache_dir, directory of the result cache
+    #        : workers, number of processes (None uses all cores, 1 runs in-process)
+    #        : checkpoint_every, checkpoint every run each this many time steps, under
+    #          cache_dir/checkpoints, so a preempted sweep also resumes the points it was
+    #          running; None for no checkpoints
+    # output : list of (params, counts) in the order of points, counts is a
+    #          (replicates, T, 4) array of S,I,R,V counts
+    #
+    # Only points whose (graph fingerprint, parameters, seed) key is missing from the
+    # cache are computed, so extending a sweep only pays for the new points.
+
+    graph  = open_graph(G)
+    shared = G if isinstance(G, (str, os.PathLike)) else graph
+    cache  = ResultCache(cache_dir)
+    finger = graph_fingerprint(graph)
+    points = [dict(DEFAULTS, **p) for p in points]
+    keys   = [cache.key(finger, dict(p, replicates=replicates, tmax=tmax), seed) for p in points]
+    found  = [cache.get(k) for k in keys]
+    todo   = [i for i, c in enumerate(found) if c is None]
+    ckpts  = [None] * len(points)
+    if checkpoint_every:
+        os.makedirs(os.path.join(cache_dir, 'checkpoints'), exist_ok=True)
+        ckpts = [(os.path.join(cache_dir, 'checkpoints', k), checkpoint_every) for k in keys]
+
+    if todo:
+        args = ([points[i] for i in todo], [seed] * len(todo), [replicates] * len(todo), [tmax] * len(todo),
+                [ckpts[i] for i in todo])
+        if workers == 1:
+            _init_worker(graph)
+            _store(cache, keys, points, found, todo, map(_run_point, *args), ckpts)
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shared,)) as pool:
+                _store(cache, keys, points, found, todo, pool.map(_run_point, *args), ckpts)
+    return list(zip(points, found))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from batched_engine import BatchedEngine
+from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+
+
+class _StopFirst():
+    # flags replicate 0 as steady at step `at`, and never the others
+    def __init__(self, at):
+        self.at = at
+
+    def start(self, n, history):
+        self.t = len(history)
+        return False
+
+    def update(self, counts):
+        self.t += 1
+        return np.arange(len(counts)) == 0 if self.t >= self.at else np.zeros(len(counts), dtype=bool)
+
+
+def test_steady_replicates_stop_advancing():
+    G   = connected_caveman_random_partition_csr(seed=1)
+    eng = BatchedEngine(G, 0.3, 0.2, 4, sigma=0.1, rng=2)
+    eng.seed_infection(np.zeros(4, dtype=np.int64))
+    frozen = {}
+
+    class Probe(_StopFirst):
+        def update(self, counts):
+            flags = super().update(counts)
+            if flags[0] and not frozen:
+                frozen['z'] = eng.z[:, 0].copy()
+            return flags
+
+    series = eng.run(tmax=40, steady=Probe(10))
+    assert len(series) == 40
+    assert (series[9:, 0] == series[9, 0]).all()
+    assert (eng.z[:, 0] == frozen['z']).all()
+    assert series[9, 0, 1] > 0 # frozen while still infected
+    assert (series[9:, 1:] != series[9, 1:]).any() # the others keep going
@@ -0,0 +1,17 @@
+import numpy as np
+
+from caveman_gaussian_snowflake_graphs import BRIDGE, caveman_partition_edges
+
+
+def test_bridges_join_cave_starts_to_block_starts():
+    u, v, layer, community = caveman_partition_edges(num_caves=4, cave_size=10, num_blocks=6, seed=0)
+    bu, bv = u[layer == BRIDGE], v[layer == BRIDGE]
+    assert (bu == [0, 10, 20, 30, 0, 10]).all() # cave b mod num_caves, not node 6*b
+    assert (bv == 40 + 30 * np.arange(6)).all()
+
+
+def test_default_connected_bridges_match_the_networkx_version():
+    # 6-node caves and 6 blocks: the bridges are the F.add_edge(6*i, len(G)) of the original
+    u, v, layer, community = caveman_partition_edges(seed=0)
+    assert (u[layer == BRIDGE] == 6 * np.arange(6)).all()
+    assert (v[layer == BRIDGE] == 36 + 30 * np.arange(6)).all()
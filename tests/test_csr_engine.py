@@ -0,0 +1,55 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from csr_engine import CSRGraph, CSREngine, I, S
+
+
+def test_dense_pressure_counts_without_the_row_array():
+    # isolated nodes at the start, in the middle and at the end of the rows
+    n = 12
+    u = np.array([1, 1, 2, 3, 5, 6, 6, 7, 9]) # 0, 4 and 11 have no neighbours
+    v = np.array([2, 3, 3, 5, 6, 7, 8, 9, 10])
+    G = CSRGraph.from_edges(n, u, v)
+    eng = CSREngine(G, 0.5, 0.1, rng=0, mode='dense', backend='numpy')
+    eng.z[[2, 5, 9]] = I
+    cand, k = eng._pressure_dense()
+    assert G._row is None
+    z = eng.z
+    expect = np.zeros(n, dtype=np.int64)
+    for a, b in zip(u, v):
+        expect[a] += z[b] == I
+        expect[b] += z[a] == I
+    keep = (expect > 0) & (z == S)
+    assert (cand == np.flatnonzero(keep)).all()
+    assert (k == expect[keep]).all()
+
+
+def test_frontier_pass_goes_through_the_backend():
+    from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+    from kernels import NUMPY, Backend
+    calls = []
+    def counted(*args):
+        calls.append(1)
+        return NUMPY.frontier_counts(*args)
+    G = connected_caveman_random_partition_csr(num_caves=100, num_blocks=100, seed=1)
+    runs = {}
+    for mode in ('frontier', 'dense'):
+        eng = CSREngine(G, 0.3, 0.3, rng=2, mode=mode, backend='numpy')
+        eng.backend = Backend('counted', counted, NUMPY.layered_escape, False)
+        runs[mode] = eng.run(tmax=30).as_array()
+    assert calls # every frontier step used backend.frontier_counts
+    assert (runs['frontier'] == runs['dense']).all()
+
+
+def test_spans_gathers_rows_in_order():
+    from kernels import spans
+    assert spans(np.array([5, 0, 9]), np.array([2, 0, 3])).tolist() == [5, 6, 9, 10, 11]
+
+
+def test_import_does_not_pull_in_networkx():
+    root = os.path.join(os.path.dirname(__file__), '..')
+    code = "import sys, csr_engine; sys.exit('networkx' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], cwd=root).returncode == 0
@@ -0,0 +1,50 @@
+import numpy as np
+
+import ensemble
+from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+from csr_engine import CSREngine
+from ensemble import run_ensemble
+
+
+def test_chunk_result_is_a_fixed_size_histogram():
+    G = connected_caveman_random_partition_csr(num_caves=3000, num_blocks=3000, seed=1) # ~108k nodes
+    assert G.n > 100000
+    ensemble._init_worker(G)
+    seeds = np.random.SeedSequence(0).spawn(8)
+    hist, total, low, high = ensemble._run_chunk(seeds, dict(beta=0.3, gamma=0.3, tmax=40, bins=ensemble.BINS))
+    T = len(total)
+    assert hist.shape == (T, 4, ensemble.BINS)
+    assert total.shape == low.shape == high.shape == (T, 4)
+    assert (hist.sum(axis=2) == 8).all()
+    # no per-replicate data: the same size for any number of replicates
+    size = hist.nbytes + total.nbytes + low.nbytes + high.nbytes
+    assert size == T * 4 * (ensemble.BINS + 3) * 8
+    assert size < 2 * 1024 * 1024 # a dense (T, 4, n+1) histogram would be hundreds of MB
+
+
+def test_ensemble_matches_the_replicates():
+    G = connected_caveman_random_partition_csr(seed=1)
+    res = run_ensemble(G, 12, 0.3, 0.3, seed=3, workers=1, tmax=20, chunksize=5)
+    assert res.mean.shape[1] == 4
+    assert np.allclose(res.mean.sum(axis=1), G.n)
+    assert (res.quantile(0.05) <= res.median).all() and (res.median <= res.quantile(0.95)).all()
+    assert res.quantiles.max() <= G.n
+
+
+def test_quantiles_are_interpolated_inside_bins():
+    G    = connected_caveman_random_partition_csr(num_caves=300, num_blocks=300, seed=1) # ~10k nodes
+    reps = 40
+    res  = run_ensemble(G, reps, 0.3, 0.3, seed=5, workers=1, tmax=15, chunksize=7)
+    runs = [CSREngine(G, 0.3, 0.3, rng=np.random.default_rng(ss)).run(tmax=15).as_array()
+            for ss in np.random.SeedSequence(5).spawn(reps)]
+    T    = max(len(r) for r in runs)
+    runs = np.stack([ensemble._pad(r, T) for r in runs])
+    width = (G.n + 1) / ensemble.BINS
+    exact = np.quantile(runs, 0.5, axis=0)
+    # infected counts are far below a bin here; they must not read as 0
+    assert exact[1:, 1].max() < width
+    assert (res.median[1:, 1] > 0).all()
+    assert np.abs(res.median - exact).max() <= width
+    # a compartment that is the same in every replicate is exact
+    assert (res.quantile(0.05)[:, 3] == 0).all()
+    assert res.median[0, 0] == G.n - 1
@@ -0,0 +1,32 @@
+import numpy as np
+
+from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+from gillespie import GillespieEngine
+
+
+def test_series_ends_with_the_final_counts():
+    G = connected_caveman_random_partition_csr(num_caves=2400, num_blocks=120, seed=1) # ~18k nodes
+    for seed in range(1, 6):
+        engine = GillespieEngine(G, 0.5, 1.0, rng=seed)
+        res    = engine.run()
+        series = res.as_array()
+        assert (series[-1] == engine.counts).all()
+        assert res.It[-1] == 0
+
+
+def test_dose_on_the_last_day_is_recorded():
+    G = connected_caveman_random_partition_csr(seed=1)
+    engine = GillespieEngine(G, 0.2, 0.5, group=6, rng=3)
+    res    = engine.run(tmax=30)
+    assert len(res.It) == 31 # days 0..30
+    assert (res.as_array()[-1] == engine.counts).all()
+    assert res.Vt[-1] > 0
+
+
+def test_dose_of_the_last_release_is_recorded_without_tmax():
+    G = connected_caveman_random_partition_csr(seed=1)
+    for seed in range(1, 4):
+        engine = GillespieEngine(G, 0.2, 0.5, group=6, rng=seed)
+        res    = engine.run()
+        assert res.Vt[-1] == engine.counts[3]
+        assert (res.as_array()[-1] == engine.counts).all()
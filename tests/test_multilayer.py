@@ -0,0 +1,19 @@
+import numpy as np
+
+from caveman_gaussian_snowflake_graphs import BRIDGE, CAVE, PARTITION, caveman_partition_edges
+from gatherings import GatheringSchedule
+from multilayer import LayeredGraph, MultilayerEngine
+
+
+def test_beta_events_reach_the_gatherings():
+    u, v, layer, community = caveman_partition_edges(num_caves=50, num_blocks=50, seed=0)
+    G = LayeredGraph(len(community), u, v, layer)
+    n = len(community)
+    close = [('beta', l, 0.0) for l in (CAVE, PARTITION, BRIDGE)]
+    eng = MultilayerEngine(G, [0.3, 0.3, 0.3], 0.05, rng=1, events={5 : close},
+                           gatherings=GatheringSchedule(n // 4, every=1, contacts=8))
+    res = eng.run(tmax=30)
+    assert eng.beta == 0.0
+    S = np.array(res.St)
+    assert S[0] - S[4] > 0       # gatherings and layers spread it before the closure
+    assert (S[5:] == S[5]).all() # nothing spreads once every layer is closed
@@ -0,0 +1,72 @@
+import gc
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import partitioned_engine
+from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+from partitioned_engine import PartitionedEngine
+
+
+def _unlinked(names):
+    # true when none of the named shared memory blocks can be attached any more
+    for name in names:
+        try:
+            shared_memory.SharedMemory(name=name).close()
+        except FileNotFoundError:
+            continue
+        return False
+    return True
+
+
+def test_workers_exit_after_run():
+    G = connected_caveman_random_partition_csr(seed=1)
+    with PartitionedEngine(G, 0.3, 0.2, parts=2, rng=1) as eng:
+        eng.run(tmax=10)
+        assert mp.active_children() == []
+
+
+def test_dropped_engine_unlinks_shared_memory():
+    G     = connected_caveman_random_partition_csr(seed=1)
+    eng   = PartitionedEngine(G, 0.3, 0.2, parts=2, rng=1)
+    names = [name for name, _, _ in eng.shared.specs.values()]
+    eng.run(tmax=5)
+    del eng
+    gc.collect()
+    assert _unlinked(names)
+
+
+def test_failed_constructor_unlinks_shared_memory(monkeypatch):
+    names  = []
+    create = partitioned_engine._Shared.create
+
+    def recording(self, name, shape, dtype):
+        array = create(self, name, shape, dtype)
+        names.append(self.specs[name][0])
+        return array
+
+    def broken(*args, **kwargs):
+        raise MemoryError('no room for the partition')
+
+    monkeypatch.setattr(partitioned_engine._Shared, 'create', recording)
+    monkeypatch.setattr(partitioned_engine, 'partition_graph', broken)
+    with pytest.raises(MemoryError):
+        PartitionedEngine(connected_caveman_random_partition_csr(seed=1), 0.3, 0.2, parts=2)
+    assert names # z was allocated before the failure
+    assert _unlinked(names)
+
+
+def test_final_sizes_do_not_depend_on_parts():
+    G     = connected_caveman_random_partition_csr(seed=1)
+    sizes = {}
+    for parts in (1, 4):
+        sizes[parts] = []
+        for seed in range(20):
+            with PartitionedEngine(G, 0.5, 0.2, parts=parts, rng=seed) as eng:
+                eng.seed_infection([0])
+                sizes[parts].append(eng.run().Rt[-1])
+    a, b = np.array(sizes[1], dtype=float), np.array(sizes[4], dtype=float)
+    se   = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+    assert abs(a.mean() - b.mean()) < 3 * se
@@ -0,0 +1,33 @@
+import numpy as np
+
+from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+from csr_engine import CSREngine
+from result_stream import ResultSink, read_counts, read_events
+
+
+class _NoCounting(np.ndarray):
+    # a state array that fails if anything counts it
+    def __array_function__(self, func, types, args, kwargs):
+        if func is np.bincount:
+            raise AssertionError('states were counted')
+        return super().__array_function__(func, types, args, kwargs)
+
+
+def test_sink_records_the_engine_counters(tmp_path):
+    G   = connected_caveman_random_partition_csr(seed=1)
+    eng = CSREngine(G, 0.3, 0.2, rng=4)
+    eng.z = eng.z.view(_NoCounting)
+    with ResultSink(str(tmp_path), chunk=7, source=eng) as sink:
+        res = eng.run(observers=[sink], tmax=30)
+    c = read_counts(str(tmp_path))
+    assert (c['I'] == res.It).all() and (c['S'] == res.St).all() and (c['R'] == res.Rt).all()
+    assert (c['t'] == np.arange(1, len(res.It) + 1)).all()
+
+
+def test_sink_events_with_source_match_state_changes(tmp_path):
+    G   = connected_caveman_random_partition_csr(seed=1)
+    eng = CSREngine(G, 0.3, 0.2, rng=4)
+    with ResultSink(str(tmp_path), chunk=5, events=True, source=eng) as sink:
+        res = eng.run(observers=[sink], tmax=30)
+    ev = read_events(str(tmp_path))
+    assert (np.bincount(ev['new'], minlength=4)[1] == G.n - res.St[-1])
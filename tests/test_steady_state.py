@@ -0,0 +1,60 @@
+import numpy as np
+
+from csr_engine import CSRGraph, CSREngine
+from steady_state import SteadyState
+
+
+def _counts(infected, n=200000):
+    # S,I,R rows with the given infected counts, R in proportion as in an SIRS equilibrium
+    infected = np.asarray(infected, dtype=np.int64)
+    removed  = 10 * infected
+    return np.column_stack([n - infected - removed, infected, removed])
+
+
+def _first_steady(steady, series):
+    if steady.start(int(series[0].sum()), series[:1]):
+        return 0
+    for t, counts in enumerate(series[1:], 1):
+        if steady.update(counts):
+            return t
+    return None
+
+
+def test_slow_growth_is_not_steady():
+    # a pre-takeoff phase: I creeps from 30 to 90 over 400 steps on 200k nodes
+    series = _counts(np.linspace(30, 90, 400).astype(np.int64))
+    assert _first_steady(SteadyState(), series) is None
+
+
+def test_plateau_after_peak_is_steady():
+    rng    = np.random.default_rng(0)
+    rise   = np.linspace(30, 2000, 100)
+    fall   = 600 + 1400 * np.exp(-np.arange(300) / 20)
+    noise  = rng.normal(0, 10, 400)
+    series = _counts((np.concatenate([rise, fall]) + noise).astype(np.int64))
+    t = _first_steady(SteadyState(), series)
+    assert t is not None and t > 200
+
+
+def test_replicates_are_judged_separately():
+    flat   = _counts(np.full(300, 500))
+    slow   = _counts(np.linspace(30, 90, 300).astype(np.int64))
+    series = np.stack([flat, slow], axis=1) # (T, R, 3)
+    steady = SteadyState()
+    steady.start(200000, series[:1])
+    flags  = [steady.update(c) for c in series[1:]]
+    assert flags[-1].tolist() == [True, False]
+
+
+def test_slow_epidemic_runs_past_its_peak():
+    # ER graph, N = 200k, beta = 0.01, slow SIRS growth: the absolute tol * N rule stopped
+    # this run at step 100 with 82 infected, long before the epidemic took off
+    n   = 200000
+    rng = np.random.default_rng(0)
+    G   = CSRGraph.from_edges(n, rng.integers(n, size=2 * n), rng.integers(n, size=2 * n))
+    e   = CSREngine(G, 0.01, 0.02, sigma=0.001, rng=1)
+    e.seed_infection(np.arange(30))
+    r   = e.run(tmax=8000, steady=SteadyState())
+    a   = r.as_array()
+    assert a[:, 1].max() > 1000
+    assert len(a) > a[:, 1].argmax() + 50
@@ -0,0 +1,16 @@
+import numpy as np
+
+from vaccination import CommunityTargeting, EligiblePool
+
+
+def test_partial_order_serves_listed_community_first():
+    community = np.repeat(np.arange(6), 20)
+    policy    = CommunityTargeting(community, order=[4])
+    assert np.isfinite(policy.rank).all()
+    pool  = EligiblePool(len(community))
+    rng   = np.random.default_rng(0)
+    slots = policy.pick(pool, 20, rng)
+    assert (community[pool.items[slots]] == 4).all()
+    # the unlisted communities come next, mixed at random
+    slots = policy.pick(pool, 40, rng)
+    assert (community[pool.items[slots]] == 4).sum() == 20
@@ -0,0 +1,51 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import networkx as nx
+import numpy as np
+import matplotlib.pylab as plt
+from PIL import Image
+
+import visualize
+from visualize import FRAME_COLORS, GraphDrawer
+
+
+def test_gif_frames_are_written_as_they_come(tmp_path):
+    path   = str(tmp_path / 'run.gif')
+    rng    = np.random.default_rng(0)
+    frames = [rng.integers(len(FRAME_COLORS), size=(48, 48)).astype(np.uint8) for _ in range(6)]
+    sink   = visualize._GifSink(path, fps=10)
+    for frame in frames:
+        sink.write(frame)
+        assert not hasattr(sink, 'frames')
+    sink.close()
+    with Image.open(path) as img:
+        assert img.n_frames == len(frames)
+        assert img.info['loop'] == 0 and img.info['duration'] == 100
+        for i, frame in enumerate(frames):
+            img.seek(i)
+            assert (np.asarray(img.convert('RGB')) == FRAME_COLORS[frame]).all()
+
+
+def test_animation_writer_labels_frames(tmp_path):
+    from caveman_gaussian_snowflake_graphs import connected_caveman_random_partition_csr
+    from csr_engine import CSREngine
+    from visualize import AnimationWriter
+    G    = connected_caveman_random_partition_csr(seed=1)
+    path = str(tmp_path / 'run.gif')
+    with AnimationWriter(path, G, size=120, cache_dir=str(tmp_path / 'layouts')) as writer:
+        res = CSREngine(G, 0.3, 0.3, rng=1).run(observers=[writer], tmax=10)
+    with Image.open(path) as img:
+        assert img.n_frames == len(res.It) == writer.frames
+
+
+def test_graph_drawer_clears_the_figure():
+    G = nx.path_graph(8)
+    drawer = GraphDrawer(G, show=False)
+    z = np.zeros(8, dtype=np.int8)
+    drawer.observe(1, z)
+    before = len(plt.gca().collections)
+    for t in range(2, 5):
+        drawer.observe(t, z)
+    assert len(plt.gca().collections) == before
+    plt.close('all')
@@ -0,0 +1,206 @@
+import numpy as np
+
+
+class EligiblePool():
+    # Nodes that can still receive a dose, kept in a swap-remove array.
+    #
+    # items[:size] are the eligible nodes in no particular order and pos[node] is
+    # the slot of a node in items (-1 once removed), so a batch of k nodes is drawn
+    # with one rng.choice over slots and removed in O(k) by moving tail items into
+    # the freed slots.
+
+    def __init__(self, n):
+        self.items = np.arange(n, dtype=np.int64)
+        self.pos   = np.arange(n, dtype=np.int64)
+        self.size  = n
+
+    def nodes(self):
+        return self.items[:self.size]
+
+    def remove(self, nodes):
+        # This function removes a batch of distinct eligible nodes
+        nodes = np.asarray(nodes, dtype=np.int64)
+        k = len(nodes)
+        if k == 0:
+            return
+        slots = self.pos[nodes]
+        tail  = self.size - k
+        # tail slots that stay eligible move into the slots freed below the tail
+        freed = np.ones(k, dtype=bool)
+        freed[slots[slots >= tail] - tail] = False
+        movers = tail + np.flatnonzero(freed)
+        holes  = slots[slots < tail]
+        self.items[holes] = self.items[movers]
+        self.pos[self.items[holes]] = holes
+        self.pos[nodes] = -1
+        self.size = tail
+
+
+def _floor_integral(x):
+    # integral of floor(u) du from 0 to x
+    m = np.floor(x)
+    return m * (m - 1) / 2 + m * (x - m)
+
+
+def weekly_mean_doses(t, group, interval=7, ramp_day=20, low=(1, 2), high=(2, 4)):
+    # This function returns the expected number of doses of WeeklyRelease on day t
+    #
+    # input  : t, day(s); group, interval, ramp_day, as in WeeklyRelease; all broadcast
+    #          against each other, so one call covers a grid of schedules
+    # output : E[int(group * U(lo, hi))] on release days, 0 on the others
+    t, group = np.asarray(t), np.asarray(group, dtype=float)
+    ramp = t >= ramp_day
+    lo   = group * np.where(ramp, high[0], low[0])
+    hi   = group * np.where(ramp, high[1], low[1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(hi > lo, (_floor_integral(hi) - _floor_integral(lo)) / (hi - lo), np.floor(lo))
+    return np.where((t >= interval) & (t % interval == 0), mean, 0.0)
+
+
+class WeeklyRelease():
+    # The release rule of the templates: every `interval` days from day `interval`
+    # on, int(group * U(low)) doses, int(group * U(high)) from day `ramp_day` on.
+
+    def __init__(self, group, interval=7, ramp_day=20, low=(1, 2), high=(2, 4)):
+        self.group    = group
+        self.interval = interval
+        self.ramp_day = ramp_day
+        self.low      = low
+        self.high     = high
+
+    def doses(self, t, rng):
+        # output : number of doses released on day t (0 on other days)
+        if t < self.interval or t % self.interval != 0:
+            return 0
+        if t >= self.ramp_day:
+            return int(self.group * rng.uniform(*self.high))
+        return int(self.group * rng.uniform(*self.low))
+
+    def mean_doses(self, t):
+        # output : expected number of doses released on day t
+        return float(weekly_mean_doses(t, self.group, self.interval, self.ramp_day, self.low, self.high))
+
+    def next_day(self, t):
+        # output : first release day after time t (None when there is none)
+        return max(self.interval, (int(np.floor(t)) // self.interval + 1) * self.interval)
+
+
+class FixedRelease():
+    # Explicit release plan, {day : number of doses}.
+
+    def __init__(self, plan):
+        self.plan = dict(plan)
+        self.days = sorted(self.plan)
+
+    def doses(self, t, rng):
+        return int(self.plan.get(t, 0))
+
+    def mean_doses(self, t):
+        return float(self.plan.get(t, 0))
+
+    def next_day(self, t):
+        later = [d for d in self.days if d > t]
+        return later[0] if later else None
+
+
+class UniformTargeting():
+    # Every eligible node is equally likely to get one of the doses.
+
+    def pick(self, pool, k, rng):
+        # output : k distinct slots of pool.items, drawn without replacement in one call
+        return rng.choice(pool.size, k, replace=False)
+
+
+class DegreeTargeting():
+    # Doses go preferentially to high-degree nodes: weighted sampling without
+    # replacement with weight degree**power (Efraimidis-Spirakis keys), O(pool) per release.
+
+    def __init__(self, degree, power=1.0):
+        self.weight = np.asarray(degree, dtype=float) ** power
+
+    def pick(self, pool, k, rng):
+        w    = self.weight[pool.nodes()]
+        keys = np.where(w > 0, np.log(rng.random(pool.size)) / np.maximum(w, 1e-300), -np.inf)
+        return np.argpartition(-keys, k - 1)[:k] if k < pool.size else np.arange(pool.size)
+
+
+class CommunityTargeting():
+    # Doses go to communities in priority order (e.g. the caves of the caveman
+    # graphs first), uniformly at random within the community being served.
+
+    def __init__(self, community, order=None):
+        # input  : community, community id of every node
+        #        : order, community ids by priority (largest community first by default);
+        #          communities left out of order are served after the listed ones
+        community = np.asarray(community)
+        if order is None:
+            order = np.argsort(-np.bincount(community), kind='stable')
+        order = np.asarray(order, dtype=np.int64)
+        rank  = np.full(community.max() + 1, len(order), dtype=float) # unlisted communities come last
+        rank[order] = np.arange(len(order))
+        self.rank = rank[community]
+
+    def pick(self, pool, k, rng):
+        keys = self.rank[pool.nodes()] + rng.random(pool.size)
+        return np.argpartition(keys, k - 1)[:k] if k < pool.size else np.arange(pool.size)
+
+
+class VaccinationScheduler():
+    # Dose bookkeeping for the SIRV simulations.
+    #
+    # A release hands its doses to distinct eligible nodes (at most one dose per node
+    # per release), chosen by the targeting policy in one batched draw. A node that
+    # reaches max_doses leaves the eligible pool. A dose protects (moves to V) with
+    # probability v_dict[dose number].
+
+    def __init__(self, n, schedule, v_dict=None, policy=None, max_doses=2):
+        # input  : n, number of nodes
+        #        : schedule, release plan with doses(t, rng), e.g. WeeklyRelease(group)
+        #        : v_dict, efficacy of every dose number, {1 : 0.85, 2 : 0.9} by default
+        #        : policy, targeting policy with pick(pool, k, rng), UniformTargeting by default
+        #        : max_doses, doses after which a node is no longer eligible
+        self.schedule  = schedule
+        self.v_dict    = v_dict if v_dict is not None else {1 : 0.85, 2 : 0.9}
+        self.policy    = policy if policy is not None else UniformTargeting()
+        self.max_doses = max_doses
+        self.doses     = np.zeros(n, dtype=np.int8) # doses received, 0..max_doses
+        self.pool      = EligiblePool(n)
+        self.efficacy  = np.array([0.0] + [self.v_dict[d] for d in range(1, max_doses + 1)])
+
+    @property
+    def pending(self):
+        # number of nodes that still need a dose
+        return self.pool.size
+
+    def exhausted(self, t):
+        # This function tells whether no dose can be handed out on day t or later
+        return self.pool.size == 0 or self.schedule.next_day(t - 1) is None
+
+    def release(self, t, rng):
+        # This function hands out the doses of day t
+        #
+        # output : v_ch, the nodes that got a dose
+        #        : protected, the subset of v_ch for which the dose worked
+        vac = self.schedule.doses(t, rng)
+        if vac <= 0 or self.pool.size == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        slots = self.policy.pick(self.pool, min(vac, self.pool.size), rng)
+        v_ch  = self.pool.items[slots]
+        self.doses[v_ch] += 1
+        self.pool.remove(v_ch[self.doses[v_ch] >= self.max_doses])
+        protected = v_ch[rng.random(len(v_ch)) < self.efficacy[self.doses[v_ch]]]
+        return v_ch, protected
+
+    def state(self):
+        # This function returns the dose bookkeeping, for checkpoints; the pool order
+        # is part of it because the next draws pick pool slots
+        return {'doses' : self.doses.copy(), 'items' : self.pool.items.copy(),
+                'pos' : self.pool.pos.copy(), 'size' : self.pool.size}
+
+    def restore(self, state):
+        # This function resumes from the output of state()
+        self.doses[:]      = state['doses']
+        self.pool.items[:] = state['items']
+        self.pool.pos[:]   = state['pos']
+        self.pool.size     = int(state['size'])
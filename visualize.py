@@ -0,0 +1,431 @@
+import hashlib
+import io
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import networkx as nx
+import numpy as np
+import matplotlib.pylab as plt
+
+from graph_store import open_graph
+from sweep import graph_fingerprint
+
+# same palette and label order as drawGz
+COLORS = ['#d61111','#11d646','#11c6d6','#d67711','#1b11d6','#d611cc']
+CODES  = {'S' : 0, 'I' : 1, 'R' : 2, 'V' : 3}
+
+# COLORS as an RGB table, so the colors of a frame are one lookup PALETTE[codes]
+PALETTE = np.array([[int(c[k:k + 2], 16) for k in (1, 3, 5)] for c in COLORS], dtype=np.uint8)
+
+# ASCII byte of a state label -> state code, for label lists
+_LABEL_CODE = np.zeros(256, dtype=np.int8)
+for _label, _code in CODES.items():
+    _LABEL_CODE[ord(_label)] = _code
+
+# frames are rendered as palette indices: background, edges, text, then the states
+BACKGROUND, EDGE, TEXT, FIRST_STATE = 0, 1, 2, 3
+FRAME_COLORS = np.concatenate([np.array([[255, 255, 255], [215, 215, 215], [0, 0, 0]], dtype=np.uint8), PALETTE])
+
+# where nodes overlap, a pixel shows the state that comes last here, so infected nodes
+# stay visible on top of the others
+DRAW_ORDER = np.array([CODES['S'], CODES['R'], CODES['V'], CODES['I']], dtype=np.int8)
+_DRAW_RANK = np.argsort(DRAW_ORDER).astype(np.int8) # state code -> rank in DRAW_ORDER
+
+
+def state_codes(z):
+    # This function returns the int8 state codes of a state array, or of a list/dict of
+    # 'S','I','R','V' labels (a list is converted with one table lookup, not a loop)
+    if isinstance(z, np.ndarray):
+        return z
+    if isinstance(z, dict):
+        return np.fromiter((CODES[z[i]] for i in range(len(z))), dtype=np.int8, count=len(z))
+    return _LABEL_CODE[np.frombuffer(''.join(z).encode('ascii'), dtype=np.uint8)]
+
+
+def _neighbour_sum(csr, x):
+    # sum of x over the neighbours of every node, for each row of a (2, n) coordinate array
+    # (the coordinates are kept row-wise, so the gathers read contiguous memory)
+    return np.stack([np.bincount(csr.row, weights=xk[csr.indices], minlength=csr.n) for xk in x])
+
+
+def spectral_layout(G, iterations=200, seed=0):
+    # This function computes a 2-d spectral layout by power iteration
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a saved graph
+    #        : iterations, power iterations
+    #        : seed, seed of the random start
+    # output : (n, 2) float array of node positions in [-1, 1]
+    #
+    # The coordinates are the two leading non-trivial eigenvectors of the random walk
+    # matrix D^-1 A (Koren's degree-normalized eigenvectors), found by power iteration on
+    # the lazy walk (I + D^-1 A) / 2 with D-orthogonalization against the constant vector.
+    # Each iteration is a pass over the edge array, O(|E|), with no dense matrix.
+    csr = open_graph(G)
+    deg = np.maximum(csr.degree(), 1).astype(float)
+    x   = np.random.default_rng(seed).standard_normal((2, csr.n))
+    for _ in range(iterations):
+        x  = (x + _neighbour_sum(csr, x) / deg) / 2
+        x -= (x @ deg)[:, None] / deg.sum() # drop the trivial constant eigenvector
+        # D-orthonormalize the two coordinates (Gram-Schmidt under <a, b> = sum(d a b))
+        x[0] /= np.sqrt(x[0] ** 2 @ deg) or 1.0
+        x[1] -= (x[0] * x[1] @ deg) * x[0]
+        x[1] /= np.sqrt(x[1] ** 2 @ deg) or 1.0
+    return _normalize(x.T)
+
+
+def _normalize(x):
+    x = x - (x.max(axis=0) + x.min(axis=0)) / 2
+    return x / (np.abs(x).max() or 1.0)
+
+
+def _repulsion_kernel(cells):
+    # FFT of the 1/r force kernel of ForceAtlas2 over all offsets of a cells x cells grid of
+    # unit cells, on a 2*cells grid so that the convolution does not wrap around
+    off    = np.fft.fftfreq(2 * cells, 1 / (2 * cells))
+    dx, dy = np.meshgrid(off, off, indexing='ij')
+    r2     = dx ** 2 + dy ** 2
+    r2[0, 0] = np.inf
+    return np.fft.rfft2(dx / r2), np.fft.rfft2(dy / r2)
+
+
+def _repulsion(x, kernel, cells):
+    # Particle-mesh repulsion: the nodes are spread on a cells x cells grid (cloud in cell,
+    # bilinear weights), the grid is convolved by FFT with the 1/r force kernel and the
+    # force is read back with the same weights, so a step costs O(n + cells^2 log cells)
+    # instead of O(n^2) pairs.
+    lo   = x.min(axis=1)
+    cell = max((x.max(axis=1) - lo).max(), 1e-9) / (cells - 1)
+    u    = (x - lo[:, None]) / cell
+    i0   = np.minimum(u.astype(np.int64), cells - 2)
+    f    = u - i0
+    flat = [(i0[0] + a) * cells + i0[1] + b for a in (0, 1) for b in (0, 1)]
+    w    = [(f[0] if a else 1 - f[0]) * (f[1] if b else 1 - f[1]) for a in (0, 1) for b in (0, 1)]
+    mass = sum(np.bincount(c, weights=wc, minlength=cells * cells) for c, wc in zip(flat, w))
+    grid = np.fft.rfft2(mass.reshape(cells, cells), (2 * cells, 2 * cells))
+    out  = []
+    for k in kernel:
+        field = np.fft.irfft2(grid * k, (2 * cells, 2 * cells))[:cells, :cells].ravel()
+        out.append(sum(field[c] * wc for c, wc in zip(flat, w)) / cell)
+    return np.stack(out)
+
+
+def force_layout(G, iterations=100, pos=None, seed=0, repulsion=2.0, gravity=1.0, cells=None):
+    # This function refines a layout with ForceAtlas-style forces
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a saved graph
+    #        : iterations, force steps
+    #        : pos, starting positions (the spectral layout when None)
+    #        : repulsion, gravity, strengths of the node repulsion and of the pull to the centre
+    #        : cells, side of the repulsion grid (sqrt(n)/2, within 16..256, when None)
+    # output : (n, 2) float array of node positions in [-1, 1]
+    #
+    # As in ForceAtlas2, every edge pulls its ends together linearly with their distance,
+    # nodes push each other apart with a 1/r force and a constant gravity keeps
+    # disconnected parts in view. The repulsion is computed on a grid (see _repulsion), so
+    # a step is O(|E| + n + cells^2 log cells).
+    csr    = open_graph(G)
+    x      = np.array(spectral_layout(csr, seed=seed) if pos is None else pos, dtype=float)
+    x      = _normalize(x).T * np.sqrt(csr.n) # about one unit of area per node
+    deg    = csr.degree().astype(float)
+    cells  = cells or int(min(256, max(16, np.sqrt(csr.n) / 2)))
+    kernel = _repulsion_kernel(cells)
+    step   = 0.1
+    for _ in range(iterations):
+        # linear attraction along the edges, sum over neighbours j of (x_j - x_i)
+        pull  = _neighbour_sum(csr, x) - deg * x
+        dist  = np.maximum(np.sqrt((x ** 2).sum(axis=0)), 1e-9)
+        force = pull + repulsion * _repulsion(x, kernel, cells) - gravity * x / dist
+        # every node moves along its force by at most `step` times the layout radius,
+        # so the layout can grow or shrink to its equilibrium scale; the step cools down
+        limit = step * np.sqrt((x ** 2).sum(axis=0).mean())
+        speed = np.maximum(np.sqrt((force ** 2).sum(axis=0)), 1e-12)
+        x    += force * np.minimum(1.0, limit / speed)
+        step *= 0.97
+    return _normalize(x.T)
+
+
+LAYOUTS = {'spectral' : spectral_layout, 'force' : force_layout}
+
+
+def graph_layout(G, method='force', cache_dir='layout_cache', seed=0, **options):
+    # This function returns a layout of a (large) graph, computed once and cached on disk
+    #
+    # input  : G is a networkx graph, a CSRGraph or the path of a saved graph
+    #        : method, 'spectral' or 'force' (spectral, then ForceAtlas2-style refinement)
+    #        : cache_dir, directory of cached layouts (None to always compute)
+    #        : seed, **options, passed to the layout function
+    # output : (n, 2) float array of node positions in [-1, 1]; node i is the i-th node of G
+    #
+    # Layouts are keyed by the graph fingerprint and the layout options, so a graph is laid
+    # out once, however many runs and animations use it.
+    csr = open_graph(G)
+    if cache_dir is None:
+        return LAYOUTS[method](csr, seed=seed, **options)
+    text = f'{graph_fingerprint(csr)}|{method}|{seed}|{sorted(options.items())}'
+    path = os.path.join(cache_dir, hashlib.sha256(text.encode()).hexdigest() + '.npy')
+    if os.path.exists(path):
+        return np.load(path)
+    pos = LAYOUTS[method](csr, seed=seed, **options)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, pos)
+    os.replace(tmp, path)
+    return pos
+
+
+class Rasterizer():
+    # Draws node states straight into a pixel array, without matplotlib.
+    #
+    # Node pixels and the edge image are computed once from the layout, with the nodes
+    # sorted by pixel. A frame is one gather of the node states, one maximum per covered
+    # pixel (np.maximum.reduceat), then a dilation of that image by the dot shape over
+    # the edge image: O(n + pixels) whatever the graph size. Frames are palette-index
+    # images (see FRAME_COLORS).
+
+    def __init__(self, pos, size=800, dot=1, G=None, max_edges=50000, seed=0):
+        # input  : pos, (n, 2) node positions
+        #        : size, width and height of the frame in pixels
+        #        : dot, node radius in pixels (0 draws one pixel per node)
+        #        : G, graph whose edges are drawn (None for no edges)
+        #        : max_edges, edges drawn at most, a random sample beyond that
+        # a few far outliers (e.g. small disconnected parts) must not shrink the rest
+        pos    = np.asarray(pos, dtype=float)
+        lo, hi = np.percentile(pos, [0.5, 99.5], axis=0) if len(pos) > 1000 else (pos.min(axis=0), pos.max(axis=0))
+        pos    = np.clip((pos - lo) / np.maximum((hi - lo).max(), 1e-12), 0, 1)
+        margin = dot + 2
+        pix    = np.rint(pos * (size - 1 - 2 * margin) + margin).astype(np.int64)
+        # flat pixel index of every node centre; image rows are y, top down
+        centre = (size - 1 - pix[:, 1]) * size + pix[:, 0]
+        order  = np.argsort(centre, kind='stable')
+        self.nodes = order.astype(np.int32 if len(pos) < 2**31 else np.int64)
+        pixels, self.starts = np.unique(centre[order], return_index=True)
+        # covered pixels in an image padded by dot on every side, so dots never wrap around
+        self.pixels = (pixels // size + dot) * (size + 2 * dot) + pixels % size + dot
+        off    = np.arange(-dot, dot + 1)
+        self.offsets = [(dy, dx) for dy in off for dx in off if dx ** 2 + dy ** 2 <= dot ** 2 + dot]
+        self.size  = size
+        self.dot   = dot
+        self.base  = np.full(size * size, BACKGROUND, dtype=np.uint8)
+        if G is not None:
+            self._draw_edges(open_graph(G), pix, max_edges, np.random.default_rng(seed))
+        self.base  = self.base.reshape(size, size)
+
+    def _draw_edges(self, csr, pix, max_edges, rng):
+        keep = np.flatnonzero(csr.row < csr.indices) # every undirected edge once
+        if len(keep) > max_edges:
+            keep = rng.choice(keep, max_edges, replace=False)
+        for part in np.array_split(keep, max(1, len(keep) // 10000)):
+            a, b  = pix[csr.row[part]], pix[csr.indices[part]]
+            steps = np.abs(b - a).max(axis=1) + 1
+            # sample every edge at one point per pixel of its longest side
+            edge  = np.repeat(np.arange(len(part)), steps)
+            frac  = (np.arange(len(edge)) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+            p     = np.rint(a[edge] + (b[edge] - a[edge]) * frac[:, None]).astype(np.int64)
+            self.base[(self.size - 1 - p[:, 1]) * self.size + p[:, 0]] = EDGE
+
+    def render(self, z):
+        # This function draws one frame
+        #
+        # input  : z, int8 state codes (or labels) of the nodes
+        # output : (size, size) uint8 image of indices into FRAME_COLORS
+        rank  = _DRAW_RANK[state_codes(z)][self.nodes]
+        d, n  = self.dot, self.size
+        top   = np.full((n + 2 * d) ** 2, -1, dtype=np.int8) # highest rank centred on each pixel
+        top[self.pixels] = np.maximum.reduceat(rank, self.starts)
+        top   = top.reshape(n + 2 * d, -1)
+        shown = np.full((n, n), -1, dtype=np.int8)
+        for dy, dx in self.offsets:
+            np.maximum(shown, top[d + dy:n + d + dy, d + dx:n + d + dx], out=shown)
+        return np.where(shown >= 0, FIRST_STATE + DRAW_ORDER[shown], self.base).astype(np.uint8)
+
+
+# NETSCAPE2.0 application extension: loop the animation forever
+_GIF_LOOP = b'!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'
+
+
+class _GifSink():
+    # GIF frames are encoded one at a time by Pillow and appended to the file as they
+    # come, so memory stays at one frame. Every frame has the size and palette of the
+    # first, so the header of the first encoded frame (screen descriptor and global
+    # palette) serves the whole file; it is followed by a loop extension, then by the
+    # image block (delay and LZW data) of every frame, and the GIF trailer on close.
+
+    def __init__(self, path, fps):
+        from PIL import Image
+        self.Image    = Image
+        self.path     = path
+        self.tmp      = f'{path}.{os.getpid()}.tmp'
+        self.duration = int(round(1000 / fps))
+        self.palette  = FRAME_COLORS.ravel().tolist()
+        self.file     = None
+
+    def write(self, frame):
+        img = self.Image.fromarray(frame) # a 2-D uint8 array is an 'L' image; putpalette makes it 'P'
+        img.putpalette(self.palette)
+        buf = io.BytesIO()
+        img.save(buf, format='GIF', duration=self.duration, optimize=False)
+        data  = buf.getvalue()
+        flags = data[10] # packed field of the logical screen descriptor
+        head  = 13 + (3 << ((flags & 7) + 1) if flags & 0x80 else 0)
+        if self.file is None:
+            self.file = open(self.tmp, 'wb')
+            self.file.write(data[:head] + _GIF_LOOP)
+        self.file.write(data[head:-1]) # without the trailer
+
+    def close(self):
+        if self.file is not None:
+            self.file.write(b';')
+            self.file.close()
+            os.replace(self.tmp, self.path)
+        self.file = None
+
+
+class _FfmpegSink():
+    # MP4 (or any format ffmpeg knows by extension): RGB frames are piped to a local
+    # ffmpeg process as they come, so memory stays at one frame.
+
+    def __init__(self, path, fps, size):
+        exe = shutil.which('ffmpeg')
+        if exe is None:
+            raise RuntimeError(f'writing {path} needs ffmpeg on the PATH (use a .gif file otherwise)')
+        self.proc = subprocess.Popen([exe, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                                      '-s', f'{size}x{size}', '-r', str(fps), '-i', '-',
+                                      '-pix_fmt', 'yuv420p', path], stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.proc.stdin.write(FRAME_COLORS[frame].tobytes())
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f'ffmpeg exited with status {self.proc.returncode}')
+
+
+class AnimationWriter():
+    # Observer that renders every step of a run into an animation file.
+    #
+    # The layout comes from graph_layout (computed once per graph and cached on disk),
+    # so the per-step cost on the simulation side is one copy of the state codes into a
+    # bounded queue. A background thread renders the frames (see Rasterizer) and writes
+    # them: .gif with Pillow, .mp4 and other video formats through a local ffmpeg.
+    # The simulation only waits when `backlog` frames are queued and not yet written.
+
+    def __init__(self, path, G, pos=None, fps=10, size=800, dot=1, edges=True, every=1,
+                 backlog=64, layout='force', cache_dir='layout_cache', label=True):
+        # input  : path, output file, .gif or a video format of ffmpeg such as .mp4
+        #        : G is a networkx graph, a CSRGraph or the path of a saved graph
+        #        : pos, node positions (graph_layout(G, layout, cache_dir) when None)
+        #        : fps, frames per second of the animation
+        #        : size, dot, edges, frame size, node radius and whether edges are drawn
+        #        : every, keep one frame every this many time steps
+        #        : backlog, frames queued at most before observe() waits for the writer
+        #        : label, write the time step in the corner of every frame
+        from PIL import Image, ImageDraw # fail at construction rather than in the writer thread
+        self.Image, self.ImageDraw = Image, ImageDraw
+        if path.lower().endswith('.gif'):
+            self.sink = _GifSink(path, fps)
+        else:
+            self.sink = _FfmpegSink(path, fps, size)
+        csr = open_graph(G)
+        if pos is None:
+            pos = graph_layout(csr, layout, cache_dir)
+        self.raster = Rasterizer(pos, size, dot, csr if edges else None)
+        self.every  = every
+        self.label  = label
+        self.frames = 0
+        self.error  = None
+        self.queue  = queue.Queue(backlog)
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def observe(self, t, z):
+        # input  : t, time step
+        #        : z, int8 state array, or a list/dict of 'S','I','R','V' labels
+        if self.error is not None:
+            raise self.error
+        if (t - 1) % self.every:
+            return
+        self._put((t, np.array(state_codes(z), dtype=np.int8))) # the engine reuses its state array
+
+    def _put(self, item):
+        # wait for room in the queue, unless the writer thread has died
+        while True:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if self.error is not None:
+                    raise self.error
+
+    def _work(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                t, codes = item
+                frame = self.raster.render(codes)
+                if self.label:
+                    img = self.Image.fromarray(frame) # 'L', from the 2-D uint8 array
+                    self.ImageDraw.Draw(img).text((8, 8), f'time step {t}', fill=TEXT)
+                    frame = np.asarray(img)
+                self.sink.write(frame)
+                self.frames += 1
+        except Exception as e:
+            self.error = e
+            while self.queue.get() is not None: # unblock close()
+                pass
+
+    def close(self):
+        # This function waits for the queued frames and finishes the file
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.sink.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GraphDrawer():
+    # Opt-in observer that draws the graph at every time step, like drawGz.
+    # The Kamada-Kawai layout is computed once per graph and reused for every frame,
+    # and every frame is drawn on a cleared figure.
+    # For graphs beyond a few thousand nodes, write an animation with AnimationWriter.
+
+    def __init__(self, G, pos=None, show=True):
+        # input  : G is a networkx graph
+        #        : pos, precomputed node positions (computed here when None)
+        #        : show, call plt.show() after each frame
+        self.G    = G
+        self.pos  = pos if pos is not None else nx.kamada_kawai_layout(G)
+        self.show = show
+
+    def observe(self, t, z):
+        # This function draws one frame
+        #
+        # input  : t, time step
+        #        : z, node states, a dict/list of 'S','I','R','V' labels or an int8 code array
+        if not isinstance(z, np.ndarray):
+            z = [z[i] for i in self.G.nodes()]
+        node_colors = np.array(COLORS)[state_codes(z)]
+
+        nsize, flabel = 600, True
+        if self.G.order() > 50:
+            nsize, flabel = 100, False
+
+        plt.clf() # one frame per figure, not every frame drawn over the last
+        nx.draw(self.G, pos=self.pos, with_labels=flabel, node_size=nsize, width=2, node_color=node_colors)
+        plt.axis('off')
+        plt.title(f'time step {t}')
+        if self.show:
+            plt.show()